@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Admin-only HTTP endpoints, mounted by both entrypoints when ADMIN_HTTP_TOKEN
+# is set (otherwise they answer 404). Send the token as
+# "Authorization: Bearer <token>".
+#   GET /admin/profile?seconds=10&mode=sample|cprofile&limit=60
+#       sample: stacks of every thread (event loop, audio and db pools)
+#               sampled every interval_ms, folded "thread;frame;... count"
+#               lines, the format flamegraph tools read
+#       cprofile: deterministic profile of the event-loop thread, pstats
+#               sorted by &sort= (cumulative, tottime, ncalls, ...)
+#   GET /admin/slow?limit=20&kind=voice
+#       slowest recent sampled updates with per-stage timings (tracing.py)
+import asyncio, cProfile, hmac, io, math, os, pstats, sys, threading, time
+from collections import Counter
+
+from aiohttp import web
+
+import tracing
+
+MAX_SECONDS = 120
+
+_busy = False
+
+def _authorized(request) -> bool:
+    # read per request, not at import: entry points import this before .env is loaded
+    token = os.environ.get("ADMIN_HTTP_TOKEN", "")
+    if not token:
+        raise web.HTTPNotFound()
+    auth = request.headers.get("Authorization", "")
+    return auth.startswith("Bearer ") and hmac.compare_digest(auth[7:].encode(), token.encode())
+
+def _params(request) -> tuple:
+    try:
+        seconds = float(request.query.get("seconds", "10"))
+        limit = int(request.query.get("limit", "60"))
+        interval_ms = float(request.query.get("interval_ms", "10"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds, limit and interval_ms must be numbers")
+    if not math.isfinite(seconds) or not math.isfinite(interval_ms):
+        raise web.HTTPBadRequest(text="seconds and interval_ms must be finite")
+    return min(max(seconds, 0.1), MAX_SECONDS), max(1, limit), max(1.0, interval_ms) / 1000.0
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _sample(seconds: float, interval: float) -> tuple:
+    # runs in its own thread; that thread is left out of the samples
+    me = threading.get_ident()
+    counts = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            counts[";".join([names.get(ident, str(ident))] + stack[::-1])] += 1
+        samples += 1
+        time.sleep(interval)
+    return counts, samples
+
+async def handle_profile(request):
+    global _busy
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    seconds, limit, interval = _params(request)
+    mode = request.query.get("mode", "sample")
+    if mode not in ("sample", "cprofile"):
+        raise web.HTTPBadRequest(text="mode must be sample or cprofile")
+    if _busy:
+        raise web.HTTPConflict(text="a profile is already running")
+    _busy = True
+    try:
+        if mode == "cprofile":
+            # the loop keeps serving updates while we sleep; everything it runs is profiled
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                prof.disable()
+            out = io.StringIO()
+            stats = pstats.Stats(prof, stream=out)
+            try:
+                stats.sort_stats(request.query.get("sort", "cumulative"))
+            except KeyError:
+                raise web.HTTPBadRequest(text="unknown sort key")
+            stats.print_stats(limit)
+            body = out.getvalue()
+        else:
+            counts, samples = await asyncio.to_thread(_sample, seconds, interval)
+            lines = [f"# {samples} samples over {seconds:g}s, every {interval * 1000:g} ms"]
+            lines += [f"{stack} {n}" for stack, n in counts.most_common(limit)]
+            body = "\n".join(lines) + "\n"
+    finally:
+        _busy = False
+    return web.Response(text=body)
+
+async def handle_slow(request):
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    try:
+        limit = int(request.query.get("limit", "20"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be a number")
+    return web.json_response({"tracing": tracing.stats(),
+                              "slowest": tracing.slowest(max(1, limit), request.query.get("kind"))})
+
+def add_routes(app: web.Application):
+    app.router.add_get("/admin/profile", handle_profile)
+    app.router.add_get("/admin/slow", handle_slow)
@@ -1,45 +1,91 @@
 # -*- coding: utf-8 -*-
-import os, math
+import os, math, subprocess, tempfile, time
 import numpy as np
-import librosa
-from pydub import AudioSegment
 from pathlib import Path
 
+from features import FeatureExtractor, LogMelExtractor, REF_SR, normalize, lowpass_decimate
+
+# librosa and pydub are imported lazily: the live path (decode_to_array ->
+# classify_array) needs only NumPy and ffmpeg, which keeps cold start short
+
 def ogg_or_m4a_to_wav(src_path: str, dst_path: str, target_sr: int = 32000):
+    from pydub import AudioSegment
     audio = AudioSegment.from_file(src_path)
     audio = audio.set_channels(1).set_frame_rate(target_sr)
     audio.export(dst_path, format="wav")
     return dst_path
 
+FFMPEG = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_TIMEOUT = float(os.environ.get("FFMPEG_TIMEOUT", "20"))
+
+def decode_to_array(data: bytes, target_sr: int = 32000, timeout: float = None) -> np.ndarray:
+    # OGG/Opus/M4A bytes -> mono float32 at target_sr in one ffmpeg pass, no temp files.
+    # timeout covers both passes; ffmpeg is killed when it runs out
+    timeout = timeout or FFMPEG_TIMEOUT
+    deadline = time.monotonic() + timeout
+    cmd = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+           "-f", "f32le", "-ac", "1", "-ar", str(target_sr), "pipe:1"]
+    try:
+        proc = subprocess.run(cmd, input=data, capture_output=True, timeout=timeout)
+        if proc.returncode != 0 or not proc.stdout:
+            # some M4A files keep the moov atom at the end and cannot be demuxed from a pipe
+            with tempfile.NamedTemporaryFile(suffix=".m4a") as f:
+                f.write(data)
+                f.flush()
+                cmd[cmd.index("pipe:0")] = f.name
+                proc = subprocess.run(cmd, capture_output=True, timeout=max(0.1, deadline - time.monotonic()))
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"ffmpeg: no result in {timeout:g}s")
+    if proc.returncode != 0:
+        raise RuntimeError("ffmpeg: " + proc.stderr.decode("utf-8", "replace").strip()[-300:])
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+def resample(y: np.ndarray, sr: int, target_sr: int) -> np.ndarray:
+    if sr == target_sr:
+        return y
+    if sr % target_sr == 0:
+        return lowpass_decimate(y, sr // target_sr)
+    import librosa
+    return librosa.resample(y, orig_sr=sr, target_sr=target_sr)
+
+def _too_short(duration: float):
+    return {"is_fart": False, "score": 0.0, "debug": {"reason": "too_short", "duration": duration}}
+
 class HeuristicFartClassifier:
     def __init__(self, cfg: dict):
         self.lowfreq_ratio_min = float(cfg.get('HEURISTIC_LOWFREQ_RATIO', 1.35))
         self.rolloff_max = float(cfg.get('HEURISTIC_ROLLOFF_MAX', 1600))
         self.zcr_max = float(cfg.get('HEURISTIC_ZCR_MAX', 0.12))
+        # FEATURE_SR < 32000 runs the feature pass on decimated audio (e.g. 8000);
+        # experimental: the thresholds above are tuned at 32 kHz and rolloff/ZCR
+        # drift at lower rates, so verdicts change
+        self.sample_rate = int(cfg.get('FEATURE_SR', REF_SR))
+        self.features = FeatureExtractor(self.sample_rate)
 
     def classify(self, wav_path: str):
-        y, sr = librosa.load(wav_path, sr=32000, mono=True)
-        duration = len(y) / sr
-        if duration < 0.5:
-            return {"is_fart": False, "score": 0.0, "debug": {"reason": "too_short", "duration": duration}}
-        y = librosa.util.normalize(y)
-
-        S = np.abs(np.fft.rfft(y))**2
-        freqs = np.fft.rfftfreq(len(y), 1.0/sr)
-        def band_energy(fmin, fmax):
-            idx = np.where((freqs >= fmin) & (freqs < fmax))[0]
-            if len(idx) == 0:
-                return 0.0
-            return float(S[idx].sum())
-
-        low = band_energy(20, 250)
-        mid = band_energy(250, 2000)
-        low_ratio = (low + 1e-9) / (mid + 1e-9)
-
-        zcr = float(librosa.feature.zero_crossing_rate(y=y, frame_length=1024, hop_length=512).mean())
-        rolloff = float(librosa.feature.spectral_rolloff(y=y, sr=sr, roll_percent=0.85).mean())
-
-        import math
+        import librosa
+        y, sr = librosa.load(wav_path, sr=self.sample_rate, mono=True)
+        return self.classify_array(y, sr)
+
+    def classify_array(self, y: np.ndarray, sr: int = 32000):
+        return self.classify_batch([y], sr)[0]
+
+    def classify_batch(self, clips, sr: int = 32000):
+        results = [None] * len(clips)
+        ready, idxs = [], []
+        for i, y in enumerate(clips):
+            duration = len(y) / sr
+            if duration < 0.5:
+                results[i] = _too_short(duration)
+                continue
+            ready.append(normalize(resample(y, sr, self.sample_rate)))
+            idxs.append(i)
+        if ready:
+            for i, f in zip(idxs, self.features.extract_batch(ready)):
+                results[i] = self._score(f["low_ratio"], f["zcr"], f["rolloff"])
+        return results
+
+    def _score(self, low_ratio: float, zcr: float, rolloff: float):
         p_low = 1 / (1 + math.exp(-6*(low_ratio - self.lowfreq_ratio_min)))
         p_roll = 1 / (1 + math.exp(-0.004*(self.rolloff_max - rolloff)))
         p_zcr = 1 / (1 + math.exp(-50*(self.zcr_max - zcr)))
@@ -56,11 +102,98 @@ class HeuristicFartClassifier:
             }
         }
 
+class ModelFartClassifier:
+    # logistic regression or a one-hidden-layer MLP over log-mel statistics,
+    # trained offline by train_model.py and stored as a small .npz; inference
+    # is a few matrix products, no librosa
+    def __init__(self, cfg: dict):
+        self.path = cfg.get('MODEL_PATH', './models/fart.npz')
+        with np.load(self.path, allow_pickle=False) as m:
+            if int(m["format"]) != 1:
+                raise ValueError(f"{self.path}: unsupported model format {int(m['format'])}")
+            self.sample_rate = int(m["sr"])
+            self.features = LogMelExtractor(self.sample_rate, int(m["n_mels"]), float(m["fmin"]), float(m["fmax"]))
+            self.mu = m["mu"].astype(np.float32)
+            self.inv_sigma = (1.0 / m["sigma"]).astype(np.float32)
+            self.w1 = m["w1"].astype(np.float32) if "w1" in m else None
+            self.b1 = m["b1"].astype(np.float32) if "b1" in m else None
+            self.w = m["w"].astype(np.float32)
+            self.b = float(m["b"])
+            self.threshold = float(cfg.get('MODEL_THRESHOLD') or m["threshold"])
+        # analysing at most this much audio keeps the per-clip cost bounded
+        self.max_seconds = float(cfg.get('MODEL_MAX_SECONDS') or cfg.get('MAX_VOICE_SECONDS', 12))
+        self.budget_ms = float(cfg.get('MODEL_BUDGET_MS', 50))
+
+    def classify_batch(self, clips, sr: int = 32000):
+        results = [None] * len(clips)
+        ready, idxs = [], []
+        limit = int(self.max_seconds * sr)
+        for i, y in enumerate(clips):
+            duration = len(y) / sr
+            if duration < 0.5:
+                results[i] = _too_short(duration)
+                continue
+            ready.append(normalize(resample(y[:limit], sr, self.sample_rate)))
+            idxs.append(i)
+        if ready:
+            for i, p in zip(idxs, self.predict(self.features.extract_batch(ready))):
+                results[i] = {"is_fart": bool(p >= self.threshold), "score": float(p),
+                              "debug": {"model": os.path.basename(self.path)}}
+        return results
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        h = (x - self.mu) * self.inv_sigma
+        if self.w1 is not None:
+            h = np.maximum(h @ self.w1 + self.b1, 0.0)
+        return 1.0 / (1.0 + np.exp(-(h @ self.w + self.b)))
+
+def model_sample_rate(cfg: dict):
+    # rate the model's features were trained at, so audio can be decoded straight to it
+    try:
+        with np.load(cfg.get('MODEL_PATH', './models/fart.npz'), allow_pickle=False) as m:
+            return int(m["sr"])
+    except (OSError, KeyError, ValueError):
+        return None
+
 class FartClassifier:
     def __init__(self, mode: str = "heuristic", cfg: dict = None):
         self.mode = mode or "heuristic"
         self.cfg = cfg or {}
         self.heur = HeuristicFartClassifier(self.cfg)
+        self.impl = self.heur
+        if self.mode == "model":
+            try:
+                self.impl = ModelFartClassifier(self.cfg)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Model not loaded ({e!r}); falling back to the heuristic classifier")
 
     def classify(self, wav_path: str):
-        return self.heur.classify(wav_path)
+        import librosa
+        y, sr = librosa.load(wav_path, sr=self.sample_rate, mono=True)
+        return self.classify_array(y, sr)
+
+    def classify_array(self, y: np.ndarray, sr: int = 32000):
+        return self.impl.classify_batch([y], sr)[0]
+
+    def classify_batch(self, clips, sr: int = 32000):
+        return self.impl.classify_batch(clips, sr)
+
+    @property
+    def sample_rate(self) -> int:
+        return self.impl.sample_rate
+
+    def warm_up(self):
+        # one pass over a short synthetic clip: builds the FFT plans and band slices
+        t = np.arange(self.sample_rate) / self.sample_rate
+        y = (np.sin(2 * np.pi * 90 * t) + 0.05 * np.sin(2 * np.pi * 1500 * t)).astype(np.float32)
+        res = self.classify_batch([y, y[: self.sample_rate // 2 + 1]], self.sample_rate)
+        if self.impl is not self.heur:
+            # the longest clip the model will ever analyse, against MODEL_BUDGET_MS
+            longest = np.resize(y, int(self.impl.max_seconds * self.sample_rate))
+            t0 = time.perf_counter()
+            self.classify_array(longest, self.sample_rate)
+            ms = (time.perf_counter() - t0) * 1000
+            if ms > self.impl.budget_ms:
+                print(f"Model inference took {ms:.1f} ms for a {self.impl.max_seconds:g} s clip "
+                      f"(budget {self.impl.budget_ms:g} ms)")
+        return res
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# Runs audio decode + classification off the event loop.
+# AUDIO_EXECUTOR: inline | thread | process (default thread)
+import asyncio, os, time
+import concurrent.futures as cf
+import multiprocessing as mp
+
+import metrics
+
+_executor = None
+_mode = "thread"
+_timeout = 30.0
+_classifier = None
+_init_args = ("heuristic", {})
+_batcher = None
+_sample_rate = 32000
+_start_task = None
+_rebuild_lock = None
+_ready = False  # a warmed pool is up; cleared while it is shut down or rebuilt
+
+def _init_worker(clf_mode, cfg):
+    # runs once per worker process (or once in-process for inline/thread):
+    # imports, classifier construction and a warm-up run on a synthetic clip
+    # are paid here, not on the first voice note
+    global _classifier
+    from audio_classifier import FartClassifier
+    _classifier = FartClassifier(mode=clf_mode, cfg=cfg)
+    _classifier.warm_up()
+
+def _ping():
+    return os.getpid()
+
+def decode_and_classify(data: bytes, target_sr: int = 32000):
+    from audio_classifier import decode_to_array
+    if _classifier is None:
+        _init_worker(*_init_args)
+    y = decode_to_array(data, target_sr=target_sr)
+    return _classifier.classify_array(y, target_sr)
+
+def _decode_and_classify_timed(data: bytes, target_sr: int = 32000, with_fp: bool = False):
+    # same as decode_and_classify, plus per-stage seconds measured in the worker;
+    # the fingerprint counts as decoding
+    from audio_classifier import decode_to_array
+    if _classifier is None:
+        _init_worker(*_init_args)
+    t0 = time.perf_counter()
+    y = decode_to_array(data, target_sr=target_sr)
+    fp = _fingerprint(y, target_sr) if with_fp else None
+    t1 = time.perf_counter()
+    res = _classifier.classify_array(y, target_sr)
+    if fp is not None:
+        res["fp"] = fp
+    return res, t1 - t0, time.perf_counter() - t1
+
+def decode(data: bytes, target_sr: int = 32000):
+    from audio_classifier import decode_to_array
+    return decode_to_array(data, target_sr=target_sr)
+
+def _fingerprint(y, sr: int):
+    # hex, so it survives the result cache's JSON; None for silence
+    from features import fingerprint
+    fp = fingerprint(y, sr)
+    return fp.hex() if fp is not None else None
+
+def decode_fingerprinted(data: bytes, target_sr: int = 32000):
+    y = decode(data, target_sr)
+    return y, _fingerprint(y, target_sr)
+
+def classify_batch(clips, sr: int = 32000):
+    if _classifier is None:
+        _init_worker(*_init_args)
+    return _classifier.classify_batch(clips, sr)
+
+class MicroBatcher:
+    # gathers decoded clips for up to window_ms (or max_batch clips) and classifies
+    # them with one vectorized classify_batch job on the executor
+    def __init__(self, max_batch: int = 8, window_ms: float = 5.0):
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self._pending = []
+        self._timer = None
+
+    async def classify(self, y):
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((y, fut))
+        if len(self._pending) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._dispatch)
+        return await fut
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            results = await run(classify_batch, [y for y, _ in batch], _sample_rate)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
+
+async def analyse(data: bytes, precheck=None):
+    # downloaded bytes -> classifier result; batched across concurrent voice notes.
+    # With precheck (fingerprints.checker) the result carries the clip's
+    # fingerprint as "fp", and a verdict precheck returns for it replaces the
+    # classifier's. Without the batcher decode and classify are one job, so
+    # there the check can only come after the classifier.
+    if _batcher is None:
+        res, decode_s, classify_s = await run(_decode_and_classify_timed, data, _sample_rate, precheck is not None)
+        metrics.STAGE_SECONDS.observe(decode_s, "decode")
+        metrics.STAGE_SECONDS.observe(classify_s, "classify")
+        return (precheck(res.get("fp")) if precheck is not None else None) or res
+    fp = None
+    with metrics.STAGE_SECONDS.time("decode"):
+        if precheck is None:
+            y = await run(decode, data, _sample_rate)
+        else:
+            y, fp = await run(decode_fingerprinted, data, _sample_rate)
+    if precheck is not None:
+        short = precheck(fp)
+        if short is not None:
+            return short
+    with metrics.STAGE_SECONDS.time("classify"):
+        res = await _batcher.classify(y)
+    if fp is not None:
+        res["fp"] = fp
+    return res
+
+def start_pool(clf_mode: str = "heuristic", cfg: dict = None):
+    global _executor, _mode, _timeout, _init_args, _batcher, _sample_rate, _ready
+    if _executor is not None:
+        return
+    cfg = dict(cfg or os.environ)
+    _mode = (cfg.get("AUDIO_EXECUTOR") or "thread").lower()
+    _timeout = float(cfg.get("AUDIO_JOB_TIMEOUT", "30"))
+    _sample_rate = int(cfg.get("FEATURE_SR", "32000"))
+    if clf_mode == "model":
+        from audio_classifier import model_sample_rate
+        _sample_rate = model_sample_rate(cfg) or _sample_rate
+    batch_max = int(cfg.get("CLASSIFY_BATCH_MAX", "8"))
+    _batcher = MicroBatcher(batch_max, float(cfg.get("CLASSIFY_BATCH_MS", "5"))) if batch_max > 1 else None
+    workers = int(cfg.get("AUDIO_WORKERS") or 0) or min(4, os.cpu_count() or 1)
+    _init_args = (clf_mode, cfg)
+    if _mode == "process":
+        _executor = cf.ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                                           initializer=_init_worker, initargs=_init_args)
+        # make every worker spawn and warm up now, not on the first voice note
+        try:
+            for f in [_executor.submit(_ping) for _ in range(workers)]:
+                f.result()
+        except BaseException:
+            ex, _executor = _executor, None
+            ex.shutdown(wait=False, cancel_futures=True)
+            raise
+    else:
+        _init_worker(*_init_args)
+        if _mode == "thread":
+            _executor = cf.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audio")
+    print(f"Audio executor: {_mode} x{workers if _executor else 1}, timeout {_timeout:g}s")
+    _ready = True
+
+def start(clf_mode: str = "heuristic", cfg: dict = None):
+    # non-blocking variant for startup hooks: the pool is built and warmed in a
+    # thread while the HTTP server binds; jobs submitted meanwhile wait for it.
+    # Returns the task, so callers may await it if they do want to block.
+    global _start_task
+    if _start_task is None:
+        t0 = time.perf_counter()
+        def report(task):
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                print("Audio executor failed to start:", task.exception())
+            else:
+                print(f"Classifier warm in {time.perf_counter() - t0:.2f}s")
+        _start_task = asyncio.ensure_future(asyncio.to_thread(start_pool, clf_mode, cfg))
+        _start_task.add_done_callback(report)
+    return _start_task
+
+def is_ready() -> bool:
+    # follows the current pool, so it recovers after a crash rebuild
+    return _ready
+
+def shutdown_pool():
+    global _executor, _start_task, _ready
+    _ready = False
+    _start_task = None
+    ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=True, cancel_futures=True)
+
+def _pool_lock():
+    global _rebuild_lock
+    if _rebuild_lock is None:
+        _rebuild_lock = asyncio.Lock()
+    return _rebuild_lock
+
+async def _rebuild(broken, kill: bool = False):
+    # a dead worker fails every job in flight on the pool; the first of them
+    # rebuilds it, the others find it already replaced. Shutting down and
+    # spawning + warming the new workers happens in a thread, off the loop.
+    async with _pool_lock():
+        if _executor is broken:
+            await asyncio.to_thread(_restart_pool, kill)
+
+def _restart_pool(kill: bool = False):
+    if kill:
+        # a worker is stuck in a job: shutdown() would wait for it forever
+        for p in list((getattr(_executor, "_processes", None) or {}).values()):
+            p.terminate()
+    shutdown_pool()
+    start_pool(*_init_args)
+
+async def _ensure_pool():
+    # run() before start(), or after the background start failed: build the
+    # pool in a thread, one caller at a time. If that fails too, fall back to a
+    # single in-process thread, once, so voice notes neither block the loop nor
+    # each retry a pool that cannot start.
+    global _executor, _mode, _ready
+    async with _pool_lock():
+        if _executor is not None or _mode == "inline":
+            return
+        try:
+            await asyncio.to_thread(start_pool, *_init_args)
+        except Exception as e:
+            print("Audio executor failed to start; falling back to one in-process thread:", repr(e))
+            _mode = "thread"
+            _executor = cf.ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio")
+            _ready = True
+
+async def run(fn, *args):
+    if _start_task is not None and not _start_task.done():
+        await asyncio.shield(_start_task)
+    if _rebuild_lock is not None and _rebuild_lock.locked():
+        # a rebuild is under way: wait for the new pool instead of starting one here
+        async with _rebuild_lock:
+            pass
+    if _executor is None and _mode != "inline":
+        await _ensure_pool()
+    if _executor is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    ex = _executor
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(ex, fn, *args), timeout=_timeout)
+    except asyncio.TimeoutError:
+        if _mode == "process":
+            # the worker is still busy with the abandoned job; replace it. A
+            # thread cannot be stopped, but ffmpeg has its own timeout there.
+            await _rebuild(ex, kill=True)
+        raise TimeoutError(f"audio job exceeded {_timeout:g}s")
+    except cf.BrokenExecutor:
+        # a worker died (OOM, segfault in native code); rebuild the pool for the next job
+        await _rebuild(ex)
+        raise
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Offline benchmarks: python -m bench [audio|db|all] --out results.json
+#                     python -m bench shard --workers 1,2,4
+#                     python -m bench snapshot --sizes 1m
+#                     python -m bench compare old.json new.json --threshold 0.15
+import argparse, datetime, json, os, platform, sqlite3, subprocess, sys
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+def _meta() -> dict:
+    import numpy as np
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        rev = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": rev or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+def _key(case: dict) -> str:
+    skip = {"n", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "min_ms", "max_ms", "throughput_per_s", "error"}
+    return "|".join(f"{k}={case[k]}" for k in sorted(case) if k not in skip)
+
+def _cases(result: dict):
+    for section in ("audio", "db"):
+        part = result.get(section) or {}
+        for case in part.get("cases", []):
+            yield f"{section}|{_key(case)}", case
+        for size in part.get("sizes", []):
+            for case in size["cases"]:
+                yield f"{section}|{_key(case)}", case
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    # p50 regressions above threshold (0.15 = 15% slower)
+    before = dict(_cases(old))
+    rows = []
+    for key, case in _cases(new):
+        prev = before.get(key)
+        if not prev or "p50_ms" not in prev or "p50_ms" not in case or not prev["p50_ms"]:
+            continue
+        ratio = case["p50_ms"] / prev["p50_ms"] - 1
+        rows.append({"case": key, "old_p50_ms": prev["p50_ms"], "new_p50_ms": case["p50_ms"],
+                     "change": ratio, "regression": ratio > threshold})
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench")
+    ap.add_argument("what", nargs="?", default="all", choices=["audio", "db", "shard", "snapshot", "all", "compare"])
+    ap.add_argument("files", nargs="*", help="compare: old.json new.json")
+    ap.add_argument("--out", help="write JSON here (default: stdout)")
+    ap.add_argument("--sizes", default="10k,1m", help="db sizes: 10k,100k,1m,10m")
+    ap.add_argument("--repeat", type=int, default=0, help="iterations per case (default 10 audio / 200 db)")
+    ap.add_argument("--workers", default="1,2,4", help="shard: worker counts to compare")
+    ap.add_argument("--jobs", type=int, default=200, help="shard: voice updates per run")
+    ap.add_argument("--workdir", help="where seeded databases are kept")
+    ap.add_argument("--threshold", type=float, default=0.15)
+    args = ap.parse_args(argv)
+
+    if args.what == "compare":
+        if len(args.files) != 2:
+            ap.error("compare needs old.json new.json")
+        old, new = (json.load(open(p, encoding="utf-8")) for p in args.files)
+        rows = compare(old, new, args.threshold)
+        for r in rows:
+            mark = "REGRESSION" if r["regression"] else "ok"
+            print(f"{mark:10} {r['change']:+7.1%}  {r['old_p50_ms']:9.3f} -> {r['new_p50_ms']:9.3f} ms  {r['case']}")
+        return 1 if any(r["regression"] for r in rows) else 0
+
+    # benchmarks must not touch the real database or the network
+    os.environ.setdefault("WRITE_BEHIND", "0")
+    result = {"meta": _meta()}
+    if args.what in ("audio", "all"):
+        from bench import audio_bench
+        result["audio"] = audio_bench.run(repeat=args.repeat or 10)
+    if args.what in ("db", "all"):
+        from bench import db_bench
+        sizes = [SIZES[s.strip().lower()] for s in args.sizes.split(",") if s.strip()]
+        result["db"] = db_bench.run(sizes, workdir=args.workdir, repeat=args.repeat or 200)
+    if args.what == "shard":
+        from bench import shard_bench
+        result["shard"] = shard_bench.run([int(w) for w in args.workers.split(",")], jobs=args.jobs)
+    if args.what == "snapshot":
+        from bench import snapshot_bench
+        sizes = [SIZES[s.strip().lower()] for s in args.sizes.split(",") if s.strip()]
+        result["snapshot"] = snapshot_bench.run(sizes, workdir=args.workdir)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    bad = [s["events"] for s in (result.get("db") or {}).get("sizes", []) if s["leaderboard"]["mismatches"]]
+    if bad:
+        print(f"FAIL: in-memory leaderboard differs from SQLite at sizes {bad}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
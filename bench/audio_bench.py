@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Decode and classification latency/throughput on synthetic 1-12 s clips.
+import os, tempfile
+
+from bench.clips import clip_set, ogg_bytes, wav_bytes
+from bench.timing import measure
+
+def run(repeat: int = 10, durations=(1, 3, 6, 12)) -> dict:
+    from audio_classifier import FartClassifier, decode_to_array, ogg_or_m4a_to_wav
+
+    clf = FartClassifier(cfg=dict(os.environ))
+    clf.warm_up()
+    sr = clf.sample_rate
+    clips = clip_set(durations, sr)
+    out = {"sample_rate": sr, "cases": []}
+
+    def case(name, fn, **meta):
+        try:
+            res = measure(fn, repeat=repeat)
+        except Exception as e:  # e.g. no ffmpeg/ffprobe on this machine
+            res = {"error": f"{type(e).__name__}: {e}"}
+        res.update(name=name, **meta)
+        out["cases"].append(res)
+
+    with tempfile.TemporaryDirectory() as td:
+        for kind, dur, y in clips:
+            meta = {"kind": kind, "seconds": dur}
+            try:
+                ogg = ogg_bytes(y, sr)
+            except Exception:
+                ogg = None
+            src = os.path.join(td, f"{kind}-{dur}.ogg" if ogg else f"{kind}-{dur}.wav")
+            with open(src, "wb") as f:
+                f.write(ogg or wav_bytes(y, sr))
+            dst = os.path.join(td, f"{kind}-{dur}.out.wav")
+            data = ogg or wav_bytes(y, sr)
+            case("ogg_or_m4a_to_wav", lambda: ogg_or_m4a_to_wav(src, dst, target_sr=sr), **meta)
+            case("decode_to_array", lambda: decode_to_array(data, target_sr=sr), **meta)
+            case("classify_array", lambda: clf.classify_array(y, sr), **meta)
+            if os.path.exists(dst):
+                case("classify(wav_path)", lambda: clf.classify(dst), **meta)
+
+    for batch in (1, 4, 8, 16):
+        ys = [y for _, _, y in clips][:batch]
+        res = measure(lambda: clf.classify_batch(ys, sr), repeat=repeat, items=len(ys))
+        res.update(name="classify_batch", batch=len(ys))
+        out["cases"].append(res)
+    return out
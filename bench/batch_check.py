@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Parity of the vectorized heuristic (classify_batch) with the per-clip scoring
+# it replaced, on synthetic clips, no network:
+#   python -m bench.batch_check [--tolerance 1e-4] [--batch 8]
+# Reference: the original librosa path (full-signal band ratio,
+# librosa zero_crossing_rate and spectral_rolloff). Every clip's score from
+# classify_array and from classify_batch over mixed-length batches must be
+# within --tolerance of it with the same verdict, and the batch must give the
+# same scores as the clips one by one. Exits non-zero otherwise.
+import argparse, json, sys
+import numpy as np
+
+from audio_classifier import HeuristicFartClassifier
+from features import REF_SR
+from bench.clips import clip_set, make_clip
+
+def reference(clf: HeuristicFartClassifier, y: np.ndarray, sr: int = REF_SR) -> dict:
+    import librosa
+    y = librosa.util.normalize(y)
+    S = np.abs(np.fft.rfft(y)) ** 2
+    freqs = np.fft.rfftfreq(len(y), 1.0 / sr)
+    low = float(S[(freqs >= 20) & (freqs < 250)].sum())
+    mid = float(S[(freqs >= 250) & (freqs < 2000)].sum())
+    zcr = float(librosa.feature.zero_crossing_rate(y=y, frame_length=1024, hop_length=512).mean())
+    rolloff = float(librosa.feature.spectral_rolloff(y=y, sr=sr, roll_percent=0.85).mean())
+    return clf._score((low + 1e-9) / (mid + 1e-9), zcr, rolloff)
+
+def clips() -> list:
+    # the benchmark set plus odd lengths, so batches mix FFT length buckets
+    out = [y for _, _, y in clip_set()]
+    odd = [(k, d) for k in ("hum", "farts", "burst", "noise") for d in (0.7, 2.37, 5.5, 11.9)]
+    return out + [make_clip(k, d, REF_SR, seed=50 + i) for i, (k, d) in enumerate(odd)]
+
+def _diff(a: list, b: list) -> dict:
+    d = [abs(x["score"] - y["score"]) for x, y in zip(a, b)]
+    return {"max": max(d), "mean": float(np.mean(d)), "flips": sum(x["is_fart"] != y["is_fart"] for x, y in zip(a, b))}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.batch_check")
+    ap.add_argument("--tolerance", type=float, default=1e-4)
+    ap.add_argument("--batch", type=int, default=8)
+    args = ap.parse_args(argv)
+    clf = HeuristicFartClassifier({})
+    ys = clips()
+    ref = [reference(clf, y) for y in ys]
+    single = [clf.classify_array(y) for y in ys]
+    # shuffled so every batch mixes lengths and kinds
+    order = np.random.default_rng(0).permutation(len(ys))
+    batched = [None] * len(ys)
+    for i in range(0, len(ys), args.batch):
+        idx = order[i:i + args.batch]
+        for j, res in zip(idx, clf.classify_batch([ys[j] for j in idx])):
+            batched[j] = res
+    report = {"clips": len(ys), "tolerance": args.tolerance,
+              "single_vs_reference": _diff(single, ref),
+              "batch_vs_reference": _diff(batched, ref),
+              "batch_vs_single": _diff(batched, single)}
+    print(json.dumps(report, indent=2))
+    ok = all(r["max"] <= args.tolerance and r["flips"] == 0
+             for k, r in report.items() if isinstance(r, dict))
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
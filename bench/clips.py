@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Deterministic synthetic clips for the benchmarks: white noise, tones and
+# low-frequency bursts (the kind of signal the heuristic is looking for).
+# "hum" (steady mains/engine-like low tone) is not in KINDS; it is a negative
+# the heuristic tends to accept, used by bench/model_check.py. "farts" (1-4
+# bursts at random times, with vibrato and noise) gives distinct clips of one
+# kind for bench/fingerprint_check.py.
+import io, shutil, subprocess, wave
+import numpy as np
+
+KINDS = ("noise", "tone", "burst")
+
+def make_clip(kind: str, seconds: float, sr: int = 32000, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    if kind == "noise":
+        y = 0.3 * rng.standard_normal(n)
+    elif kind == "tone":
+        y = 0.5 * np.sin(2 * np.pi * rng.uniform(200, 3000) * t)
+    elif kind == "burst":
+        f0 = rng.uniform(40, 120)
+        env = np.exp(-((t % 1.0) - 0.3) ** 2 * 30)
+        y = np.sin(2 * np.pi * f0 * t) * env + 0.02 * rng.standard_normal(n)
+    elif kind == "hum":
+        f0 = rng.uniform(50, 120)
+        y = 0.5 * np.sin(2 * np.pi * f0 * t) + 0.2 * np.sin(4 * np.pi * f0 * t) + 0.02 * rng.standard_normal(n)
+    elif kind == "farts":
+        y = 0.005 * rng.standard_normal(n)
+        for _ in range(rng.integers(1, 5)):
+            start, decay, f0 = rng.uniform(0, max(0.1, seconds - 0.5)), rng.uniform(0.2, 1.5), rng.uniform(40, 200)
+            env = np.clip((t - start) / 0.05, 0, 1) * np.exp(-np.clip(t - start, 0, None) / decay) * (t >= start)
+            am = 1 + 0.5 * np.sin(2 * np.pi * rng.uniform(5, 30) * t)
+            phase = 2 * np.pi * f0 * t + rng.uniform(0, 6) + 15 * np.cumsum(rng.standard_normal(n)) / sr
+            y += env * am * (np.sin(phase) + 0.3 * rng.standard_normal(n)) * rng.uniform(0.3, 1)
+    else:
+        raise ValueError(kind)
+    return y.astype(np.float32)
+
+def clip_set(durations=(1, 3, 6, 12), sr: int = 32000):
+    return [(kind, d, make_clip(kind, d, sr, seed=i)) for i, (kind, d) in
+            enumerate((k, d) for d in durations for k in KINDS)]
+
+def wav_bytes(y: np.ndarray, sr: int = 32000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((np.clip(y, -1, 1) * 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+def ogg_bytes(y: np.ndarray, sr: int = 32000) -> bytes:
+    # Opus in OGG like a Telegram voice note; needs a local ffmpeg (no network)
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg not found")
+    proc = subprocess.run(["ffmpeg", "-nostdin", "-loglevel", "error", "-f", "wav", "-i", "pipe:0",
+                           "-c:a", "libopus", "-b:a", "32k", "-f", "ogg", "pipe:1"],
+                          input=wav_bytes(y, sr), capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "replace")[-300:])
+    return proc.stdout
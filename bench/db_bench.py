@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# db.py latency against seeded databases (10k / 1M / 10M events).
+# Seeded files are kept in the work dir and reused by later runs.
+# Afterwards every chat's in-memory leaderboard is checked against stats and
+# daily_totals (db.verify_leaderboard); `python -m bench db` exits 1 on a mismatch.
+import os, random, sqlite3, time, types
+
+import numpy as np
+
+import db
+from bench.timing import measure
+
+CHATS = 50
+USERS_PER_CHAT = 40
+HISTORY_DAYS = 365
+
+def seed(path: str, n_events: int, rng_seed: int = 0) -> float:
+    # bulk-loads events directly, then derives users/stats/daily_totals with SQL
+    if os.path.exists(path):
+        with sqlite3.connect(path) as conn:
+            try:
+                if conn.execute("SELECT n FROM bench_meta").fetchone()[0] == n_events:
+                    return 0.0
+            except sqlite3.Error:
+                pass
+        os.remove(path)
+    t0 = time.perf_counter()
+    db.set_db_path(path)
+    db.init_db()
+    db.close_db()
+    rng = np.random.default_rng(rng_seed)
+    now = int(time.time())
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("DROP INDEX IF EXISTS idx_events_chat_kind_ts")
+    chunk = 500_000
+    for start in range(0, n_events, chunk):
+        k = min(chunk, n_events - start)
+        chats = rng.integers(1, CHATS + 1, k)
+        users = rng.integers(1, USERS_PER_CHAT + 1, k) + chats * 1000
+        ts = now - rng.integers(0, HISTORY_DAYS * 86400, k)
+        conn.executemany("INSERT INTO events(chat_id,user_id,kind,amount,ts,file_id) VALUES(?,?,'fart',1,?,NULL)",
+                         zip(chats.tolist(), users.tolist(), ts.tolist()))
+        conn.commit()
+    conn.executescript(f"""
+        CREATE INDEX IF NOT EXISTS idx_events_chat_kind_ts ON events(chat_id, kind, ts, user_id, amount);
+        INSERT OR IGNORE INTO users(chat_id, user_id, username, first_name, last_name, created_at)
+            SELECT DISTINCT chat_id, user_id, 'user' || user_id, NULL, NULL, {now} FROM events;
+        INSERT OR REPLACE INTO stats(chat_id, user_id, farts_count, whips_count, updated_at)
+            SELECT chat_id, user_id, SUM(amount), 0, {now} FROM events GROUP BY chat_id, user_id;
+        DELETE FROM daily_totals;
+        INSERT INTO daily_totals(chat_id, user_id, day, farts)
+            SELECT chat_id, user_id, ts / 86400, SUM(amount) FROM events GROUP BY chat_id, user_id, ts / 86400;
+        CREATE TABLE IF NOT EXISTS bench_meta(n INTEGER);
+        DELETE FROM bench_meta;
+        INSERT INTO bench_meta VALUES ({n_events});
+        ANALYZE;
+    """)
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - t0
+
+def _user(rng):
+    chat = rng.randint(1, CHATS)
+    uid = chat * 1000 + rng.randint(1, USERS_PER_CHAT)
+    return chat, types.SimpleNamespace(id=uid, username=f"user{uid}", first_name=None, last_name=None)
+
+def check_leaderboards(rng, writes: int = 2000) -> list:
+    # loads every board, writes through each path that updates one, then
+    # compares; returns (chat, mismatch) pairs, empty when consistent
+    if db._boards is None:
+        return []
+    for chat in range(1, CHATS + 1):
+        db.get_top(chat, days=7)
+    for _ in range(writes):
+        chat, user = _user(rng)
+        r = rng.random()
+        if r < 0.4:
+            db.record_detection(chat, user, file_id="check")
+        elif r < 0.7:
+            db.add_event(chat, user.id, 'fart', rng.randint(1, 3), None)
+        elif r < 0.9:
+            db.inc_dec_stat(chat, user.id, 'farts_count', rng.choice((-1, 1)))
+        else:
+            # a new member: stats row at 0
+            db.ensure_user(chat, types.SimpleNamespace(id=chat * 1000 + USERS_PER_CHAT + rng.randint(1, 20),
+                                                       username=None, first_name=None, last_name=None))
+    return [(chat, p) for chat in range(1, CHATS + 1) for p in db.verify_leaderboard(chat)]
+
+def run_size(path: str, n_events: int, repeat: int = 200) -> dict:
+    seed_s = seed(path, n_events)
+    db.set_db_path(path)
+    db.init_db()
+    size_mb = os.path.getsize(path) / 1e6
+    rng = random.Random(1)
+    cases = []
+
+    def case(name, fn, **meta):
+        res = measure(fn, repeat=repeat, warmup=3)
+        res.update(name=name, events=n_events, **meta)
+        cases.append(res)
+
+    boards = db._boards
+    try:
+        db._boards = None  # SQL path only
+        for days in (7, 30, 0):
+            case("get_top", lambda: db.get_top(rng.randint(1, CHATS), days=days), days=days, cache=False)
+    finally:
+        db._boards = boards
+    if boards is not None:
+        for days in (7, 30, 0):
+            boards.clear()
+            case("get_top", lambda: db.get_top(rng.randint(1, CHATS), days=days), days=days, cache=True)
+    case("get_stats", lambda: db.get_stats(*((lambda c, u: (c, u.id))(*_user(rng)))))
+    case("get_usernames", lambda: db.get_usernames(*((lambda c, u: (c, [u.id]))(*_user(rng)))))
+    # what /top renders: ten members of one chat
+    case("get_usernames", lambda: (lambda c: db.get_usernames(c, [c * 1000 + i for i in range(1, 11)]))(rng.randint(1, CHATS)),
+         users=10)
+    # a member who already spoke, names unchanged (/stats, every voice note)
+    case("ensure_user", lambda: db.ensure_user(*_user(rng)))
+    case("add_event", lambda: db.add_event(*((lambda c, u: (c, u.id))(*_user(rng))), 'fart', 1, None))
+    case("record_detection", lambda: db.record_detection(*_user(rng), file_id="bench"))
+    problems = check_leaderboards(rng)
+    db.close_db()
+    return {"events": n_events, "seed_s": seed_s, "db_mb": size_mb, "cases": cases,
+            "leaderboard": {"checked": db._boards is not None, "mismatches": len(problems),
+                            "first": [str(p)[:300] for p in problems[:3]]}}
+
+def run(sizes=(10_000, 1_000_000), workdir: str = None, repeat: int = 200) -> dict:
+    workdir = workdir or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+    os.makedirs(workdir, exist_ok=True)
+    return {"sizes": [run_size(os.path.join(workdir, f"seed-{n}.sqlite3"), n, repeat) for n in sizes]}
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Checks downloads.py against the local fake Bot API (no network):
+#   python -m bench.download_check
+# Prints one line per case and exits non-zero if any case fails.
+import asyncio, os, sys, time, types
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import downloads
+from bench.fake_bot_api import FakeBotAPI
+
+TOKEN = "123456:TEST"
+
+def _media(file_id, size=None):
+    return types.SimpleNamespace(file_id=file_id, file_size=size)
+
+async def _with_api(fn, **api_kw):
+    api = FakeBotAPI(**api_kw)
+    base = await api.start()
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    try:
+        return await fn(api, bot)
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+async def case_ok(api, bot):
+    data = os.urandom(150_000)
+    api.add_file("ok", data)
+    got = await downloads.fetch(bot, _media("ok", len(data)), "voice")
+    methods = [m for m, _, _ in api.calls]
+    assert got == data, "content differs"
+    assert methods == ["getFile"], methods
+    return f"{len(got)} bytes, API calls {methods}"
+
+async def case_advertised_too_large(api, bot):
+    cap = downloads.byte_cap("voice")
+    try:
+        await downloads.fetch(bot, _media("big", cap + 1), "voice")
+    except downloads.TooLarge:
+        assert not api.calls, api.calls
+        return f"rejected before any request (cap {cap})"
+    raise AssertionError("not rejected")
+
+async def case_getfile_too_large(api, bot):
+    cap = downloads.byte_cap("voice")
+    api.add_file("big", b"\0" * (cap + 1))
+    try:
+        await downloads.fetch(bot, _media("big"), "voice")
+    except downloads.TooLarge:
+        assert api.downloads == 0, api.downloads
+        return "rejected from getFile file_size, nothing downloaded"
+    raise AssertionError("not rejected")
+
+async def case_stream_cap(api, bot):
+    cap = downloads.byte_cap("voice")
+    total = 20 * cap
+    api.add_file("huge", b"\0" * total)
+    try:
+        await downloads.fetch(bot, _media("huge"), "voice")
+    except downloads.TooLarge:
+        await asyncio.sleep(0.2)
+        assert api.bytes_sent < total // 2, (api.bytes_sent, total)
+        return f"aborted after ~{api.bytes_sent} of {total} bytes sent"
+    raise AssertionError("not rejected")
+
+async def case_concurrency(api, bot):
+    limit = downloads._sem._value
+    for i in range(limit * 3):
+        api.add_file(f"c{i}", os.urandom(64 * 1024))
+    t0 = time.perf_counter()
+    await asyncio.gather(*[downloads.fetch(bot, _media(f"c{i}"), "voice") for i in range(limit * 3)])
+    assert api.max_active <= limit, (api.max_active, limit)
+    return f"{limit * 3} downloads, at most {api.max_active} at once (limit {limit}), {time.perf_counter() - t0:.2f}s"
+
+async def case_missing(api, bot):
+    try:
+        await downloads.fetch(bot, _media("nope"), "voice")
+    except downloads.TooLarge:
+        raise AssertionError("wrong error")
+    except Exception as e:
+        return f"{type(e).__name__}"
+    raise AssertionError("no error")
+
+CASES = [
+    (case_ok, {}),
+    (case_advertised_too_large, {}),
+    (case_getfile_too_large, {}),
+    (case_stream_cap, {"send_length": False, "chunk_delay": 0.001}),
+    (case_concurrency, {"chunk_delay": 0.005}),
+    (case_missing, {}),
+]
+
+async def main() -> int:
+    failed = 0
+    for fn, kw in CASES:
+        try:
+            note = await _with_api(fn, **kw)
+            print(f"PASS {fn.__name__}: {note}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {fn.__name__}: {type(e).__name__}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Local stand-in for the Telegram Bot API: getFile + the /file/ endpoint, with
+# knobs for what the real server does to us (no Content-Length, slow chunks),
+# getMe, long-polling getUpdates fed by push_update(), and sendMessage, which
+# reports every reply to on_reply(chat_id, reply_to_message_id, text, t).
+# Other methods answer {"ok": true} and are recorded in `calls`.
+import asyncio, json, time
+
+from aiohttp import web
+
+class FakeBotAPI:
+    def __init__(self, chunk: int = 16 * 1024, chunk_delay: float = 0.0, send_length: bool = True):
+        self.files = {}  # file_id -> bytes
+        self.chunk = chunk
+        self.chunk_delay = chunk_delay
+        self.send_length = send_length
+        self.calls = []
+        self.bytes_sent = 0
+        self.downloads = 0
+        self.active = 0
+        self.max_active = 0
+        self._runner = None
+        self.base = None
+        self.record_calls = True
+        self.updates = []
+        self._new_update = asyncio.Event()
+        self.on_reply = None
+        self.sent = 0
+
+    def add_file(self, file_id: str, data: bytes):
+        self.files[file_id] = data
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://{host}:{port}"
+        return self.base
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _params(self, request) -> dict:
+        params = dict(request.query)
+        if request.method == "POST":
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        return params
+
+    async def _method(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if self.record_calls:
+            self.calls.append((method, params, time.monotonic()))
+        handler = getattr(self, "api_" + method.lower(), None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return await handler(params)
+
+    def push_update(self, update: dict):
+        self.updates.append(update)
+        self._new_update.set()
+
+    async def api_getme(self, params):
+        return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "FartBot",
+                                                         "username": "fartbot"}})
+
+    async def api_getupdates(self, params):
+        # long poll: confirmed updates (id < offset) are forgotten, new ones wake the waiter
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), min(float(params.get("timeout") or 0), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        return web.json_response({"ok": True, "result": self.updates[:limit]})
+
+    async def api_sendmessage(self, params):
+        now = time.monotonic()
+        chat_id = int(params["chat_id"])
+        reply = params.get("reply_parameters")
+        if isinstance(reply, str):
+            reply = json.loads(reply)
+        reply_to = int(reply["message_id"]) if reply else int(params.get("reply_to_message_id") or 0) or None
+        self.sent += 1
+        if self.on_reply is not None:
+            self.on_reply(chat_id, reply_to, params.get("text", ""), now)
+        return web.json_response({"ok": True, "result": {
+            "message_id": 10 ** 9 + self.sent, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup"}, "text": params.get("text", "")}})
+
+    async def api_getfile(self, params):
+        file_id = params.get("file_id")
+        data = self.files.get(file_id)
+        if data is None:
+            return web.json_response({"ok": False, "error_code": 400,
+                                      "description": "Bad Request: invalid file_id"}, status=400)
+        return web.json_response({"ok": True, "result": {
+            "file_id": file_id, "file_unique_id": "u" + file_id,
+            "file_size": len(data) if self.send_length else None, "file_path": f"voice/{file_id}.ogg"}})
+
+    async def _file(self, request):
+        path = request.match_info["path"]
+        file_id = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        data = self.files.get(file_id)
+        if data is None:
+            raise web.HTTPNotFound()
+        self.downloads += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        resp = web.StreamResponse()
+        if self.send_length:
+            resp.content_length = len(data)
+        try:
+            await resp.prepare(request)
+            for i in range(0, len(data), self.chunk):
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+                await resp.write(data[i:i + self.chunk])
+                self.bytes_sent += min(self.chunk, len(data) - i)
+            await resp.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.active -= 1
+        return resp
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Near-duplicate detection (features.fingerprint + fingerprints.py) on
+# synthetic clips, no network:
+#   python -m bench.fingerprint_check [--clips 60] [--size 100000] [--max-distance 30]
+# Quality: Hamming distance between a clip and its re-encoded (Opus, as a
+# Telegram voice note), quieter, noisier, echoed, padded, trimmed and
+# re-recorded copies, against the distance between distinct clips.
+# Speed: fingerprint time per 12 s clip and lookup latency in one chat's index
+# holding --size entries. Exits non-zero if distinct clips match or the
+# lookup p95 exceeds --budget-ms.
+import argparse, json, sys, time
+import numpy as np
+
+from audio_classifier import decode_to_array
+from bench.clips import make_clip, ogg_bytes
+from bench.timing import measure, summarize
+from features import fingerprint
+from fingerprints import ChatIndex, _POPCOUNT
+
+SR = 32000
+
+def _copies(y: np.ndarray, rng) -> dict:
+    noise = lambda n, level: (level * rng.standard_normal(n)).astype(np.float32)
+    echo = np.exp(-np.arange(200) / 30.0)
+    echo = (echo / echo.sum()).astype(np.float32)
+    room = np.convolve(y, echo, mode="same")
+    lead = int(0.25 * SR)
+    return {
+        "reencoded": decode_to_array(ogg_bytes(y, SR), SR),
+        "quieter": y * 0.3,
+        "noisier": y + noise(len(y), 0.09 * float(np.std(y))),
+        "echo": room + noise(len(y), 0.01),
+        "padded": np.concatenate([noise(int(0.4 * SR), 0.003), y, np.zeros(int(0.2 * SR), np.float32)]),
+        "trimmed": y[int(0.15 * SR):],
+        # played through a speaker into another phone: echo, noise, lead-in, Opus again
+        "rerecorded": decode_to_array(ogg_bytes(np.concatenate([noise(lead, 0.003), room * 0.5])
+                                                + noise(len(y) + lead, 0.02 * float(np.std(y))), SR), SR),
+    }
+
+def _distance(a: bytes, b: bytes) -> int:
+    return int(_POPCOUNT[np.frombuffer(a, np.uint16) ^ np.frombuffer(b, np.uint16)].sum())
+
+def quality(n: int, max_distance: int) -> dict:
+    rng = np.random.default_rng(0)
+    clips = [make_clip("farts", float(rng.uniform(2, 8)), SR, seed=i) for i in range(n)]
+    fps = [fingerprint(y, SR) for y in clips]
+    copies = {}
+    for y, fp in zip(clips[:15], fps):
+        for name, c in _copies(y, rng).items():
+            copies.setdefault(name, []).append(_distance(fp, fingerprint(c, SR)))
+    distinct = [_distance(fps[i], fps[j]) for i in range(n) for j in range(i + 1, n)]
+    row = lambda d: {"min": int(min(d)), "median": float(np.median(d)), "max": int(max(d)),
+                     "matched": float(np.mean(np.array(d) <= max_distance))}
+    return {"copies": {k: row(v) for k, v in copies.items()},
+            "all_copies_matched": float(np.mean(np.concatenate(list(copies.values())) <= max_distance)),
+            "distinct": {**row(distinct), "p1": float(np.percentile(distinct, 1)), "pairs": len(distinct)}}
+
+def lookup_latency(size: int, max_distance: int, queries: int = 2000) -> dict:
+    # random fingerprints fill the index; queries are stored entries with a few
+    # bits flipped (hits) and fresh ones (misses)
+    rng = np.random.default_rng(1)
+    ix = ChatIndex(max_distance, ttl=1e9, max_items=size)
+    stored = rng.integers(0, 256, (size, 32), dtype=np.uint8)
+    t0 = time.perf_counter()
+    for i in range(size):
+        ix.add(stored[i].tobytes(), 0.9, now=float(i))
+    insert_s = time.perf_counter() - t0
+    out = {"size": len(ix), "insert_us": insert_s / size * 1e6}
+    for kind in ("hit", "miss"):
+        qs = []
+        for _ in range(queries):
+            if kind == "hit":
+                bits = np.unpackbits(stored[rng.integers(0, size)])
+                bits[rng.choice(256, int(rng.integers(0, max_distance + 1)), replace=False)] ^= 1
+                qs.append(np.packbits(bits).tobytes())
+            else:
+                qs.append(rng.integers(0, 256, 32, dtype=np.uint8).tobytes())
+        samples, found = [], 0
+        for q in qs:
+            t = time.perf_counter()
+            found += ix.nearest(q, float(size)) is not None
+            samples.append(time.perf_counter() - t)
+        out[kind] = {**summarize(samples), "found": found / queries}
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.fingerprint_check")
+    ap.add_argument("--clips", type=int, default=60)
+    ap.add_argument("--size", type=int, default=100000)
+    ap.add_argument("--max-distance", type=int, default=30)
+    ap.add_argument("--budget-ms", type=float, default=1.0)
+    args = ap.parse_args(argv)
+    longest = make_clip("farts", 12.0, SR, seed=3)
+    report = {
+        "quality": quality(args.clips, args.max_distance),
+        "fingerprint_12s": {"32k": measure(lambda: fingerprint(longest, SR), repeat=30),
+                            "8k": measure(lambda: fingerprint(longest[::4], 8000), repeat=30)},
+        "lookup": lookup_latency(args.size, args.max_distance),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    ok = (report["quality"]["distinct"]["matched"] == 0
+          and report["lookup"]["hit"]["found"] == 1.0
+          and max(report["lookup"][k]["p95_ms"] for k in ("hit", "miss")) <= args.budget_ms)
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
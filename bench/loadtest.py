@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# End-to-end load test against a local stand-in for the Bot API (no network):
+#   python -m bench.loadtest --mode both --rate 10,20,40 --duration 20 --chats 50
+# The real entrypoint (web_entry.py for polling, web_entry_webhook.py for
+# webhooks) runs as a subprocess with BOT_API_BASE pointing at
+# bench/fake_bot_api.py and a throwaway database. Synthetic updates (a mix of
+# voice notes, /top and /stats over many chats and members) are fed at a fixed
+# rate through getUpdates or POSTed to /webhook. Reply latency is the time from
+# handing an update over to the sendMessage that answers it; voice notes the
+# classifier rejects have no reply and are counted from /metrics instead.
+# Each rate step reports throughput, p50/p95/p99 latency and error counts;
+# "capacity" is the highest rate that stayed within --slo-ms at p95 with every
+# update answered. bench/shard_bench.py reuses run_mode() with WORKERS=N.
+import argparse, asyncio, json, os, random, signal, socket, subprocess, sys, tempfile, time
+
+import aiohttp
+
+from bench.clips import make_clip, ogg_bytes, wav_bytes
+from bench.fake_bot_api import FakeBotAPI
+from bench.timing import summarize
+from sharding import METRICS_PUSH
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRIES = {"polling": "web_entry.py", "webhook": "web_entry_webhook.py"}
+TOKEN = "123456:LOADTEST"
+CLIP_SECONDS = 3.0
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, share = part.partition("=")
+        if kind.strip() not in ("voice", "top", "stats"):
+            raise SystemExit(f"unknown update kind in --mix: {kind!r}")
+        mix[kind.strip()] = float(share)
+    total = sum(mix.values())
+    return {k: v / total for k, v in mix.items()}
+
+def _pick_clips(sr: int = 32000):
+    # one clip the configured classifier accepts (it gets a reply) and one it rejects
+    from audio_classifier import FartClassifier
+    clf = FartClassifier(os.environ.get("CLASSIFIER_MODE", "heuristic"), dict(os.environ))
+    confidence_min = float(os.environ.get("CONFIDENCE_MIN", "0.55"))
+    accepted = rejected = None
+    for kind in ("hum", "burst", "noise", "tone"):
+        y = make_clip(kind, CLIP_SECONDS, sr, seed=1)
+        res = clf.classify_array(y, sr)
+        if res["is_fart"] and res["score"] >= confidence_min:
+            accepted = y if accepted is None else accepted
+        else:
+            rejected = y if rejected is None else rejected
+    if accepted is None or rejected is None:
+        raise SystemExit("could not find one accepted and one rejected synthetic clip for this classifier")
+    try:
+        return ogg_bytes(accepted, sr), ogg_bytes(rejected, sr)
+    except RuntimeError:
+        return wav_bytes(accepted, sr), wav_bytes(rejected, sr)
+
+def _metric_values(text: str, name: str) -> dict:
+    # {label value: number} for one labelled counter in Prometheus text output
+    out = {}
+    for line in text.splitlines():
+        if line.startswith(name + "{"):
+            labels, _, value = line.rpartition(" ")
+            out[labels.split('"')[1]] = float(value)
+    return out
+
+def _metric_total(text: str, name: str) -> float:
+    # one unlabelled sample, e.g. a histogram's _sum or _count
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rpartition(" ")[2])
+    return 0.0
+
+class Load:
+    def __init__(self, mode: str, api: FakeBotAPI, port: int, chats: int, users: int, mix: dict,
+                 accept: float, seed: int = 0):
+        self.mode = mode
+        self.api = api
+        self.port = port
+        self.chats = chats
+        self.users = users
+        self.mix = mix
+        self.accept = accept
+        self.rng = random.Random(seed)
+        self.update_id = 0
+        self.pending = {}  # (chat_id, message_id) -> (kind, sent at)
+        self.latencies = {}
+        self.errors = {"http": 0, "reply": 0}
+        self.last_reply = 0.0
+        self.metrics_lag = 0.0  # with WORKERS > 1 worker samples reach /metrics this late
+        api.on_reply = self._on_reply
+
+    def _on_reply(self, chat_id, reply_to, text, t):
+        sent = self.pending.pop((chat_id, reply_to), None)
+        if sent is None:
+            return  # achievement follow-ups and other unsolicited messages
+        kind, t0 = sent
+        self.latencies.setdefault(kind, []).append(t - t0)
+        self.last_reply = t
+        if text.startswith("Не удалось"):
+            self.errors["reply"] += 1
+
+    def _update(self):
+        self.update_id += 1
+        chat_id = -1001000000000 - self.rng.randrange(self.chats)
+        uid = 1000 + self.rng.randrange(self.users)
+        kind = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        msg = {"message_id": self.update_id, "date": int(time.time()),
+               "chat": {"id": chat_id, "type": "supergroup", "title": "load"},
+               "from": {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}}
+        if kind == "voice":
+            ok = self.rng.random() < self.accept
+            fid = f"{'a' if ok else 'r'}{self.update_id}"  # unique: no result-cache hits
+            msg["voice"] = {"file_id": fid, "file_unique_id": "u" + fid, "duration": int(CLIP_SECONDS),
+                            "mime_type": "audio/ogg"}
+            kind = "voice" if ok else "voice_rejected"
+        else:
+            text = "/top" if kind == "top" else "/stats"
+            msg["text"] = text
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return kind, chat_id, {"update_id": self.update_id, "message": msg}
+
+    async def _post(self, session, update):
+        try:
+            async with session.post(f"http://127.0.0.1:{self.port}/webhook", json=update) as resp:
+                if resp.status != 200:
+                    self.errors["http"] += 1
+        except aiohttp.ClientError:
+            self.errors["http"] += 1
+
+    async def step(self, rate: float, duration: float, drain: float) -> dict:
+        self.latencies = {}
+        self.errors = {"http": 0, "reply": 0}
+        text = await self.scrape()
+        before = _metric_values(text, "fartbot_clips_total")
+        wait_before = [_metric_total(text, "fartbot_db_lock_wait_seconds" + s) for s in ("_sum", "_count")]
+        n = int(rate * duration)
+        sent = {}
+        posts = set()
+        async with aiohttp.ClientSession() as session:
+            t_start = time.monotonic()
+            for i in range(n):
+                delay = t_start + i / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                kind, chat_id, update = self._update()
+                sent[kind] = sent.get(kind, 0) + 1
+                if kind != "voice_rejected":
+                    self.pending[(chat_id, update["message"]["message_id"])] = (kind, time.monotonic())
+                if self.mode == "polling":
+                    self.api.push_update(update)
+                else:
+                    task = asyncio.create_task(self._post(session, update))
+                    posts.add(task)
+                    task.add_done_callback(posts.discard)
+            t_sent = time.monotonic()
+            # wait for every reply and for every rejected clip to show up in /metrics
+            deadline = t_sent + drain
+            while time.monotonic() < deadline:
+                done = await self.clips()
+                rejected = done.get("rejected_score", 0) - before.get("rejected_score", 0)
+                if not self.pending and rejected >= sent.get("voice_rejected", 0):
+                    break
+                await asyncio.sleep(0.1)
+            if posts:
+                await asyncio.wait(posts)
+        t_end = max(self.last_reply, t_start) if not self.pending else time.monotonic()
+        await asyncio.sleep(self.metrics_lag)
+        text = await self.scrape()
+        clips = _metric_values(text, "fartbot_clips_total")
+        wait_s, waits = (_metric_total(text, "fartbot_db_lock_wait_seconds" + s) - b
+                         for s, b in zip(("_sum", "_count"), wait_before))
+        outcomes = {k: int(v - before.get(k, 0)) for k, v in clips.items() if v - before.get(k, 0)}
+        missing = len(self.pending)
+        self.pending.clear()
+        all_lat = [x for xs in self.latencies.values() for x in xs]
+        return {
+            "mode": self.mode, "rate": rate, "sent": n, "sent_by_kind": sent,
+            "send_seconds": round(t_sent - t_start, 2),
+            "throughput_per_s": round(n / (t_end - t_start), 2) if missing == 0 else None,
+            "replies": len(all_lat), "missing": missing,
+            "errors": dict(self.errors, clips=outcomes.get("error", 0), shed=outcomes.get("shed", 0)),
+            "clips": outcomes,
+            "db_lock_wait": {"writes": int(waits), "total_ms": round(wait_s * 1000, 1),
+                             "mean_ms": round(wait_s * 1000 / waits, 3) if waits else 0.0},
+            "latency": summarize(all_lat),
+            "latency_by_kind": {k: summarize(v) for k, v in sorted(self.latencies.items())},
+        }
+
+    async def scrape(self) -> str:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{self.port}/metrics") as resp:
+                return await resp.text()
+
+    async def clips(self) -> dict:
+        return _metric_values(await self.scrape(), "fartbot_clips_total")
+
+async def _wait_ready(port: int, proc, timeout: float = 180.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"bot exited with code {proc.returncode}")
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/readyz") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("bot did not become ready")
+
+async def run_mode(mode: str, rates, duration: float, chats: int, users: int, mix: dict, accept: float,
+                   drain: float, env: dict = None) -> dict:
+    accepted, rejected = _pick_clips()
+    api = FakeBotAPI()
+    api.record_calls = False
+    _orig_getfile = api.api_getfile
+
+    async def getfile(params):
+        # every file_id maps to one of the two clips
+        fid = params.get("file_id", "")
+        if fid not in api.files:
+            api.add_file(fid, accepted if fid.startswith("a") else rejected)
+        return await _orig_getfile(params)
+    api.api_getfile = getfile
+    base = await api.start()
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as td:
+        child_env = dict(os.environ)
+        child_env.update({
+            "BOT_TOKEN": TOKEN, "BOT_API_BASE": base, "PORT": str(port),
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}", "DATA_DIR": td,
+            "DB_PATH": os.path.join(td, "fartbot.sqlite3"), "SNAPSHOT_DIR": "", "COMPACT_INTERVAL_HOURS": "0",
+            "METRICS_ENABLED": "1", "PYTHONUNBUFFERED": "1",
+            # every voice note is one of two clips: the fingerprint index would reject repeats
+            "FP_INDEX": "0",
+        })
+        child_env.update(env or {})
+        log_path = os.path.join(td, "bot.log")
+        with open(log_path, "w") as log:
+            proc = subprocess.Popen([sys.executable, "-u", ENTRIES[mode]], cwd=ROOT, env=child_env,
+                                    stdout=log, stderr=subprocess.STDOUT)
+            try:
+                t0 = time.monotonic()
+                await _wait_ready(port, proc)
+                ready_s = time.monotonic() - t0
+                load = Load(mode, api, port, chats, users, mix, accept)
+                if int(child_env.get("WORKERS") or 1) > 1:
+                    load.metrics_lag = METRICS_PUSH + 0.5
+                steps = []
+                for rate in rates:
+                    steps.append(await load.step(rate, duration, drain))
+            except Exception:
+                with open(log_path) as f:
+                    print(f.read()[-3000:], file=sys.stderr)
+                raise
+            finally:
+                # wait off the loop: the bot's shutdown still talks to the fake API
+                proc.send_signal(signal.SIGTERM)  # what Render sends on redeploy
+                try:
+                    await asyncio.to_thread(proc.wait, 30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+                    print(f"{mode}: bot did not stop within 30 s; killed", file=sys.stderr)
+                await api.stop()
+    return {"mode": mode, "ready_s": round(ready_s, 2), "steps": steps}
+
+def capacity(steps, slo_ms: float):
+    ok = [s["rate"] for s in steps
+          if s["missing"] == 0 and not any(s["errors"].values()) and s["latency"].get("p95_ms", 0) <= slo_ms]
+    return max(ok) if ok else None
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.loadtest")
+    ap.add_argument("--mode", default="both", choices=["polling", "webhook", "both"])
+    ap.add_argument("--rate", default="5,10,20", help="updates per second; several values run as steps")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds per rate step")
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--users", type=int, default=20, help="members per chat")
+    ap.add_argument("--mix", default="voice=0.7,top=0.2,stats=0.1")
+    ap.add_argument("--accept", type=float, default=0.5, help="share of voice notes the classifier accepts")
+    ap.add_argument("--drain", type=float, default=60.0, help="max seconds to wait for replies after a step")
+    ap.add_argument("--slo-ms", type=float, default=2000.0, help="p95 reply latency that still counts as absorbed")
+    ap.add_argument("--out", help="write JSON here (default: stdout)")
+    args = ap.parse_args(argv)
+
+    from bench.__main__ import _meta
+    rates = [float(r) for r in args.rate.split(",") if r.strip()]
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    result = {"meta": _meta(), "args": vars(args), "runs": []}
+    for mode in modes:
+        run = asyncio.run(run_mode(mode, rates, args.duration, args.chats, args.users, _parse_mix(args.mix),
+                                   args.accept, args.drain))
+        run["capacity_per_s"] = capacity(run["steps"], args.slo_ms)
+        result["runs"].append(run)
+        for s in run["steps"]:
+            lat = s["latency"]
+            print(f"{mode:8} {s['rate']:6g}/s  sent {s['sent']:5}  replies {s['replies']:5}  missing {s['missing']:4}  "
+                  f"errors {sum(s['errors'].values()):3}  p50 {lat.get('p50_ms', 0):7.1f}  p95 {lat.get('p95_ms', 0):7.1f}  "
+                  f"p99 {lat.get('p99_ms', 0):7.1f} ms", file=sys.stderr)
+        print(f"{mode:8} capacity: {run['capacity_per_s']} updates/s at p95 <= {args.slo_ms:g} ms", file=sys.stderr)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
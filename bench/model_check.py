@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# End-to-end check of CLASSIFIER_MODE=model on synthetic clips (no network):
+#   python -m bench.model_check [--hidden 0] [--budget-ms 50]
+# Writes a labeled folder (burst = fart; noise, tone, hum = other), trains with
+# train_model.py, then compares the model with the heuristic on fresh clips and
+# times the longest clip against the per-clip budget. Exits non-zero if the
+# model is less accurate than the heuristic or over budget.
+import argparse, json, os, sys, tempfile
+import numpy as np
+
+import train_model
+from audio_classifier import FartClassifier
+from bench.clips import make_clip, wav_bytes
+from bench.timing import measure
+
+NEGATIVES = ("noise", "tone", "hum")
+
+def _write_set(root: str, n: int, sr: int, seed: int):
+    for label in ("fart", "other"):
+        os.makedirs(os.path.join(root, label), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        dur = float(rng.uniform(1, 12))
+        kind = "burst" if i % 2 == 0 else NEGATIVES[(i // 2) % len(NEGATIVES)]
+        label = "fart" if kind == "burst" else "other"
+        with open(os.path.join(root, label, f"{kind}-{i}.wav"), "wb") as f:
+            f.write(wav_bytes(make_clip(kind, dur, sr, seed=seed * 100000 + i), sr))
+
+def _accuracy(clf, clips, labels, confidence_min: float) -> float:
+    res = clf.classify_batch(clips, 32000)
+    pred = [r["is_fart"] and r["score"] >= confidence_min for r in res]
+    return float(np.mean([p == bool(l) for p, l in zip(pred, labels)]))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.model_check")
+    ap.add_argument("--clips", type=int, default=240)
+    ap.add_argument("--hidden", type=int, default=0)
+    ap.add_argument("--budget-ms", type=float, default=50.0)
+    ap.add_argument("--confidence-min", type=float, default=float(os.environ.get("CONFIDENCE_MIN", "0.55")))
+    args = ap.parse_args(argv)
+    with tempfile.TemporaryDirectory() as td:
+        data, out = os.path.join(td, "clips"), os.path.join(td, "fart.npz")
+        _write_set(data, args.clips, 32000, seed=1)
+        report = {"train": train_model.train(data, out, hidden=args.hidden)}
+        cfg = {"MODEL_PATH": out, "MODEL_BUDGET_MS": str(args.budget_ms)}
+        model, heur = FartClassifier("model", cfg), FartClassifier("heuristic", {})
+        model.warm_up()
+        rng = np.random.default_rng(7)
+        kinds = ["burst" if i % 2 == 0 else NEGATIVES[(i // 2) % 3] for i in range(120)]
+        clips = [make_clip(k, float(rng.uniform(1, 12)), 32000, seed=900000 + i) for i, k in enumerate(kinds)]
+        labels = [k == "burst" for k in kinds]
+        report["accuracy"] = {"heuristic": _accuracy(heur, clips, labels, args.confidence_min),
+                              "model": _accuracy(model, clips, labels, args.confidence_min)}
+        longest = make_clip("burst", model.impl.max_seconds, 32000, seed=3)
+        decoded = longest[::32000 // model.sample_rate]  # already at the model's rate, as audio_pool decodes it
+        report["latency_12s"] = {
+            "model_32k_input": measure(lambda: model.classify_array(longest, 32000), repeat=30),
+            "model": measure(lambda: model.classify_array(decoded, model.sample_rate), repeat=30),
+            "heuristic": measure(lambda: heur.classify_array(longest, 32000), repeat=30),
+        }
+        report["model_bytes"] = os.path.getsize(out)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    ok = (report["accuracy"]["model"] >= report["accuracy"]["heuristic"]
+          and report["latency_12s"]["model"]["p95_ms"] <= args.budget_ms)
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Throughput of the sharded mode (WORKERS=N, sharding.py) end to end: the real
+# entry point runs against bench/fake_bot_api.py with a throwaway database, as
+# in bench/loadtest.py, and gets a burst of voice notes over many chats. Every
+# clip is accepted, so each one is downloaded, classified, written with
+# record_detection and answered. WORKERS=1 is the plain single-process bot;
+# with N > 1 the workers share one SQLite file and contend for its writer lock
+# across processes, reported as db_lock_wait (from /metrics). Each process
+# gets one audio thread, so a worker is one core. Scaling is only meaningful
+# up to the number of physical cores.
+import asyncio, os
+
+from bench import loadtest
+
+def run_one(workers: int, jobs: int = 200, chats: int = 64, mode: str = "polling") -> dict:
+    rate = float(jobs)  # the whole burst is handed over in about a second
+    res = asyncio.run(loadtest.run_mode(mode, [rate], duration=jobs / rate, chats=chats, users=20,
+                                        mix={"voice": 1.0}, accept=1.0, drain=600.0,
+                                        env={"WORKERS": str(workers), "AUDIO_WORKERS": "1"}))
+    step = res["steps"][0]
+    return {"workers": workers, "mode": mode, "jobs": step["sent"], "ready_s": res["ready_s"],
+            "throughput_per_s": step["throughput_per_s"], "missing": step["missing"],
+            "errors": step["errors"], "clips": step["clips"], "db_lock_wait": step["db_lock_wait"],
+            "latency": step["latency"]}
+
+def run(workers=(1, 2, 4), jobs: int = 200, mode: str = "polling") -> dict:
+    out = {"cpus": os.cpu_count(), "mode": mode, "cases": []}
+    for n in workers:
+        res = run_one(n, jobs, mode=mode)
+        base = out["cases"][0] if out["cases"] else None
+        if base and base["throughput_per_s"] and res["throughput_per_s"]:
+            res["speedup"] = res["throughput_per_s"] / base["throughput_per_s"]
+            res["efficiency"] = res["speedup"] / (n / base["workers"])
+        out["cases"].append(res)
+    return out
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Snapshot and restore timings (snapshot.py) on the seeded bench databases.
+import os, tempfile
+
+import snapshot
+from bench import db_bench
+
+def run(sizes=(1_000_000,), workdir: str = None, repeat: int = 3) -> dict:
+    workdir = workdir or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+    os.makedirs(workdir, exist_ok=True)
+    out = {"cases": []}
+    for n in sizes:
+        src = os.path.join(workdir, f"seed-{n}.sqlite3")
+        db_bench.seed(src, n)
+        with tempfile.TemporaryDirectory(dir=workdir) as td:
+            take = snapshot.take(os.path.join(td, "snap"), src)
+            restores = []
+            for i in range(repeat):
+                target = os.path.join(td, f"restored-{i}.sqlite3")
+                restores.append(snapshot.restore(os.path.join(td, "snap"), target)["seconds"])
+        out["cases"].append({"events": n, "db_bytes": take["bytes"], "gz_bytes": take["gz_bytes"],
+                             "snapshot_s": take["seconds"], "backup_s": take["backup_s"],
+                             "max_step_ms": take["max_step_ms"],
+                             "restore_s_min": min(restores), "restore_s_max": max(restores),
+                             "verify": snapshot.VERIFY})
+    return out
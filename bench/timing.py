@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import time
+
+def summarize(samples_s, items: int = 1) -> dict:
+    xs = sorted(samples_s)
+    n = len(xs)
+    if not n:
+        return {"n": 0}
+    total = sum(xs)
+    pct = lambda p: xs[min(n - 1, int(round(p * (n - 1))))] * 1000
+    return {
+        "n": n,
+        "mean_ms": total / n * 1000,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "min_ms": xs[0] * 1000,
+        "max_ms": xs[-1] * 1000,
+        "throughput_per_s": n * items / total if total else None,
+    }
+
+def measure(fn, repeat: int = 20, warmup: int = 2, items: int = 1, budget_s: float = 20.0) -> dict:
+    # stops early once budget_s is spent so large cases stay bounded
+    for _ in range(warmup):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if time.perf_counter() - start > budget_s:
+            break
+    return summarize(samples, items)
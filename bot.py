@@ -1,18 +1,22 @@
 # -*- coding: utf-8 -*-
-import asyncio, os, re, tempfile, sys
+import asyncio, os, re, sys
 from pathlib import Path
 from dotenv import load_dotenv
+# before the project imports below, which read their settings at import time;
+# a no-op when an entry point has already loaded .env
+load_dotenv()
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
 from aiogram.enums import ParseMode, ChatType
 from aiogram.filters import Command, CommandObject
-from aiogram.types import Message
-
-from db import init_db, ensure_user, add_event, get_stats, get_top, get_usernames, inc_dec_stat, log_admin_action, save_achievement, has_achievement
-from audio_classifier import ogg_or_m4a_to_wav, FartClassifier
-from achievements import newly_earned_achievements, ACHIEVEMENTS
+from aiogram.types import Message, Update
 
-load_dotenv()
+from db import (init_db, close_db, ensure_user_async, get_stats_async, get_top_async, get_usernames_async,
+                record_detection_async, user_cache_stats)
+import audio_pool, writebehind, result_cache, metrics, scheduler, dedup, sharding, downloads, compaction, snapshot, tracing, fingerprints
+from achievements import ACHIEVEMENTS
 
 TOKEN = os.environ.get("BOT_TOKEN")
 if not TOKEN:
@@ -37,13 +41,81 @@ MIN_SEC = int(os.environ.get("MIN_VOICE_SECONDS", "1"))
 MAX_SEC = int(os.environ.get("MAX_VOICE_SECONDS", "12"))
 CONFIDENCE_MIN = float(os.environ.get("CONFIDENCE_MIN", "0.55"))
 CLASSIFIER_MODE = os.environ.get("CLASSIFIER_MODE", "heuristic")
+# WORKERS > 1: this process only receives updates and forwards them to worker
+# processes by chat (see sharding.py); workers run with SHARD_WORKER set
+WORKERS = int(os.environ.get("WORKERS", "1"))
+SHARD_FRONT = WORKERS > 1 and not os.environ.get(sharding.WORKER_ENV)
+# the process that owns database maintenance (retention, snapshots)
+DB_OWNER = not os.environ.get(sharding.WORKER_ENV)
 
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# one pooled HTTP session for API calls and file downloads; BOT_API_BASE points
+# it at a self-hosted Bot API server (BOT_API_LOCAL=1 for --local mode) or at
+# the load-test stand-in (bench/loadtest.py)
+API_BASE = os.environ.get("BOT_API_BASE")
+api = TelegramAPIServer.from_base(API_BASE, is_local=os.environ.get("BOT_API_LOCAL") == "1") if API_BASE else PRODUCTION
+session = AiohttpSession(api=api, limit=int(os.environ.get("HTTP_POOL_LIMIT", "100")))
+bot = Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
+dp.update.outer_middleware(dedup.middleware)
+dp.update.outer_middleware(sharding.middleware)
+dp.update.outer_middleware(tracing.middleware)
 
-classifier = FartClassifier(mode=CLASSIFIER_MODE, cfg=os.environ)
+async def startup():
+    # returns quickly: the classifier is imported and warmed in the background,
+    # voice notes that arrive before it is ready simply wait for it
+    if DB_OWNER:
+        restored = await asyncio.to_thread(snapshot.restore)
+        if restored:
+            print("Database restored from snapshot:", restored)
+    init_db()
+    tracing.start()
+    dedup.start()
+    metrics.add_collector("fartbot_dedup", dedup.stats)
+    if DB_OWNER:
+        compaction.start()
+        snapshot.start()
+    if SHARD_FRONT:
+        sharding.start(WORKERS)
+        metrics.add_collector("fartbot_shards", sharding.stats)
+        metrics.start()
+        return
+    writebehind.start()
+    result_cache.start(CLASSIFIER_MODE, os.environ)
+    fingerprints.start(os.environ)
+    audio_pool.start(CLASSIFIER_MODE, os.environ)
+    scheduler.start()
+    metrics.add_collector("fartbot_scheduler", scheduler.stats)
+    metrics.add_collector("fartbot_write_behind", writebehind.stats)
+    metrics.add_collector("fartbot_result_cache", result_cache.stats)
+    metrics.add_collector("fartbot_fingerprints", fingerprints.stats)
+    metrics.add_collector("fartbot_user_cache", user_cache_stats)
+    metrics.add_collector("fartbot_tracing", tracing.stats)
+    metrics.start()
+
+def is_ready() -> bool:
+    return sharding.is_ready() if SHARD_FRONT else audio_pool.is_ready()
+
+async def shutdown():
+    await compaction.stop()
+    if SHARD_FRONT:
+        await sharding.stop()
+        await dedup.stop()
+        await metrics.stop()
+        await snapshot.stop()
+        close_db()
+        return
+    await scheduler.stop()
+    await dedup.stop()
+    await metrics.stop()
+    await result_cache.stop()
+    fingerprints.stop()
+    await writebehind.stop()
+    audio_pool.shutdown_pool()
+    if DB_OWNER:
+        await snapshot.stop()  # after write-behind has flushed, so the last rows are in it
+    close_db()
 
 LOCK_FH = None
 def acquire_singleton_lock():
@@ -126,8 +198,8 @@ async def cmd_ach(message: Message):
 @router.message(Command("stats"))
 async def cmd_stats(message: Message):
     target = await resolve_target_user(message) or message.from_user
-    ensure_user(message.chat.id, target)
-    s = get_stats(message.chat.id, target.id)
+    await ensure_user_async(message.chat.id, target)
+    s = await get_stats_async(message.chat.id, target.id)
     await message.reply(f"Статистика для <b>{mention(target)}</b>:\n💨: <b>{s['farts']}</b>\n🪢 кнуты: <b>{s['whips']}</b>")
 
 @router.message(Command("top"))
@@ -138,8 +210,9 @@ async def cmd_top(message: Message, command: CommandObject):
             days = int(command.args.strip())
         except Exception:
             pass
-    rows = get_top(message.chat.id, days=days if days>0 else 0, limit=10)
-    names = get_usernames(message.chat.id, [uid for uid,_ in rows])
+    with metrics.STAGE_SECONDS.time("top"):
+        rows = await get_top_async(message.chat.id, days=days if days>0 else 0, limit=10)
+        names = await get_usernames_async(message.chat.id, [uid for uid,_ in rows])
     title = f"Топ по 💨 за {days} дн." if days>0 else "Топ за всё время"
     lines = [f"<b>{title}</b>"]
     for i,(uid,total) in enumerate(rows, start=1):
@@ -151,56 +224,81 @@ def _format_achievement_msg(user, a):
 
 from aiogram.types import ContentType
 @router.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}) & (F.voice | F.audio | F.video_note))
-async def on_voice(message: Message):
+async def on_voice(message: Message, event_update: Update = None):
+    metrics.IN_FLIGHT.inc()
+    try:
+        await _handle_voice(message, event_update and event_update.update_id)
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+async def _handle_voice(message: Message, update_id: int = None):
     dur = (message.voice and message.voice.duration) or (message.audio and message.audio.duration) or (message.video_note and message.video_note.duration) or 0
     if dur and (dur < MIN_SEC or dur > MAX_SEC):
+        metrics.CLIPS.inc("rejected_duration")
         return
-    file_id = message.voice.file_id if message.voice else (message.audio and message.audio.file_id) or (message.video_note and message.video_note.file_id)
+    media = message.voice or message.audio or message.video_note
+    file_id = media and media.file_id
     if not file_id:
         return
+    try:
+        await scheduler.run(message.chat.id, tracing.bind(lambda: _process_voice(message, media, update_id)))
+    except scheduler.Overloaded:
+        metrics.CLIPS.inc("shed")
 
-    ensure_user(message.chat.id, message.from_user)
-
-    with tempfile.TemporaryDirectory() as td:
-        ogg_path = Path(td) / "in.ogg"
-        wav_path = Path(td) / "in.wav"
+async def _process_voice(message: Message, media, update_id: int = None):
+    # runs under the per-chat scheduler: one clip per chat at a time, in order
+    stage = metrics.STAGE_SECONDS.time
+    file_id = media.file_id
+    # near-duplicates of clips already counted in this chat (fingerprints.py)
+    precheck = fingerprints.checker(message.chat.id)
+    res = await result_cache.get(media.file_unique_id)
+    if res is not None and precheck is not None:
+        # a forwarded copy keeps its file_unique_id
+        res = precheck(res.get("fp")) or res
+    if res is None:
         try:
-            try:
-                await message.bot.download(file_id, destination=ogg_path)
-            except Exception:
-                f = await message.bot.get_file(file_id)
-                await message.bot.download(f.file_path, destination=ogg_path)
-            ogg_or_m4a_to_wav(str(ogg_path), str(wav_path), target_sr=32000)
+            kind = "voice" if message.voice else "audio" if message.audio else "video_note"
+            with stage("download"):
+                data = await downloads.fetch(message.bot, media, kind)
+            res = await audio_pool.analyse(data, precheck)
+        except downloads.TooLarge:
+            metrics.CLIPS.inc("rejected_size")
+            return
         except Exception as e:
+            metrics.CLIPS.inc("error")
             await message.reply("Не удалось обработать голосовое: " + str(e))
             return
+        if "duplicate" not in res:
+            result_cache.put(media.file_unique_id, res)
 
-        res = classifier.classify(str(wav_path))
-
+    if "duplicate" in res and not res["is_fart"]:
+        metrics.CLIPS.inc("duplicate")
+        return
     if not res.get("is_fart") or float(res.get("score",0.0)) < CONFIDENCE_MIN:
+        metrics.CLIPS.inc("rejected_score")
         return
 
-    add_event(message.chat.id, message.from_user.id, 'fart', amount=1, file_id=file_id)
-    log_admin_action(message.chat.id, message.from_user.id, 'autodetect', 1, admin_user_id=None)
-    s = get_stats(message.chat.id, message.from_user.id)
-
-    old = s['farts'] - 1
-    new = s['farts']
-    earned = newly_earned_achievements(old, new)
-    ach_msg = "\n".join(_format_achievement_msg(message.from_user, a) for a in earned if not has_achievement(message.chat.id, message.from_user.id, a['key']))
-    for a in earned:
-        save_achievement(message.chat.id, message.from_user.id, a['key'], a['threshold'])
+    with stage("db"):
+        s = await record_detection_async(message.chat.id, message.from_user, file_id=file_id,
+                                         mark=dedup.mark(update_id))
+    metrics.CLIPS.inc("accepted")
+    fingerprints.remember(message.chat.id, res)
+    ach_msg = "\n".join(_format_achievement_msg(message.from_user, a) for a in s['earned'])
 
     txt = f"💨 +1 для {mention(message.from_user)} (итого: <b>{s['farts']}</b>)."
     if ach_msg:
         txt += "\n\n" + ach_msg
-    await message.reply(txt)
+    with stage("reply"):
+        await message.reply(txt)
 
 async def main():
     acquire_singleton_lock()
-    init_db()
+    await startup()
     print("Bot started. Press Ctrl+C to stop.")
-    await dp.start_polling(bot, allowed_updates=["message"])
+    try:
+        await dp.start_polling(bot, allowed_updates=["message"])
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Retention for the append-only log tables. Per-day fart totals already live in
+# daily_totals (written in the same transaction as each event), so old events
+# carry no information /top needs: they are folded into daily_totals once more
+# as a safety net (a day total is only ever raised) and deleted. Old audit rows
+# are deleted, file_ids of events past a shorter horizon are cleared, and the
+# freed pages are returned to the filesystem with incremental vacuum.
+# Everything runs in short batches under the writer lock with pauses between
+# them, so handlers never wait for more than one batch.
+#
+#   python compaction.py [--events-days 90] [--audit-days 180] [--file-id-days 7]
+#                        [--batch 2000] [--convert] [--dry-run]
+import argparse, asyncio, json, os, time
+
+import db
+
+EVENTS_DAYS = int(os.environ.get("COMPACT_EVENTS_DAYS", "90"))
+AUDIT_DAYS = int(os.environ.get("COMPACT_AUDIT_DAYS", "180"))
+FILE_ID_DAYS = int(os.environ.get("COMPACT_FILE_ID_DAYS", "7"))
+BATCH = int(os.environ.get("COMPACT_BATCH", "2000"))
+PAUSE_MS = int(os.environ.get("COMPACT_PAUSE_MS", "50"))
+FILE_ID_MARK = "compact_file_id_mark"
+VACUUM_PAGES = 1000  # pages freed per incremental_vacuum step (4 MB at 4 KB pages)
+
+def _first_id_at(conn, table: str, cut: int) -> int:
+    # smallest id whose row has ts >= cut; ids grow with ts in these logs, so
+    # this is a binary search over the rowid instead of a full scan on ts
+    lo, hi = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+    if lo is None:
+        return 0
+    hi += 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        row = conn.execute(f"SELECT id, ts FROM {table} WHERE id >= ? ORDER BY id LIMIT 1", (mid,)).fetchone()
+        if row is None or row[1] >= cut:
+            hi = mid
+        else:
+            lo = row[0] + 1
+    return lo
+
+_max_batch_s = 0.0
+
+def _batches(table: str, cut: int, batch: int, pause: float, step, start: int = None):
+    # calls step(conn, lo, hi) for id ranges below the cut, one transaction each;
+    # returns (rows affected, first id not processed)
+    global _max_batch_s
+    with db._db.read() as conn:
+        first = conn.execute(f"SELECT MIN(id) FROM {table}").fetchone()[0]
+        end = _first_id_at(conn, table, cut)
+    start = max(start or 0, first or 0)
+    n = 0
+    while first is not None and start < end:
+        hi = min(start + batch, end)
+        t0 = time.perf_counter()
+        with db._db.write() as conn:
+            n += step(conn, start, hi)
+        _max_batch_s = max(_max_batch_s, time.perf_counter() - t0)
+        start = hi
+        time.sleep(pause)
+    return n, start
+
+def _count_step(table: str, cut: int):
+    return lambda conn, lo, hi: conn.execute(f"SELECT COUNT(*) FROM {table} WHERE id >= ? AND id < ? AND ts < ?",
+                                             (lo, hi, cut)).fetchone()[0]
+
+def _delete_step(table: str, cut: int):
+    return lambda conn, lo, hi: conn.execute(f"DELETE FROM {table} WHERE id >= ? AND id < ? AND ts < ?",
+                                             (lo, hi, cut)).rowcount
+
+def _fold_step(cut: int, touched: set):
+    delete = _delete_step("events", cut)
+    def step(conn, lo, hi):
+        for (chat_id,) in conn.execute("""
+                INSERT INTO daily_totals(chat_id, user_id, day, farts)
+                    SELECT chat_id, user_id, ts / 86400, SUM(amount) FROM events
+                    WHERE id >= ? AND id < ? AND ts < ? AND kind = 'fart'
+                    GROUP BY chat_id, user_id, ts / 86400
+                ON CONFLICT(chat_id, day, user_id) DO UPDATE SET farts = excluded.farts
+                    WHERE excluded.farts > daily_totals.farts
+                RETURNING chat_id""", (lo, hi, cut)).fetchall():
+            touched.add(chat_id)
+        return delete(conn, lo, hi)
+    return step
+
+def compact(events_days: int = EVENTS_DAYS, audit_days: int = AUDIT_DAYS, file_id_days: int = FILE_ID_DAYS,
+            batch: int = BATCH, pause_ms: int = PAUSE_MS, convert: bool = False, dry_run: bool = False) -> dict:
+    # a horizon of 0 keeps that data forever
+    global _max_batch_s
+    _max_batch_s = 0.0
+    t0 = time.perf_counter()
+    now = int(time.time())
+    pause = pause_ms / 1000.0
+    report = {"dry_run": dry_run, "bytes_before": _db_bytes()}
+
+    if events_days > 0:
+        cut = now - events_days * 86400
+        touched = set()
+        step = _count_step("events", cut) if dry_run else _fold_step(cut, touched)
+        report["events_deleted"], _ = _batches("events", cut, batch, pause, step)
+        if touched:
+            # daily_totals had fallen behind the log for these chats; reload their boards
+            report["chats_refolded"] = len(touched)
+            if db._boards is not None:
+                for chat_id in touched:
+                    db._boards.discard(chat_id)
+    if audit_days > 0:
+        cut = now - audit_days * 86400
+        step = _count_step("audit_log", cut) if dry_run else _delete_step("audit_log", cut)
+        report["audit_deleted"], _ = _batches("audit_log", cut, batch, pause, step)
+    if file_id_days > 0 and not dry_run:
+        # resumes where the previous run stopped instead of rescanning kept events
+        cut = now - file_id_days * 86400
+        mark = db.kv_get(FILE_ID_MARK)
+        report["file_ids_cleared"], done = _batches(
+            "events", cut, batch, pause,
+            lambda conn, lo, hi: conn.execute("""UPDATE events SET file_id = NULL
+                                                 WHERE id >= ? AND id < ? AND ts < ? AND file_id IS NOT NULL""",
+                                              (lo, hi, cut)).rowcount,
+            start=mark[0] if mark else 0)
+        db.kv_set_max(FILE_ID_MARK, done)
+    if not dry_run:
+        report.update(_vacuum(convert, pause))
+    report["bytes_after"] = _db_bytes()
+    report["max_batch_ms"] = round(_max_batch_s * 1000, 1)
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+def _db_bytes() -> int:
+    return sum(os.path.getsize(db.DB_PATH + sfx) for sfx in ("", "-wal") if os.path.exists(db.DB_PATH + sfx))
+
+def _vacuum(convert: bool, pause: float) -> dict:
+    with db._db.read() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        if not convert:
+            return {"vacuum": "skipped: database is not in incremental auto_vacuum mode (run with --convert once)"}
+        # one-off full VACUUM to switch modes; blocks writers for its duration
+        with db._db._wlock:
+            conn = db._db._writer_conn()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        return {"vacuum": "converted to incremental (full VACUUM)"}
+    pages = 0
+    while True:
+        with db._db._wlock:
+            conn = db._db._writer_conn()
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            n = min(free, VACUUM_PAGES)
+            conn.execute(f"PRAGMA incremental_vacuum({n})").fetchall()
+        pages += n
+        time.sleep(pause)
+    with db._db._wlock:
+        # hand the shrunk file back to the filesystem (the WAL keeps the pages otherwise)
+        db._db._writer_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return {"vacuum_pages": pages}
+
+async def run_periodically(interval_hours: float, first_delay: float = 600.0):
+    # scheduled from bot.startup(); runs in a thread so the loop stays free
+    await asyncio.sleep(first_delay)
+    while True:
+        try:
+            report = await asyncio.to_thread(compact)
+            print("Compaction:", json.dumps(report, ensure_ascii=False))
+        except Exception as e:
+            print("Compaction failed:", repr(e))
+        await asyncio.sleep(interval_hours * 3600)
+
+_task = None
+
+def start(cfg: dict = None):
+    # COMPACT_INTERVAL_HOURS=0 disables the schedule (the CLI still works)
+    global _task
+    cfg = cfg or os.environ
+    hours = float(cfg.get("COMPACT_INTERVAL_HOURS", "24"))
+    if _task is None and hours > 0:
+        _task = asyncio.ensure_future(run_periodically(hours))
+    return _task
+
+async def stop():
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Trim old events/audit rows and reclaim space")
+    ap.add_argument("--events-days", type=int, default=EVENTS_DAYS)
+    ap.add_argument("--audit-days", type=int, default=AUDIT_DAYS)
+    ap.add_argument("--file-id-days", type=int, default=FILE_ID_DAYS)
+    ap.add_argument("--batch", type=int, default=BATCH)
+    ap.add_argument("--pause-ms", type=int, default=PAUSE_MS)
+    ap.add_argument("--convert", action="store_true", help="switch an old database to incremental auto_vacuum (one full VACUUM)")
+    ap.add_argument("--dry-run", action="store_true", help="count what would be removed, change nothing")
+    args = ap.parse_args(argv)
+    db.init_db()
+    try:
+        report = compact(args.events_days, args.audit_days, args.file_id_days, args.batch, args.pause_ms,
+                         convert=args.convert, dry_run=args.dry_run)
+    finally:
+        db.close_db()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,235 @@
 # -*- coding: utf-8 -*-
-import sqlite3, time, threading, os
+import sqlite3, time, threading, os, queue, asyncio
+import concurrent.futures as cf
+from contextlib import contextmanager
 from pathlib import Path
 
+from achievements import newly_earned_achievements
+from leaderboard import LeaderboardCache, ChatBoard, RING_DAYS
+from userdir import UserDirectory
+import metrics
+
 DB_PATH = os.environ.get("DB_PATH", "./data/fartbot.sqlite3")
 Path(os.path.dirname(DB_PATH)).mkdir(parents=True, exist_ok=True)
 
-_lock = threading.Lock()
+DB_READERS = int(os.environ.get("DB_READERS", "4"))
+DB_CACHE_KB = int(os.environ.get("DB_CACHE_KB", "16384"))
+DB_MMAP_MB = int(os.environ.get("DB_MMAP_MB", "64"))
+LEADERBOARD_CACHE = os.environ.get("LEADERBOARD_CACHE", "1") not in ("0", "false", "no")
+LEADERBOARD_MAX_CHATS = int(os.environ.get("LEADERBOARD_MAX_CHATS", "1000"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "50000"))  # 0 disables the user directory
+
+class ConnectionManager:
+    # one long-lived writer (serialized by a lock) + a small pool of read-only
+    # connections; with WAL the readers never wait for the writer
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.max_readers = max(1, readers)
+        self._writer = None
+        self._wlock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._olock = threading.Lock()
+        self._after_commit = []
+
+    def _open(self, readonly: bool):
+        if readonly:
+            uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            # only takes effect on a new file; existing ones are converted by compaction.py
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _writer_conn(self):
+        if self._writer is None:
+            self._writer = self._open(readonly=False)
+        return self._writer
+
+    @contextmanager
+    def write(self):
+        t0 = time.perf_counter()
+        with self._wlock:
+            metrics.DB_LOCK_WAIT.observe(time.perf_counter() - t0)
+            conn = self._writer_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            self._after_commit = []
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+                # still under the writer lock, so in-memory mirrors see commits in order
+                for fn in self._after_commit:
+                    fn()
+            finally:
+                self._after_commit = []
+
+    def after_commit(self, fn):
+        # only valid inside write(); dropped if the transaction rolls back
+        self._after_commit.append(fn)
+
+    @contextmanager
+    def read(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._olock:
+                if self._opened < self.max_readers:
+                    if self._writer is None:
+                        with self._wlock:
+                            self._writer_conn()  # creates the file and switches it to WAL
+                    conn = self._open(readonly=True)
+                    self._opened += 1
+            if conn is None:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        with self._wlock:
+            if self._writer is not None:
+                try:
+                    self._writer.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                self._writer.close()
+                self._writer = None
+        with self._olock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._opened = 0
+
+_db = ConnectionManager(DB_PATH)
+_boards = LeaderboardCache(max_chats=LEADERBOARD_MAX_CHATS) if LEADERBOARD_CACHE else None
+_users = UserDirectory(USER_CACHE_SIZE) if USER_CACHE_SIZE > 0 else None
+_log_sink = None
+
+def set_log_sink(sink):
+    # takes over events/audit_log inserts while sink.accepting() (see writebehind.py);
+    # rows are handed over only after the surrounding transaction commits
+    global _log_sink
+    _log_sink = sink
+_executor = cf.ThreadPoolExecutor(max_workers=DB_READERS + 1, thread_name_prefix="db")
+
+def close_db():
+    _db.close()
+
+def set_db_path(path: str):
+    # point the module at another database file (benchmarks, restores)
+    global DB_PATH, _db
+    _db.close()
+    DB_PATH = path
+    _db = ConnectionManager(path)
+    if _boards is not None:
+        _boards.clear()
+    if _users is not None:
+        _users.clear()
+
+async def run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+
+# schema changes applied once, in order, tracked by PRAGMA user_version
+_MIGRATIONS = [
+    # 1: covering index for windowed event scans, all-time top index and the
+    #    per-day rollup used by /top N, backfilled from the existing events
+    """
+    CREATE INDEX IF NOT EXISTS idx_events_chat_kind_ts ON events(chat_id, kind, ts, user_id, amount);
+    CREATE INDEX IF NOT EXISTS idx_stats_chat_farts ON stats(chat_id, farts_count DESC);
+    CREATE TABLE IF NOT EXISTS daily_totals(
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        farts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, day, user_id)
+    ) WITHOUT ROWID;
+    DELETE FROM daily_totals;
+    INSERT INTO daily_totals(chat_id, user_id, day, farts)
+        SELECT chat_id, user_id, ts / 86400, SUM(amount) FROM events
+        WHERE kind='fart' GROUP BY chat_id, user_id, ts / 86400;
+    """,
+    # 2: persistent classifier result cache (see result_cache.py)
+    """
+    CREATE TABLE IF NOT EXISTS classify_cache(
+        key TEXT PRIMARY KEY,
+        result TEXT NOT NULL,
+        ts INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_classify_cache_ts ON classify_cache(ts);
+    """,
+    # 3: small key/value state (update_id high-water mark, see dedup.py)
+    """
+    CREATE TABLE IF NOT EXISTS kv(
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL,
+        ts INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    """,
+]
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for v, script in enumerate(_MIGRATIONS, start=1):
+        if v <= version:
+            continue
+        try:
+            conn.executescript(f"BEGIN IMMEDIATE;{script}PRAGMA user_version={v};COMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        print(f"DB migrated to schema v{v}")
+
+_EVENT_SQL = "INSERT INTO events(chat_id,user_id,kind,amount,ts,file_id) VALUES(?,?,?,?,?,?)"
+_AUDIT_SQL = "INSERT INTO audit_log(chat_id,target_user_id,action,delta,admin_user_id,ts,note) VALUES(?,?,?,?,?,?,?)"
+
+def _insert_event(conn, row: tuple):
+    sink = _log_sink
+    if sink is not None and sink.accepting():
+        _db.after_commit(lambda: sink.submit("events", row))
+    else:
+        conn.execute(_EVENT_SQL, row)
+
+def _insert_audit(conn, row: tuple):
+    sink = _log_sink
+    if sink is not None and sink.accepting():
+        _db.after_commit(lambda: sink.submit("audit_log", row))
+    else:
+        conn.execute(_AUDIT_SQL, row)
+
+def insert_log_rows(events, audits):
+    with _db.write() as conn:
+        if events:
+            conn.executemany(_EVENT_SQL, events)
+        if audits:
+            conn.executemany(_AUDIT_SQL, audits)
 
-def _connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+def _bump_daily(conn, chat_id: int, user_id: int, amount: int, ts: int):
+    conn.execute("""INSERT INTO daily_totals(chat_id, user_id, day, farts) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(chat_id, day, user_id) DO UPDATE SET farts = farts + excluded.farts
+                 """, (chat_id, user_id, ts // 86400, amount))
 
 def init_db():
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.executescript("""
-        PRAGMA journal_mode=WAL;
+    with _db._wlock:
+        conn = _db._writer_conn()
+        conn.executescript("""
         CREATE TABLE IF NOT EXISTS users(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             chat_id INTEGER NOT NULL,
@@ -65,134 +277,259 @@ def init_db():
             note TEXT
         );
         """)
-        conn.commit()
-        conn.close()
+        _migrate(conn)
+
+def _names(user) -> tuple:
+    return (user.username, user.first_name, user.last_name)
+
+def _known(chat_id: int, user) -> bool:
+    # member already in `users` (and `stats`) with exactly these names
+    return _users is not None and _users.get(chat_id, user.id) == _names(user)
+
+def _upsert_user(conn, chat_id: int, user, now: int):
+    # new member, or names changed since they were written; unchanged rows are not rewritten
+    names = _names(user)
+    conn.execute("""INSERT INTO users(chat_id, user_id, username, first_name, last_name, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(chat_id, user_id) DO UPDATE
+                    SET username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name
+                    WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
+                       OR last_name IS NOT excluded.last_name
+                 """, (chat_id, user.id, *names, now))
+    if _users is not None:
+        _db.after_commit(lambda: _users.put(chat_id, user.id, names))
 
 def ensure_user(chat_id: int, user):
+    if _known(chat_id, user):
+        return
     now = int(time.time())
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("""INSERT OR IGNORE INTO users(chat_id, user_id, username, first_name, last_name, created_at)
-                       VALUES (?, ?, ?, ?, ?, ?)
-                   """, (chat_id, user.id, user.username, user.first_name, user.last_name, now))
-        cur.execute("""INSERT OR IGNORE INTO stats(chat_id, user_id, farts_count, whips_count, updated_at)
-                       VALUES (?, ?, 0, 0, ?)
-                   """, (chat_id, user.id, now))
-        conn.commit()
-        conn.close()
+    with _db.write() as conn:
+        _upsert_user(conn, chat_id, user, now)
+        cur = conn.execute("""INSERT OR IGNORE INTO stats(chat_id, user_id, farts_count, whips_count, updated_at)
+                              VALUES (?, ?, 0, 0, ?)
+                           """, (chat_id, user.id, now))
+        if cur.rowcount and _boards is not None:
+            _db.after_commit(lambda: _boards.set_total(chat_id, user.id, 0))
 
 def add_event(chat_id: int, user_id: int, kind: str, amount: int = 1, file_id: str = None):
     now = int(time.time())
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO events(chat_id,user_id,kind,amount,ts,file_id) VALUES(?,?,?,?,?,?)",
-                    (chat_id, user_id, kind, amount, now, file_id))
+    with _db.write() as conn:
+        _insert_event(conn, (chat_id, user_id, kind, amount, now, file_id))
         if kind == 'fart':
-            cur.execute("UPDATE stats SET farts_count = farts_count + ?, updated_at=? WHERE chat_id=? AND user_id=?",
-                        (amount, now, chat_id, user_id))
+            _bump_daily(conn, chat_id, user_id, amount, now)
+            row = conn.execute("UPDATE stats SET farts_count = farts_count + ?, updated_at=? WHERE chat_id=? AND user_id=? RETURNING farts_count",
+                               (amount, now, chat_id, user_id)).fetchall()
+            if _boards is not None:
+                _db.after_commit(lambda: _sync_board(chat_id, user_id, amount, now, row[0][0] if row else None))
         elif kind == 'whip':
-            cur.execute("UPDATE stats SET whips_count = whips_count + ?, updated_at=? WHERE chat_id=? AND user_id=?",
-                        (amount, now, chat_id, user_id))
-        conn.commit()
-        conn.close()
+            conn.execute("UPDATE stats SET whips_count = whips_count + ?, updated_at=? WHERE chat_id=? AND user_id=?",
+                         (amount, now, chat_id, user_id))
 
 def inc_dec_stat(chat_id: int, user_id: int, field: str, delta: int):
     assert field in ('farts_count','whips_count')
     now = int(time.time())
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute(f"UPDATE stats SET {field} = MAX(0, {field} + ?), updated_at=? WHERE chat_id=? AND user_id=?",
-                    (delta, now, chat_id, user_id))
-        conn.commit()
-        conn.close()
+    with _db.write() as conn:
+        row = conn.execute(f"UPDATE stats SET {field} = MAX(0, {field} + ?), updated_at=? WHERE chat_id=? AND user_id=? RETURNING {field}",
+                           (delta, now, chat_id, user_id)).fetchall()
+        if row and field == 'farts_count' and _boards is not None:
+            _db.after_commit(lambda: _boards.set_total(chat_id, user_id, row[0][0]))
 
 def get_stats(chat_id: int, user_id: int):
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT farts_count, whips_count FROM stats WHERE chat_id=? AND user_id=?",
-                    (chat_id, user_id))
-        row = cur.fetchone()
-        conn.close()
+    with _db.read() as conn:
+        row = conn.execute("SELECT farts_count, whips_count FROM stats WHERE chat_id=? AND user_id=?",
+                           (chat_id, user_id)).fetchone()
     if row is None:
         return {"farts": 0, "whips": 0}
     return {"farts": row[0], "whips": row[1]}
 
+def _sync_board(chat_id: int, user_id: int, amount: int, ts: int, total):
+    _boards.add_event(chat_id, user_id, amount, ts)
+    if total is not None:
+        _boards.set_total(chat_id, user_id, total)
+
+def _load_board(chat_id: int, today: int):
+    # under the writer lock so no commit can slip between the snapshot and put()
+    with _db._wlock:
+        conn = _db._writer_conn()
+        totals = dict(conn.execute("SELECT user_id, farts_count FROM stats WHERE chat_id=?", (chat_id,)).fetchall())
+        daily = {}
+        for day, uid, n in conn.execute("SELECT day, user_id, farts FROM daily_totals WHERE chat_id=? AND day>?",
+                                        (chat_id, today - RING_DAYS)):
+            daily.setdefault(day, {})[uid] = n
+        _boards.put(chat_id, ChatBoard(totals, daily, today))
+
 def get_top(chat_id: int, days: int = 7, limit: int = 10):
-    now = int(time.time())
-    after = now - days*86400 if days else 0
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
+    # windowed tops come from the daily rollup: the last `days` full UTC days
+    # plus today's partial bucket, so the cost does not grow with the event log
+    today = int(time.time()) // 86400
+    if _boards is not None and 0 <= days < RING_DAYS:
+        rows = _boards.top(chat_id, days, limit, today)
+        if rows is None:
+            _load_board(chat_id, today)
+            rows = _boards.top(chat_id, days, limit, today)
+        if rows is not None:
+            return [(uid, int(total)) for uid, total in rows]
+    with _db.read() as conn:
         if days:
-            cur.execute("""SELECT user_id, SUM(amount) as total
-                           FROM events
-                           WHERE chat_id=? AND kind='fart' AND ts>=?
-                           GROUP BY user_id
-                           ORDER BY total DESC
-                           LIMIT ?
-                        """, (chat_id, after, limit))
+            since = today - days
+            rows = conn.execute("""SELECT user_id, SUM(farts) as total
+                                   FROM daily_totals
+                                   WHERE chat_id=? AND day>=?
+                                   GROUP BY user_id
+                                   ORDER BY total DESC
+                                   LIMIT ?
+                                """, (chat_id, since, limit)).fetchall()
         else:
-            cur.execute("""SELECT user_id, farts_count as total
-                           FROM stats
-                           WHERE chat_id=?
-                           ORDER BY total DESC
-                           LIMIT ?
-                        """, (chat_id, limit))
-        rows = cur.fetchall()
-        conn.close()
+            rows = conn.execute("""SELECT user_id, farts_count as total
+                                   FROM stats
+                                   WHERE chat_id=?
+                                   ORDER BY total DESC
+                                   LIMIT ?
+                                """, (chat_id, limit)).fetchall()
     return [(r[0], int(r[1])) for r in rows]
 
+def _display(user_id: int, username, first_name, last_name) -> str:
+    if username:
+        return '@' + username
+    full = (first_name or '') + ' ' + (last_name or '')
+    return full.strip() or str(user_id)
+
 def get_usernames(chat_id: int, user_ids):
     if not user_ids:
         return {}
-    qmarks = ','.join('?' for _ in user_ids)
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute(f"SELECT user_id, username, first_name, last_name FROM users WHERE chat_id=? AND user_id IN ({qmarks})",
-                    (chat_id, *user_ids))
-        rows = cur.fetchall()
-        conn.close()
-    res = {}
-    for r in rows:
-        uname = r['username']
-        if uname:
-            res[r['user_id']] = '@' + uname
-        else:
-            full = (r['first_name'] or '') + ' ' + (r['last_name'] or '')
-            res[r['user_id']] = full.strip() or str(r['user_id'])
-    return res
+    found, missing = _users.lookup(chat_id, user_ids) if _users is not None else ({}, list(user_ids))
+    if missing:
+        qmarks = ','.join('?' for _ in missing)
+        with _db.read() as conn:
+            rows = conn.execute(f"SELECT user_id, username, first_name, last_name FROM users WHERE chat_id=? AND user_id IN ({qmarks})",
+                                (chat_id, *missing)).fetchall()
+        for r in rows:
+            names = (r['username'], r['first_name'], r['last_name'])
+            found[r['user_id']] = names
+            if _users is not None:
+                _users.put(chat_id, r['user_id'], names)
+    return {uid: _display(uid, *names) for uid, names in found.items()}
 
 def save_achievement(chat_id: int, user_id: int, key: str, threshold: int):
     now = int(time.time())
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("""INSERT OR IGNORE INTO achievements_awarded(chat_id,user_id,achievement_key,threshold,ts)
-                       VALUES(?,?,?,?,?)""", (chat_id, user_id, key, threshold, now))
-        conn.commit()
-        conn.close()
+    with _db.write() as conn:
+        conn.execute("""INSERT OR IGNORE INTO achievements_awarded(chat_id,user_id,achievement_key,threshold,ts)
+                        VALUES(?,?,?,?,?)""", (chat_id, user_id, key, threshold, now))
 
 def has_achievement(chat_id: int, user_id: int, key: str) -> bool:
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM achievements_awarded WHERE chat_id=? AND user_id=? AND achievement_key=?",
-                    (chat_id, user_id, key))
-        ok = cur.fetchone() is not None
-        conn.close()
-    return ok
+    with _db.read() as conn:
+        row = conn.execute("SELECT 1 FROM achievements_awarded WHERE chat_id=? AND user_id=? AND achievement_key=?",
+                           (chat_id, user_id, key)).fetchone()
+    return row is not None
 
 def log_admin_action(chat_id: int, target_user_id: int, action: str, delta: int, admin_user_id: int, note: str = None):
     now = int(time.time())
-    with _lock:
-        conn = _connect()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO audit_log(chat_id,target_user_id,action,delta,admin_user_id,ts,note) VALUES(?,?,?,?,?,?,?)",
-                    (chat_id, target_user_id, action, delta, admin_user_id, now, note))
-        conn.commit()
-        conn.close()
+    with _db.write() as conn:
+        _insert_audit(conn, (chat_id, target_user_id, action, delta, admin_user_id, now, note))
+
+def record_detection(chat_id: int, user, file_id: str = None, amount: int = 1, mark: tuple = None):
+    # whole voice hot path in one transaction: user upsert, event + audit rows,
+    # counter bump and the achievements it crossed. Returns what the reply needs.
+    # mark = (kv key, value) is stored like kv_set_max in the same transaction
+    # (dedup.mark: the clip's update_id is marked exactly when it is counted)
+    now = int(time.time())
+    known = _known(chat_id, user)
+    with _db.write() as conn:
+        if not known:
+            _upsert_user(conn, chat_id, user, now)
+        _insert_event(conn, (chat_id, user.id, 'fart', amount, now, file_id))
+        _insert_audit(conn, (chat_id, user.id, 'autodetect', amount, None, now, None))
+        _bump_daily(conn, chat_id, user.id, amount, now)
+        farts, whips = conn.execute("""INSERT INTO stats(chat_id, user_id, farts_count, whips_count, updated_at)
+                                       VALUES (?, ?, ?, 0, ?)
+                                       ON CONFLICT(chat_id, user_id) DO UPDATE
+                                       SET farts_count = farts_count + excluded.farts_count, updated_at = excluded.updated_at
+                                       RETURNING farts_count, whips_count
+                                    """, (chat_id, user.id, amount, now)).fetchall()[0]
+        earned = []
+        for a in newly_earned_achievements(farts - amount, farts):
+            inserted = conn.execute("""INSERT OR IGNORE INTO achievements_awarded(chat_id,user_id,achievement_key,threshold,ts)
+                                       VALUES(?,?,?,?,?) RETURNING id""",
+                                    (chat_id, user.id, a['key'], a['threshold'], now)).fetchall()
+            if inserted:
+                earned.append(a)
+        if mark is not None:
+            _kv_max(conn, mark[0], mark[1], now)
+        if _boards is not None:
+            _db.after_commit(lambda: _sync_board(chat_id, user.id, amount, now, farts))
+    return {"farts": farts, "whips": whips, "earned": earned}
+
+def verify_leaderboard(chat_id: int):
+    # compares the in-memory board with SQLite; returns a list of mismatches (empty = consistent)
+    if _boards is None or _boards.get(chat_id) is None:
+        return []
+    today = int(time.time()) // 86400
+    problems = []
+    with _db._wlock:
+        conn = _db._writer_conn()
+        with _boards.lock:
+            board = _boards.get(chat_id)
+            db_totals = dict(conn.execute("SELECT user_id, farts_count FROM stats WHERE chat_id=?", (chat_id,)).fetchall())
+            if db_totals != board.totals:
+                problems.append(("totals", db_totals, dict(board.totals)))
+            for days in (7, 30):
+                db_win = dict(conn.execute("SELECT user_id, SUM(farts) FROM daily_totals WHERE chat_id=? AND day>=? GROUP BY user_id",
+                                           (chat_id, today - days)).fetchall())
+                mem_win = board.window(days, today)
+                if db_win != mem_win:
+                    problems.append((f"window_{days}", db_win, mem_win))
+    return problems
+
+def cache_get(key: str, min_ts: int = 0):
+    with _db.read() as conn:
+        row = conn.execute("SELECT result FROM classify_cache WHERE key=? AND ts>=?", (key, min_ts)).fetchone()
+    return row[0] if row else None
+
+def cache_put(key: str, result: str):
+    with _db.write() as conn:
+        conn.execute("INSERT OR REPLACE INTO classify_cache(key, result, ts) VALUES(?,?,?)", (key, result, int(time.time())))
+
+def cache_prune(max_age: int, max_rows: int) -> int:
+    with _db.write() as conn:
+        n = conn.execute("DELETE FROM classify_cache WHERE ts<?", (int(time.time()) - max_age,)).rowcount
+        n += conn.execute("""DELETE FROM classify_cache WHERE key IN
+                             (SELECT key FROM classify_cache ORDER BY ts DESC LIMIT -1 OFFSET ?)""", (max_rows,)).rowcount
+    return n
+
+def user_cache_stats():
+    return _users.stats() if _users is not None else None
+
+def kv_get(key: str):
+    # -> (value, ts) or None
+    with _db.read() as conn:
+        row = conn.execute("SELECT value, ts FROM kv WHERE key=?", (key,)).fetchone()
+    return (row[0], row[1]) if row else None
+
+def _kv_max(conn, key: str, value: int, now: int):
+    conn.execute("""INSERT INTO kv(key, value, ts) VALUES(?,?,?)
+                    ON CONFLICT(key) DO UPDATE SET value=MAX(value, excluded.value), ts=excluded.ts
+                 """, (key, value, now))
+
+def kv_set_max(key: str, value: int):
+    # stores max(old, value); ts is refreshed on every call
+    with _db.write() as conn:
+        _kv_max(conn, key, value, int(time.time()))
+
+def _async(fn):
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = fn.__name__ + "_async"
+    return wrapper
+
+# awaitable variants for handlers: the query runs on the db thread pool, not the event loop
+ensure_user_async = _async(ensure_user)
+add_event_async = _async(add_event)
+inc_dec_stat_async = _async(inc_dec_stat)
+get_stats_async = _async(get_stats)
+get_top_async = _async(get_top)
+get_usernames_async = _async(get_usernames)
+save_achievement_async = _async(save_achievement)
+has_achievement_async = _async(has_achievement)
+log_admin_action_async = _async(log_admin_action)
+record_detection_async = _async(record_detection)
+kv_set_max_async = _async(kv_set_max)
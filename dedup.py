@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Drops Telegram updates that were already seen: webhook redeliveries (Telegram
+# did not get our answer in time) via a bounded window of recent update_ids and,
+# after a restart, anything at or below the persisted update_id high-water mark.
+# The mark is only trusted if it is fresh: Telegram restarts update_id from a
+# random value after a week without updates. A counted voice note's update_id
+# goes into record_detection's own transaction (mark()), so a clip is marked
+# exactly when it is counted and a crash can never let it count twice. Other
+# updates are marked every DEDUP_FLUSH_SEC seconds and at shutdown, with no
+# SQLite write of their own.
+import asyncio, os, sqlite3, time
+from collections import deque
+
+import db, metrics
+from sharding import WORKER_ENV
+
+HWM_KEY = "update_id_hwm"
+
+class UpdateDedup:
+    def __init__(self, window: int = 10000, persist: bool = True, hwm_ttl: int = 86400):
+        self.window = max(1, window)
+        self.persist = persist
+        self.hwm_ttl = hwm_ttl
+        self.hwm = None  # high-water mark left by the previous run
+        self.latest = None  # highest update_id accepted in this run
+        self._saved = None
+        self._ring = deque()
+        self._seen = set()
+        self.duplicates = 0
+
+    def load(self):
+        if not self.persist:
+            return
+        row = db.kv_get(HWM_KEY)
+        if row and time.time() - row[1] <= self.hwm_ttl:
+            self.hwm = row[0]
+
+    def check(self, update_id: int):
+        # marks update_id as seen; returns why it is a duplicate, or None
+        if update_id in self._seen:
+            return "window"
+        if self.hwm is not None and update_id <= self.hwm:
+            return "hwm"
+        self._seen.add(update_id)
+        self._ring.append(update_id)
+        if self.latest is None or update_id > self.latest:
+            self.latest = update_id
+        if len(self._ring) > self.window:
+            self._seen.discard(self._ring.popleft())
+        return None
+
+    async def __call__(self, handler, update, data):
+        reason = self.check(update.update_id)
+        if reason is not None:
+            self.duplicates += 1
+            metrics.DUPLICATE_UPDATES.inc(reason)
+            return None
+        return await handler(update, data)
+
+    async def flush(self):
+        latest = self.latest
+        if not self.persist or latest is None or latest == self._saved:
+            return
+        try:
+            await db.kv_set_max_async(HWM_KEY, latest)
+            self._saved = latest
+        except sqlite3.Error as e:
+            print("update_id mark not saved:", e)
+
+    def stats(self) -> dict:
+        return {"window": len(self._ring), "duplicates": self.duplicates}
+
+_instance = None
+_task = None
+_marking = False
+
+async def _flush_periodically(seconds: float):
+    while True:
+        await asyncio.sleep(seconds)
+        await _instance.flush()
+
+def start(cfg: dict = None):
+    # DEDUP_WINDOW=0 disables it; DEDUP_PERSIST=0 keeps the window in memory only;
+    # DEDUP_FLUSH_SEC is how often the mark is written
+    global _instance, _task, _marking
+    cfg = cfg or os.environ
+    window = int(cfg.get("DEDUP_WINDOW", "10000"))
+    persist = cfg.get("DEDUP_PERSIST", "1") not in ("0", "false", "no")
+    # shard workers run without a window (the front deduplicates), but their
+    # marks are what the front loads after a restart
+    _marking = persist and (window > 0 or bool(os.environ.get(WORKER_ENV)))
+    if _instance is not None or window <= 0:
+        return _instance
+    _instance = UpdateDedup(window=window, persist=persist,
+                            hwm_ttl=int(cfg.get("DEDUP_HWM_TTL", "86400")))
+    _instance.load()
+    if _instance.persist:
+        _task = asyncio.ensure_future(_flush_periodically(float(cfg.get("DEDUP_FLUSH_SEC", "5"))))
+    return _instance
+
+async def stop():
+    # writes the final mark; call before the database is closed
+    global _instance, _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    dd, _instance = _instance, None
+    if dd is not None:
+        await dd.flush()
+
+def mark(update_id):
+    # -> the mark for db.record_detection to store with the clip, or None
+    if not _marking or update_id is None:
+        return None
+    return (HWM_KEY, update_id)
+
+async def middleware(handler, update, data):
+    # registered once as dp.update outer middleware; a no-op until start()
+    if _instance is None:
+        return await handler(update, data)
+    return await _instance(handler, update, data)
+
+def stats():
+    return _instance.stats() if _instance is not None else None
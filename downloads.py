@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Voice/audio downloads: one getFile call, then the file is streamed over the
+# bot's pooled aiohttp session into a buffer that is abandoned as soon as it
+# grows past the byte cap for its kind (derived from MAX_VOICE_SECONDS).
+# DOWNLOAD_CONCURRENCY bounds how many downloads run at once.
+import asyncio, os
+
+import aiohttp
+
+MAX_SEC = int(os.environ.get("MAX_VOICE_SECONDS", "12"))
+MAX_BYTES = int(os.environ.get("DOWNLOAD_MAX_BYTES", "0"))  # >0 overrides the derived caps
+TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", "30"))
+CHUNK = 64 * 1024
+
+# generous upper bitrates (kbit/s): Telegram voice notes are ~32 kbit/s Opus,
+# audio files may be 320 kbit/s MP3, video notes carry video
+KBPS = {"voice": 128, "audio": 320, "video_note": 2500}
+HEADROOM = 64 * 1024  # container headers, cover art
+
+_sem = asyncio.Semaphore(int(os.environ.get("DOWNLOAD_CONCURRENCY", "8")))
+
+class TooLarge(Exception):
+    pass
+
+def byte_cap(kind: str, seconds: int = MAX_SEC) -> int:
+    if MAX_BYTES > 0:
+        return MAX_BYTES
+    return seconds * KBPS.get(kind, KBPS["audio"]) * 1000 // 8 + HEADROOM
+
+def _read_local(path: str, cap: int) -> bytes:
+    # local Bot API server (--local): files are on our disk already
+    if os.path.getsize(path) > cap:
+        raise TooLarge(f"{path} exceeds {cap} bytes")
+    with open(path, "rb") as f:
+        return f.read()
+
+async def fetch(bot, media, kind: str) -> bytes:
+    cap = byte_cap(kind)
+    if media.file_size and media.file_size > cap:
+        raise TooLarge(f"{media.file_size} bytes > {cap}")
+    async with _sem:
+        f = await bot.get_file(media.file_id)
+        if f.file_size and f.file_size > cap:
+            raise TooLarge(f"{f.file_size} bytes > {cap}")
+        api = bot.session.api
+        if api.is_local:
+            return await asyncio.to_thread(_read_local, str(api.wrap_local_file.to_local(f.file_path)), cap)
+        session = await bot.session.create_session()
+        url = api.file_url(bot.token, f.file_path)
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
+            resp.raise_for_status()
+            if resp.content_length and resp.content_length > cap:
+                raise TooLarge(f"{resp.content_length} bytes > {cap}")
+            buf = bytearray()
+            async for chunk in resp.content.iter_chunked(CHUNK):
+                buf += chunk
+                if len(buf) > cap:
+                    raise TooLarge(f"more than {cap} bytes")
+        return bytes(buf)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Single-pass framewise feature engine for the heuristic classifier.
+# The signal is framed once (64 ms Hann frames, 16 ms hop, centered as in
+# librosa) and every feature is read from that one pass:
+#   - low (20-250 Hz) / mid (250-2000 Hz) band energy from the power spectrum
+#   - spectral rolloff (85%) from the magnitude spectrum
+#   - zero-crossing rate from the central half of each frame
+# Everything of interest is below 2 kHz, so the extractor also runs on
+# decimated audio (e.g. 8 kHz); frame geometry scales with the rate and the
+# ZCR is rescaled to the 32 kHz reference the thresholds were tuned on.
+# LogMelExtractor reuses the same framing for the trained model (model mode):
+# per-clip mean/std/mean |delta| of log mel band energies, through a
+# precomputed filterbank matrix.
+# fingerprint() condenses a clip into 32 bytes for the near-duplicate index
+# (fingerprints.py); it runs in the decode job, before any classifier.
+from functools import lru_cache
+import numpy as np
+
+REF_SR = 32000
+FRAME_SEC = 2048 / REF_SR
+HOP_SEC = 512 / REF_SR
+LOW_BAND = (20, 250)
+MID_BAND = (250, 2000)
+ROLL_PERCENT = 0.85
+
+@lru_cache(maxsize=8)
+def _plan(sr: int):
+    n_fft = int(round(FRAME_SEC * sr))
+    hop = int(round(HOP_SEC * sr))
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+    def band(fmin, fmax):
+        idx = np.flatnonzero((freqs >= fmin) & (freqs < fmax))
+        return slice(int(idx[0]), int(idx[-1]) + 1) if len(idx) else slice(0, 0)
+    return n_fft, hop, window, freqs, band(*LOW_BAND), band(*MID_BAND)
+
+def normalize(y: np.ndarray) -> np.ndarray:
+    peak = float(np.max(np.abs(y))) if len(y) else 0.0
+    return y / peak if peak > np.finfo(np.float32).tiny else y
+
+def _layout(clips, n_fft: int, hop: int):
+    # all clips, each centre-padded, in one buffer; frames are gathered per chunk
+    # so the full frame matrix is never materialized
+    pad = n_fft // 2
+    sig = np.concatenate([np.pad(np.asarray(y, dtype=np.float32), pad) for y in clips])
+    counts, offsets, base = [], [], 0
+    for y in clips:
+        k = 1 + len(y) // hop
+        counts.append(k)
+        offsets.append(base + hop * np.arange(k))
+        base += len(y) + 2 * pad
+    return sig, np.concatenate(offsets), counts
+
+def lowpass_decimate(y: np.ndarray, factor: int, taps: int = 63) -> np.ndarray:
+    # windowed-sinc anti-alias FIR followed by plain downsampling
+    n = np.arange(taps) - (taps - 1) / 2
+    h = np.sinc(n / factor) * np.hamming(taps)
+    h /= h.sum()
+    return np.convolve(y, h.astype(np.float32), mode="same")[::factor]
+
+class FeatureExtractor:
+    def __init__(self, sr: int = REF_SR, chunk_frames: int = 128):
+        self.sr = sr
+        self.chunk_frames = chunk_frames
+
+    def extract(self, y: np.ndarray) -> dict:
+        return self.extract_batch([y])[0]
+
+    def extract_batch(self, clips) -> list:
+        # all clips' frames go through the same chunked rfft; per-clip means via reduceat
+        n_fft, hop, window, freqs, low_b, mid_b = _plan(self.sr)
+        sig, offsets, counts = _layout(clips, n_fft, hop)
+        ramp = np.arange(n_fft)
+        n = len(offsets)
+        low = np.empty(n)
+        mid = np.empty(n)
+        roll = np.empty(n)
+        zcr = np.empty(n)
+        q = n_fft // 4
+        for i in range(0, n, self.chunk_frames):
+            f = sig[offsets[i:i + self.chunk_frames, None] + ramp]
+            mag = np.abs(np.fft.rfft(f * window, axis=1))
+            power = mag * mag
+            low[i:i + len(f)] = power[:, low_b].sum(axis=1)
+            mid[i:i + len(f)] = power[:, mid_b].sum(axis=1)
+            cum = np.cumsum(mag, axis=1)
+            roll[i:i + len(f)] = freqs[np.argmax(cum >= ROLL_PERCENT * cum[:, -1:], axis=1)]
+            centre = f[:, q:q + 2 * q]
+            sign = np.signbit(centre) & (np.abs(centre) > 1e-10)
+            zcr[i:i + len(f)] = (sign[:, 1:] != sign[:, :-1]).sum(axis=1) / (2 * q)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp)
+        counts = np.asarray(counts, dtype=np.float64)
+        low_sum = np.add.reduceat(low, starts)
+        mid_sum = np.add.reduceat(mid, starts)
+        zcr_mean = np.add.reduceat(zcr, starts) / counts * (self.sr / REF_SR)
+        roll_mean = np.add.reduceat(roll, starts) / counts
+        return [
+            {"low": float(low_sum[k]), "mid": float(mid_sum[k]),
+             "low_ratio": float((low_sum[k] + 1e-9) / (mid_sum[k] + 1e-9)),
+             "zcr": float(zcr_mean[k]), "rolloff": float(roll_mean[k])}
+            for k in range(len(clips))
+        ]
+
+def _hz_to_mel(f):
+    return 2595.0 * np.log10(1.0 + np.asarray(f, dtype=np.float64) / 700.0)
+
+def _mel_to_hz(m):
+    return 700.0 * (10.0 ** (np.asarray(m, dtype=np.float64) / 2595.0) - 1.0)
+
+@lru_cache(maxsize=8)
+def mel_filterbank(sr: int, n_mels: int, fmin: float, fmax: float) -> np.ndarray:
+    # (n_bins, n_mels) triangular HTK-mel filters with unit area; bands too
+    # narrow for the FFT resolution fall back to their nearest bin
+    n_fft = _plan(sr)[0]
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+    edges = _mel_to_hz(np.linspace(_hz_to_mel(fmin), _hz_to_mel(min(fmax, sr / 2)), n_mels + 2))
+    fb = np.zeros((len(freqs), n_mels))
+    for m in range(n_mels):
+        lo, c, hi = edges[m:m + 3]
+        w = np.maximum(0.0, np.minimum((freqs - lo) / (c - lo), (hi - freqs) / (hi - c)))
+        if not w.any():
+            w[np.argmin(np.abs(freqs - c))] = 1.0
+        fb[:, m] = w / w.sum()
+    return fb.astype(np.float32)
+
+class LogMelExtractor:
+    def __init__(self, sr: int = REF_SR, n_mels: int = 32, fmin: float = 20.0, fmax: float = 4000.0,
+                 chunk_frames: int = 128):
+        self.sr = sr
+        self.n_mels = n_mels
+        self.fmin = fmin
+        self.fmax = fmax
+        self.chunk_frames = chunk_frames
+
+    @property
+    def dim(self) -> int:
+        return 3 * self.n_mels
+
+    def extract_batch(self, clips) -> np.ndarray:
+        # (len(clips), 3 * n_mels): mean, std and mean |frame-to-frame delta| per band
+        n_fft, hop, window = _plan(self.sr)[:3]
+        fb = mel_filterbank(self.sr, self.n_mels, self.fmin, self.fmax)
+        sig, offsets, counts = _layout(clips, n_fft, hop)
+        ramp = np.arange(n_fft)
+        logmel = np.empty((len(offsets), self.n_mels), dtype=np.float32)
+        for i in range(0, len(offsets), self.chunk_frames):
+            f = sig[offsets[i:i + self.chunk_frames, None] + ramp]
+            spec = np.fft.rfft(f * window, axis=1)
+            power = (spec.real * spec.real + spec.imag * spec.imag).astype(np.float32)
+            logmel[i:i + len(f)] = np.log(power @ fb + 1e-6)
+        out = np.empty((len(clips), self.dim), dtype=np.float32)
+        start = 0
+        for k, n in enumerate(counts):
+            x = logmel[start:start + n]
+            start += n
+            out[k, :self.n_mels] = x.mean(axis=0)
+            out[k, self.n_mels:2 * self.n_mels] = x.std(axis=0)
+            out[k, 2 * self.n_mels:] = np.abs(np.diff(x, axis=0)).mean(axis=0) if n > 1 else 0.0
+        return out
+
+FP_SEGMENTS = 16
+FP_SEGMENT_SEC = 0.25
+
+def fingerprint(y: np.ndarray, sr: int):
+    # 256-bit acoustic fingerprint, or None for silence. Two halves, both
+    # relative comparisons so gain and a flat channel cancel out:
+    #   time: mean log energy of 8 mel bands over 0.25 s segments counted from
+    #     the onset, above/below that band's median (16 segments x 8 bits)
+    #   spectrum: over the active span, slope sign between neighbouring bands of
+    #     a 65-band mel spectrum, and bands above their local mean (128 bits)
+    # Bytes 2k..2k+1 hold segment k's time bits and 8 spectral bits, so no
+    # 16-bit chunk is constant for short clips (the index keys on those chunks).
+    # Frames are _plan's 64 ms at a 32 ms hop; the segments are far coarser.
+    n_fft, hop, window = _plan(sr)[:3]
+    hop *= 2
+    y = np.asarray(y, dtype=np.float32)
+    if len(y) < n_fft:
+        y = np.pad(y, (0, n_fft - len(y)))
+    spec = np.fft.rfft(np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop] * window, axis=1)
+    power = (spec.real * spec.real + spec.imag * spec.imag).astype(np.float32)
+    coarse = power @ mel_filterbank(sr, 8, 50.0, 4000.0)
+    energy = np.convolve(coarse.sum(axis=1), np.ones(3, dtype=np.float32) / 3, mode="same")
+    active = np.flatnonzero(energy > energy.max() * 0.05)
+    if not len(active):
+        return None
+    s0, s1 = active[0], active[-1] + 1
+    per = max(1, int(round(FP_SEGMENT_SEC * sr / hop)))
+    logs = np.log(coarse[s0:s1][:FP_SEGMENTS * per] + 1e-9)
+    starts = np.arange(0, len(logs), per)
+    seg = np.add.reduceat(logs, starts) / np.diff(np.append(starts, len(logs)))[:, None]
+    t_bits = np.zeros((FP_SEGMENTS, 8), dtype=bool)
+    t_bits[:len(seg)] = seg > np.median(seg, axis=0)
+    m = np.log((power[s0:s1] @ mel_filterbank(sr, 65, 50.0, 4000.0)).mean(axis=0) + 1e-9)
+    slope = m[:-1] - m[1:]
+    local = np.convolve(m, np.ones(9) / 9, mode="same")[:-1]
+    f_bits = np.concatenate([slope > np.median(slope), m[:-1] > local]).reshape(FP_SEGMENTS, 8)
+    return np.packbits(np.concatenate([t_bits, f_bits], axis=1)).tobytes()
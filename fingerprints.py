@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Per-chat index of the acoustic fingerprints (features.fingerprint, 256 bits)
+# of recently accepted clips. A re-upload or re-recording of a counted clip
+# arrives with a new file_unique_id; its fingerprint is still within a few
+# dozen bits of the original, so it is caught after decoding, before the
+# classifier runs, and rejected (FP_POLICY=reject) or given the original's
+# verdict (FP_POLICY=cache).
+# Lookup is multi-index hashing: the 256 bits are 16 chunks of 16, and two
+# fingerprints at most FP_MAX_DISTANCE bits apart have some chunk at most
+# FP_MAX_DISTANCE // 16 bits apart (pigeonhole). Every (chunk, value) pair is a
+# key of one sorted table; a query probes the keys within that radius of its
+# own chunks and verifies the candidates by popcount, so the cost follows the
+# number of near keys, not the index size.
+# New entries go to a tail that is scanned directly and merged into the table
+# every `tail` inserts. Entries arrive in time order, so expiry (FP_TTL) and
+# the size bounds are one watermark per chat: rows below it are ignored and
+# dropped at the next merge.
+import os, time
+from collections import OrderedDict
+from itertools import combinations
+import numpy as np
+
+FP_BYTES = 32
+CHUNKS = 16
+_POPCOUNT = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+_CHUNK_KEYS = np.arange(CHUNKS, dtype=np.uint32) << 16
+
+def _flip_masks(radius: int) -> np.ndarray:
+    # all 16-bit values with at most `radius` bits set
+    masks = [0]
+    for r in range(1, min(radius, 16) + 1):
+        masks.extend(sum(1 << b for b in bits) for bits in combinations(range(16), r))
+    return np.array(masks, dtype=np.uint32)
+
+class ChatIndex:
+    def __init__(self, max_distance: int, ttl: float, max_items: int, tail: int = 256):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_items = max_items
+        self.tail = tail
+        self._masks = _flip_masks(max_distance // CHUNKS)
+        self._fps = np.empty((0, FP_BYTES), dtype=np.uint8)
+        self._ts = np.empty(0)
+        self._scores = np.empty(0, dtype=np.float32)
+        self._n = 0       # rows in use
+        self._low = 0     # rows below are expired or evicted
+        self._merged = 0  # rows below are in the sorted table, the rest is the tail
+        self._keys = np.empty(0, dtype=np.uint32)  # chunk << 16 | value, sorted
+        self._rows = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return self._n - self._low
+
+    def expire(self, now: float):
+        low = max(self._low, self._n - self.max_items)
+        low = max(low, int(np.searchsorted(self._ts[:self._n], now - self.ttl, side="left")))
+        self._low = min(low, self._n)
+
+    def trim(self, n: int):
+        self._low = min(self._n, self._low + n)
+
+    def nearest(self, fp: bytes, now: float):
+        # -> (distance, score) of the closest live entry within max_distance, or None
+        self.expire(now)
+        if self._n == self._low:
+            return None
+        q = np.frombuffer(fp, dtype=np.uint8)
+        cands = [np.arange(max(self._merged, self._low), self._n)]
+        if self._merged > self._low:
+            probes = ((_CHUNK_KEYS | q.view(">u2").astype(np.uint32))[:, None] ^ self._masks).ravel()
+            lo = np.searchsorted(self._keys, probes, side="left")
+            hi = np.searchsorted(self._keys, probes, side="right")
+            n = hi - lo
+            total = int(n.sum())
+            if total:
+                # all matching ranges of the table in one gather
+                rows = self._rows[np.repeat(lo - np.cumsum(n) + n, n) + np.arange(total)]
+                cands.append(rows[rows >= self._low])
+        rows = np.concatenate(cands)
+        if not len(rows):
+            return None
+        dist = _POPCOUNT[self._fps[rows].view(np.uint16) ^ q.view(np.uint16)].sum(axis=1, dtype=np.int32)
+        best = int(np.argmin(dist))
+        if dist[best] > self.max_distance:
+            return None
+        return int(dist[best]), float(self._scores[rows[best]])
+
+    def add(self, fp: bytes, score: float, now: float):
+        if self._n == len(self._ts):
+            self._grow()
+        i = self._n
+        # expiry needs non-decreasing timestamps
+        now = max(now, self._ts[i - 1]) if i else now
+        self._fps[i] = np.frombuffer(fp, dtype=np.uint8)
+        self._ts[i] = now
+        self._scores[i] = score
+        self._n += 1
+        self.expire(now)
+        if self._n - self._merged >= self.tail:
+            self._merge()
+
+    def _grow(self):
+        cap = max(16, 2 * (self._n - self._low))
+        if self._low:
+            self._compact()
+            if self._n < len(self._ts):
+                return
+        fps = np.empty((cap, FP_BYTES), dtype=np.uint8)
+        ts = np.empty(cap)
+        scores = np.empty(cap, dtype=np.float32)
+        fps[:self._n] = self._fps[:self._n]
+        ts[:self._n] = self._ts[:self._n]
+        scores[:self._n] = self._scores[:self._n]
+        self._fps, self._ts, self._scores = fps, ts, scores
+
+    def _compact(self):
+        # drop rows below the watermark; the table stays sorted, row numbers shift
+        low, n = self._low, self._n
+        self._fps[:n - low] = self._fps[low:n]
+        self._ts[:n - low] = self._ts[low:n]
+        self._scores[:n - low] = self._scores[low:n]
+        keep = self._rows >= low
+        self._keys = self._keys[keep]
+        self._rows = self._rows[keep] - low
+        self._n -= low
+        self._merged = max(0, self._merged - low)
+        self._low = 0
+
+    def _merge(self):
+        if self._low:
+            self._compact()
+        start, n = self._merged, self._n
+        chunks = self._fps[start:n].view(">u2").astype(np.uint32)
+        keys = (_CHUNK_KEYS | chunks).ravel()
+        rows = np.repeat(np.arange(start, n, dtype=np.int32), CHUNKS)
+        order = np.argsort(keys, kind="stable")
+        keys, rows = keys[order], rows[order]
+        pos = np.searchsorted(self._keys, keys)
+        self._keys = np.insert(self._keys, pos, keys)
+        self._rows = np.insert(self._rows, pos, rows)
+        self._merged = n
+
+class FingerprintIndex:
+    def __init__(self, max_distance: int = 30, ttl: float = 7 * 86400, max_items: int = 100000,
+                 chat_items: int = 20000, policy: str = "reject", tail: int = 256):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_items = max_items
+        self.chat_items = chat_items
+        self.policy = policy
+        self.tail = tail
+        self._chats = OrderedDict()
+        self._size = 0
+        self.lookups = 0
+        self.hits = 0
+        self.added = 0
+
+    def lookup(self, chat_id: int, fp: bytes, now: float = None):
+        self.lookups += 1
+        ix = self._chats.get(chat_id)
+        if ix is None:
+            return None
+        self._chats.move_to_end(chat_id)
+        before = len(ix)
+        hit = ix.nearest(fp, time.time() if now is None else now)
+        self._size += len(ix) - before
+        if hit is not None:
+            self.hits += 1
+        return hit
+
+    def add(self, chat_id: int, fp: bytes, score: float, now: float = None):
+        ix = self._chats.get(chat_id)
+        if ix is None:
+            ix = self._chats[chat_id] = ChatIndex(self.max_distance, self.ttl, self.chat_items, self.tail)
+        self._chats.move_to_end(chat_id)
+        before = len(ix)
+        ix.add(fp, score, time.time() if now is None else now)
+        self._size += len(ix) - before
+        self.added += 1
+        # over the total bound: the oldest entries of the least recently active chats go first
+        while self._size > self.max_items:
+            other_id, other = next(iter(self._chats.items()))
+            n = min(len(other), self._size - self.max_items)
+            other.trim(n)
+            self._size -= n
+            if not len(other):
+                del self._chats[other_id]
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "size": self._size, "lookups": self.lookups,
+                "hits": self.hits, "added": self.added, "max_distance": self.max_distance}
+
+_instance = None
+
+def start(cfg: dict = None):
+    # FP_INDEX=0 disables; FP_POLICY reject|cache; FP_MAX_DISTANCE bits of 256;
+    # FP_TTL seconds; FP_INDEX_SIZE entries in total, FP_CHAT_SIZE per chat
+    global _instance
+    cfg = cfg or os.environ
+    if _instance is not None or cfg.get("FP_INDEX", "1") in ("0", "false", "no"):
+        return _instance
+    policy = (cfg.get("FP_POLICY") or "reject").lower()
+    if policy not in ("reject", "cache"):
+        raise ValueError(f"FP_POLICY must be reject or cache, not {policy!r}")
+    _instance = FingerprintIndex(max_distance=int(cfg.get("FP_MAX_DISTANCE", "30")),
+                                 ttl=float(cfg.get("FP_TTL", str(7 * 86400))),
+                                 max_items=int(cfg.get("FP_INDEX_SIZE", "100000")),
+                                 chat_items=int(cfg.get("FP_CHAT_SIZE", "20000")),
+                                 policy=policy)
+    return _instance
+
+def stop():
+    global _instance
+    _instance = None
+
+def check(chat_id: int, fp: str):
+    # -> verdict replacing the classifier's for a near-duplicate of a clip
+    # accepted in this chat, or None; fp is the hex string audio_pool attaches
+    if _instance is None or not fp:
+        return None
+    hit = _instance.lookup(chat_id, bytes.fromhex(fp))
+    if hit is None:
+        return None
+    distance, score = hit
+    if _instance.policy == "cache":
+        return {"is_fart": True, "score": score, "duplicate": distance}
+    return {"is_fart": False, "score": 0.0, "duplicate": distance}
+
+def checker(chat_id: int):
+    # precheck callback for audio_pool.analyse, None when the index is off
+    if _instance is None:
+        return None
+    return lambda fp: check(chat_id, fp)
+
+def remember(chat_id: int, res: dict):
+    # called for counted clips; verdicts that were themselves duplicates are not re-added
+    if _instance is not None and res.get("fp") and "duplicate" not in res:
+        _instance.add(chat_id, bytes.fromhex(res["fp"]), float(res.get("score", 0.0)))
+
+def stats():
+    return _instance.stats() if _instance is not None else None
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# In-process per-chat leaderboards so /top can be answered without SQLite.
+# Each board holds the all-time totals (mirror of `stats`) and a ring of daily
+# buckets (mirror of `daily_totals`); db.py keeps them in sync on every write.
+import heapq, threading, time
+from collections import OrderedDict
+
+RING_DAYS = 31  # today + 30 full days, enough for /top 30
+
+class ChatBoard:
+    def __init__(self, totals: dict, daily: dict, today: int):
+        self.totals = dict(totals)
+        self.ring_day = [None] * RING_DAYS
+        self.ring = [None] * RING_DAYS
+        for day, users in daily.items():
+            if today - RING_DAYS < day <= today:
+                self._bucket(day).update(users)
+        self._top_cache = {}
+        self.last_used = time.monotonic()
+
+    def _bucket(self, day: int) -> dict:
+        i = day % RING_DAYS
+        if self.ring_day[i] != day:
+            self.ring_day[i] = day
+            self.ring[i] = {}
+        return self.ring[i]
+
+    def add_event(self, user_id: int, amount: int, day: int):
+        b = self._bucket(day)
+        b[user_id] = b.get(user_id, 0) + amount
+        self._top_cache.clear()
+
+    def set_total(self, user_id: int, total: int):
+        if self.totals.get(user_id) != total:
+            self.totals[user_id] = total
+            self._top_cache.clear()
+
+    def window(self, days: int, today: int) -> dict:
+        res = {}
+        for day in range(today - days, today + 1):
+            i = day % RING_DAYS
+            if self.ring_day[i] == day:
+                for uid, n in self.ring[i].items():
+                    res[uid] = res.get(uid, 0) + n
+        return res
+
+    def top(self, days: int, limit: int, today: int):
+        key = (days, limit, today)
+        rows = self._top_cache.get(key)
+        if rows is None:
+            src = self.window(days, today) if days else self.totals
+            rows = heapq.nlargest(limit, src.items(), key=lambda kv: kv[1])
+            if len(self._top_cache) >= 64:
+                self._top_cache.clear()
+            self._top_cache[key] = rows
+        return rows
+
+class LeaderboardCache:
+    # LRU of ChatBoards; idle chats are dropped and reloaded lazily on next access
+    def __init__(self, max_chats: int = 1000, idle_seconds: float = 6 * 3600):
+        self.max_chats = max_chats
+        self.idle_seconds = idle_seconds
+        self._boards = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, chat_id: int):
+        with self.lock:
+            board = self._boards.get(chat_id)
+            if board is not None:
+                board.last_used = time.monotonic()
+                self._boards.move_to_end(chat_id)
+            return board
+
+    def put(self, chat_id: int, board: ChatBoard):
+        with self.lock:
+            self._boards[chat_id] = board
+            self._boards.move_to_end(chat_id)
+            self._evict()
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._boards:
+            chat_id, board = next(iter(self._boards.items()))
+            if len(self._boards) <= self.max_chats and board.last_used >= cutoff:
+                break
+            del self._boards[chat_id]
+
+    def top(self, chat_id: int, days: int, limit: int, today: int):
+        with self.lock:
+            board = self.get(chat_id)
+            return None if board is None else board.top(days, limit, today)
+
+    def add_event(self, chat_id: int, user_id: int, amount: int, ts: int):
+        with self.lock:
+            board = self._boards.get(chat_id)
+            if board is not None:
+                board.add_event(user_id, amount, ts // 86400)
+
+    def set_total(self, chat_id: int, user_id: int, total: int):
+        with self.lock:
+            board = self._boards.get(chat_id)
+            if board is not None:
+                board.set_total(user_id, total)
+
+    def clear(self):
+        with self.lock:
+            self._boards.clear()
+
+    def discard(self, chat_id: int):
+        with self.lock:
+            self._boards.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self._boards)
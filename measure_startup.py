@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Cold-start measurement for CI: spawns an entry point with a throwaway data dir
+# and a dummy token, then polls /healthz (liveness) and /readyz (classifier warm).
+# Bot API calls go to bench.fake_bot_api served from this process, so the probe
+# needs no network and never talks to api.telegram.org.
+# Prints one JSON line; exits 1 if a --max-*-ms budget is exceeded.
+#
+#   python measure_startup.py --entry web_entry_webhook.py --max-live-ms 3000
+import argparse, asyncio, json, os, socket, subprocess, sys, tempfile, threading, time
+import urllib.request, urllib.error
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=0.5) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+class _FakeAPI:
+    # the fake Bot API on its own loop thread; this script is synchronous
+    def __enter__(self) -> str:
+        from bench.fake_bot_api import FakeBotAPI
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self._api = FakeBotAPI()
+        self._api.record_calls = False
+        return asyncio.run_coroutine_threadsafe(self._api.start(), self._loop).result(10)
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._api.stop(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+def measure(entry: str, timeout: float = 120.0, env: dict = None, api_base: str = None) -> dict:
+    if api_base is None:
+        with _FakeAPI() as base:
+            return measure(entry, timeout, env, base)
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as td:
+        child_env = dict(os.environ)
+        child_env.update({
+            "BOT_TOKEN": "123456:STARTUP-PROBE",
+            "BOT_API_BASE": api_base,
+            "PORT": str(port),
+            "DATA_DIR": td,
+            "DB_PATH": os.path.join(td, "fartbot.sqlite3"),
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+            "PYTHONUNBUFFERED": "1",
+        })
+        child_env.update(env or {})
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(HERE, entry)], cwd=HERE, env=child_env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        live = ready = None
+        try:
+            while time.perf_counter() - t0 < timeout and proc.poll() is None:
+                now = (time.perf_counter() - t0) * 1000
+                if live is None and _status(f"http://127.0.0.1:{port}/healthz") == 200:
+                    live = now
+                if live is not None and _status(f"http://127.0.0.1:{port}/readyz") == 200:
+                    ready = (time.perf_counter() - t0) * 1000
+                    break
+                time.sleep(0.02)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return {"entry": entry, "live_ms": live and round(live, 1), "ready_ms": ready and round(ready, 1),
+            "exit_code": proc.returncode}
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure time to /healthz (live) and /readyz (ready).")
+    ap.add_argument("--entry", default="web_entry_webhook.py")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--max-live-ms", type=float, default=None)
+    ap.add_argument("--max-ready-ms", type=float, default=None)
+    args = ap.parse_args()
+
+    with _FakeAPI() as base:
+        runs = [measure(args.entry, args.timeout, api_base=base) for _ in range(args.runs)]
+    lives = sorted(r["live_ms"] for r in runs if r["live_ms"] is not None)
+    readies = sorted(r["ready_ms"] for r in runs if r["ready_ms"] is not None)
+    report = {
+        "entry": args.entry,
+        "runs": runs,
+        "live_ms_median": lives[len(lives) // 2] if lives else None,
+        "ready_ms_median": readies[len(readies) // 2] if readies else None,
+    }
+    print(json.dumps(report))
+    failed = len(lives) < len(runs) or len(readies) < len(runs)
+    if args.max_live_ms is not None and (not lives or report["live_ms_median"] > args.max_live_ms):
+        failed = True
+    if args.max_ready_ms is not None and (not readies or report["ready_ms_median"] > args.max_ready_ms):
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
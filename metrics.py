@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# In-process metrics rendered in the Prometheus text format (no extra deps).
+# METRICS_ENABLED=0 (read by start()) turns every update into a no-op and
+# /metrics into 404. With WORKERS > 1 each worker sends snapshot() to the front
+# over the shard status queue; the front's render() adds them to its own
+# samples and exports worker collectors with a shard label.
+import asyncio, os, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+ENABLED = True
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_registry = []
+_collectors = {}
+_NOOP = nullcontext()
+_shards = {}   # shard index -> latest snapshot() of its worker process
+_retired = {}  # metric name -> cumulative samples of replaced worker processes
+
+def _fmt(v) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+def _labels(label, key, le=None):
+    parts = []
+    if label is not None and key is not None:
+        parts.append(f'{label}="{key}"')
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    cumulative = True
+
+    def __init__(self, name: str, help: str, label: str = None):
+        self.name, self.help, self.label = name, help, label
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, key=None, n: float = 1):
+        if not ENABLED:
+            return
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def dump(self):
+        return dict(self._values)
+
+    @staticmethod
+    def add(a, b):
+        out = dict(a)
+        for key, v in b.items():
+            out[key] = out.get(key, 0) + v
+        return out
+
+    def render(self, values):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, v in sorted(values.items(), key=lambda kv: str(kv[0])):
+            yield f"{self.name}{_labels(self.label, key)} {_fmt(v)}"
+
+class Gauge:
+    cumulative = False  # a replaced worker's value is gone with it
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self.value = 0
+        _registry.append(self)
+
+    def set(self, v):
+        self.value = v
+
+    def inc(self, n=1):
+        if ENABLED:
+            with _lock:
+                self.value += n
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def dump(self):
+        return self.value
+
+    @staticmethod
+    def add(a, b):
+        return a + b
+
+    def render(self, value):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_fmt(value)}"
+
+class Histogram:
+    cumulative = True
+
+    def __init__(self, name: str, help: str, label: str = None, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self._series = {}  # key -> [bucket counts..., +Inf count, sum]
+        self.on_observe = None  # fn(key, seconds), called even when metrics are disabled
+        _registry.append(self)
+
+    def observe(self, seconds: float, key=None):
+        if self.on_observe is not None:
+            self.on_observe(key, seconds)
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, seconds)
+        with _lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            s[i] += 1
+            s[-1] += seconds
+
+    def time(self, key=None):
+        return self._timer(key) if ENABLED or self.on_observe is not None else _NOOP
+
+    def dump(self):
+        return {key: list(s) for key, s in self._series.items()}
+
+    @staticmethod
+    def add(a, b):
+        out = {key: list(s) for key, s in a.items()}
+        for key, s in b.items():
+            mine = out.get(key)
+            out[key] = list(s) if mine is None else [x + y for x, y in zip(mine, s)]
+        return out
+
+    @contextmanager
+    def _timer(self, key):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, key)
+
+    def render(self, series):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, s in sorted(series.items(), key=lambda kv: str(kv[0])):
+            acc = 0
+            for le, c in zip(self.buckets, s):
+                acc += c
+                yield f"{self.name}_bucket{_labels(self.label, key, le)} {acc}"
+            acc += s[len(self.buckets)]
+            yield f"{self.name}_bucket{_labels(self.label, key, '+Inf')} {acc}"
+            yield f"{self.name}_sum{_labels(self.label, key)} {_fmt(s[-1])}"
+            yield f"{self.name}_count{_labels(self.label, key)} {acc}"
+
+STAGE_SECONDS = Histogram("fartbot_stage_seconds", "Voice handler stage latency", label="stage")
+CLIPS = Counter("fartbot_clips_total", "Voice notes by outcome", label="outcome")
+DUPLICATE_UPDATES = Counter("fartbot_duplicate_updates_total", "Telegram updates dropped as already seen", label="reason")
+IN_FLIGHT = Gauge("fartbot_voice_in_flight", "Voice handlers currently running")
+DB_LOCK_WAIT = Histogram("fartbot_db_lock_wait_seconds", "Time spent waiting for the SQLite writer lock")
+LOOP_LAG = Histogram("fartbot_event_loop_lag_seconds", "Event loop scheduling delay",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+def add_collector(prefix: str, fn):
+    # fn() -> dict of numbers (or None); exported as gauges <prefix>_<key>
+    _collectors[prefix] = fn
+
+def _collect() -> dict:
+    out = {}
+    for prefix, fn in list(_collectors.items()):
+        try:
+            values = fn() or {}
+        except Exception:
+            continue
+        out[prefix] = {k: v for k, v in values.items()
+                       if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    return out
+
+def snapshot() -> dict:
+    # this process's samples, picklable, for the multi-process front
+    with _lock:
+        registry = {m.name: m.dump() for m in _registry}
+    return {"pid": os.getpid(), "registry": registry, "collectors": _collect()}
+
+def merge_shard(index: int, snap: dict):
+    # called by the front for every snapshot a worker sends; when the worker
+    # was replaced, the old process's counts are kept so totals never go back
+    with _lock:
+        old = _shards.get(index)
+        if old is not None and old["pid"] != snap["pid"]:
+            for m in _registry:
+                if m.cumulative and m.name in old["registry"]:
+                    prev = _retired.get(m.name)
+                    dump = old["registry"][m.name]
+                    _retired[m.name] = dump if prev is None else m.add(prev, dump)
+        _shards[index] = snap
+
+def render():
+    if not ENABLED:
+        return None
+    lines = []
+    with _lock:
+        for m in _registry:
+            values = m.dump()
+            for snap in _shards.values():
+                if m.name in snap["registry"]:
+                    values = m.add(values, snap["registry"][m.name])
+            if m.name in _retired:
+                values = m.add(values, _retired[m.name])
+            lines.extend(m.render(values))
+        shards = sorted(_shards.items())
+    for prefix, values in _collect().items():
+        for k, v in values.items():
+            lines.append(f"# TYPE {prefix}_{k} gauge")
+            lines.append(f"{prefix}_{k} {_fmt(v)}")
+    # worker collectors (scheduler, write-behind, caches...) per shard
+    by_name = {}
+    for i, snap in shards:
+        for prefix, values in snap["collectors"].items():
+            for k, v in values.items():
+                by_name.setdefault(f"{prefix}_{k}", []).append(f'{prefix}_{k}{{shard="{i}"}} {_fmt(v)}')
+    for name, series in by_name.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(series)
+    return "\n".join(lines) + "\n"
+
+_lag_task = None
+
+async def _watch_loop(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - t0 - interval))
+
+def start(interval: float = 0.5, cfg: dict = None):
+    # read here, not at import: the entry points import this module early
+    global ENABLED, _lag_task
+    cfg = cfg or os.environ
+    ENABLED = cfg.get("METRICS_ENABLED", "1") not in ("0", "false", "no")
+    if ENABLED and _lag_task is None:
+        _lag_task = asyncio.ensure_future(_watch_loop(interval))
+
+async def stop():
+    global _lag_task
+    task, _lag_task = _lag_task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
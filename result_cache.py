@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Two-level cache of classifier verdicts keyed by Telegram file_unique_id:
+# an in-memory LRU in front of the persistent `classify_cache` table.
+# Keys include a hash of the classifier config, so changing CLASSIFIER_MODE,
+# FEATURE_SR or any HEURISTIC_*/MODEL_* setting makes old entries unreachable
+# (they age out by TTL); in model mode the hash also covers the model file, so
+# retraining does too.
+import asyncio, hashlib, json, os, time
+from collections import OrderedDict
+
+import db
+
+CONFIG_PREFIXES = ("HEURISTIC_", "MODEL_", "FEATURE_SR")
+
+def config_hash(mode: str, cfg: dict) -> str:
+    items = sorted((k, str(v)) for k, v in cfg.items() if k.startswith(CONFIG_PREFIXES))
+    if mode == "model":
+        try:
+            with open(cfg.get("MODEL_PATH", "./models/fart.npz"), "rb") as f:
+                items.append(("model_sha1", hashlib.sha1(f.read()).hexdigest()))
+        except OSError:
+            pass
+    raw = json.dumps([mode or "heuristic", items])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+class ResultCache:
+    def __init__(self, cfg_hash: str, max_items: int = 5000, ttl: int = 30 * 86400,
+                 max_rows: int = 100000, persist: bool = True):
+        self.cfg_hash = cfg_hash
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.persist = persist
+        self._mem = OrderedDict()
+        self._tasks = set()
+        self._puts = 0
+        self.hits_mem = 0
+        self.hits_db = 0
+        self.misses = 0
+
+    def _key(self, file_unique_id: str) -> str:
+        return f"{file_unique_id}:{self.cfg_hash}"
+
+    async def get(self, file_unique_id: str):
+        key = self._key(file_unique_id)
+        hit = self._mem.get(key)
+        if hit is not None:
+            ts, res = hit
+            if time.time() - ts < self.ttl:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return res
+            del self._mem[key]
+        if self.persist:
+            raw = await db.run(db.cache_get, key, int(time.time()) - self.ttl)
+            if raw is not None:
+                res = json.loads(raw)
+                self._remember(key, res)
+                self.hits_db += 1
+                return res
+        self.misses += 1
+        return None
+
+    def put(self, file_unique_id: str, res: dict):
+        key = self._key(file_unique_id)
+        self._remember(key, res)
+        if self.persist:
+            # not awaited: the reply should not wait for the cache commit
+            self._spawn(db.run(db.cache_put, key, json.dumps(res)))
+            self._puts += 1
+            if self._puts % 500 == 0:
+                self._spawn(db.run(db.cache_prune, self.ttl, self.max_rows))
+
+    def _remember(self, key: str, res: dict):
+        self._mem[key] = (time.time(), res)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits_mem + self.hits_db + self.misses
+        return {
+            "size": len(self._mem),
+            "hits_mem": self.hits_mem,
+            "hits_db": self.hits_db,
+            "misses": self.misses,
+            "hit_ratio": (self.hits_mem + self.hits_db) / lookups if lookups else 0.0,
+        }
+
+_instance = None
+
+def start(mode: str, cfg: dict = None):
+    # RESULT_CACHE=0 disables; RESULT_CACHE_SIZE in-memory entries,
+    # RESULT_CACHE_TTL seconds, RESULT_CACHE_DB_ROWS persisted rows (0 = memory only)
+    global _instance
+    cfg = cfg or os.environ
+    if _instance is not None or cfg.get("RESULT_CACHE", "1") in ("0", "false", "no"):
+        return _instance
+    max_rows = int(cfg.get("RESULT_CACHE_DB_ROWS", "100000"))
+    _instance = ResultCache(config_hash(mode, cfg),
+                            max_items=int(cfg.get("RESULT_CACHE_SIZE", "5000")),
+                            ttl=int(cfg.get("RESULT_CACHE_TTL", str(30 * 86400))),
+                            max_rows=max_rows, persist=max_rows > 0)
+    return _instance
+
+async def stop():
+    global _instance
+    rc, _instance = _instance, None
+    if rc is not None:
+        await rc.drain()
+
+async def get(file_unique_id: str):
+    if _instance is None or not file_unique_id:
+        return None
+    return await _instance.get(file_unique_id)
+
+def put(file_unique_id: str, res: dict):
+    if _instance is not None and file_unique_id:
+        _instance.put(file_unique_id, res)
+
+def stats():
+    return _instance.stats() if _instance is not None else None
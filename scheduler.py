@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Per-chat ordered scheduler for the heavy part of on_voice (download, decode,
+# classify, DB write, reply). Jobs of one chat run strictly one after another
+# (so counters and achievements are awarded in message order), different chats
+# run in parallel up to a global limit, and every chat has a bounded queue.
+# When a queue is full the policy decides:
+#   shed         reject the new job (default)
+#   drop_oldest  reject the oldest queued job of that chat and take the new one
+#   defer        wait up to SCHED_DEFER_TIMEOUT for room, then shed
+import asyncio, os
+from collections import deque
+
+class Overloaded(Exception):
+    pass
+
+class ChatScheduler:
+    def __init__(self, concurrency: int = 8, chat_queue: int = 20, max_queued: int = 1000,
+                 policy: str = "shed", defer_timeout: float = 10.0):
+        if policy not in ("shed", "drop_oldest", "defer"):
+            raise ValueError(f"unknown scheduler policy: {policy}")
+        self.concurrency = max(1, concurrency)
+        self.chat_queue = max(1, chat_queue)
+        self.max_queued = max(1, max_queued)
+        self.policy = policy
+        self.defer_timeout = defer_timeout
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._chats = {}    # chat_id -> deque of (fn, future)
+        self._workers = {}  # chat_id -> task draining that chat
+        self._room = asyncio.Event()
+        self._queued = 0
+        self.running = 0
+        self.completed = 0
+        self.shed = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.max_depth_seen = 0
+
+    def _full(self, chat_id) -> bool:
+        q = self._chats.get(chat_id)
+        return (q is not None and len(q) >= self.chat_queue) or self._queued >= self.max_queued
+
+    async def run(self, chat_id, fn):
+        # fn: zero-argument coroutine function; returns its result or raises Overloaded
+        if self._full(chat_id):
+            if self.policy == "defer":
+                self.deferred += 1
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.defer_timeout
+                while self._full(chat_id):
+                    self._room.clear()
+                    try:
+                        await asyncio.wait_for(self._room.wait(), max(0.0, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+            elif self.policy == "drop_oldest":
+                q = self._chats.get(chat_id)
+                if q and len(q) >= self.chat_queue:
+                    _, old = q.popleft()
+                    self._queued -= 1
+                    self.dropped += 1
+                    if not old.done():
+                        old.set_exception(Overloaded("dropped from a full chat queue"))
+            if self._full(chat_id):
+                self.shed += 1
+                raise Overloaded("voice queue is full")
+
+        fut = asyncio.get_running_loop().create_future()
+        q = self._chats.setdefault(chat_id, deque())
+        q.append((fn, fut))
+        self._queued += 1
+        self.max_depth_seen = max(self.max_depth_seen, len(q))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id, q))
+        return await fut
+
+    async def _drain(self, chat_id, q):
+        try:
+            while q:
+                async with self._sem:
+                    if not q:
+                        break
+                    fn, fut = q.popleft()
+                    self._queued -= 1
+                    self._room.set()
+                    if fut.done():  # caller went away (cancelled) while queued
+                        continue
+                    self.running += 1
+                    try:
+                        res = await fn()
+                    except asyncio.CancelledError:
+                        fut.cancel()
+                        raise
+                    except Exception as e:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    else:
+                        if not fut.done():
+                            fut.set_result(res)
+                    finally:
+                        self.running -= 1
+                        self.completed += 1
+        finally:
+            # no await between the empty check and here, so no job can slip in unseen
+            self._workers.pop(chat_id, None)
+            if self._chats.get(chat_id) is q:
+                del self._chats[chat_id]
+            while q:
+                _, fut = q.popleft()
+                self._queued -= 1
+                if not fut.done():
+                    fut.cancel()
+
+    def depth(self) -> int:
+        return self._queued
+
+    async def stop(self):
+        tasks = list(self._workers.values())
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queued,
+            "running": self.running,
+            "chats": len(self._chats),
+            "max_chat_depth": max((len(q) for q in self._chats.values()), default=0),
+            "max_chat_depth_seen": self.max_depth_seen,
+            "completed": self.completed,
+            "shed": self.shed,
+            "dropped": self.dropped,
+            "deferred": self.deferred,
+        }
+
+_instance = None
+
+def start(cfg: dict = None):
+    # SCHED_CONCURRENCY=0 disables it (jobs run directly in the handler, as before)
+    global _instance
+    cfg = cfg or os.environ
+    concurrency = int(cfg.get("SCHED_CONCURRENCY", "8"))
+    if _instance is not None or concurrency <= 0:
+        return _instance
+    _instance = ChatScheduler(concurrency=concurrency,
+                              chat_queue=int(cfg.get("SCHED_CHAT_QUEUE", "20")),
+                              max_queued=int(cfg.get("SCHED_MAX_QUEUED", "1000")),
+                              policy=(cfg.get("SCHED_POLICY") or "shed").lower(),
+                              defer_timeout=float(cfg.get("SCHED_DEFER_TIMEOUT", "10")))
+    return _instance
+
+async def stop():
+    global _instance
+    s, _instance = _instance, None
+    if s is not None:
+        await s.stop()
+
+async def run(chat_id, fn):
+    if _instance is None:
+        return await fn()
+    return await _instance.run(chat_id, fn)
+
+def stats():
+    return _instance.stats() if _instance is not None else None
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Multi-process mode (WORKERS > 1). This process only receives updates (polling
+# or webhook, deduplicated by dedup.py) and forwards each one over a
+# multiprocessing queue to worker chat_id % WORKERS. A worker is a full bot
+# (scheduler, classifier, DB writes, replies) for its own chats only, so
+# per-chat ordering and the in-memory leaderboards hold across processes.
+# Workers that exit are restarted with backoff on a fresh queue (a killed
+# process may hold the old queue's lock); updates still queued are lost.
+# Workers also send metrics.snapshot() over the status queue every
+# METRICS_PUSH seconds, so the front's /metrics covers their clips and stages.
+import asyncio, os, time
+import multiprocessing as mp
+import queue as _queue
+
+import metrics
+
+WORKER_ENV = "SHARD_WORKER"
+METRICS_PUSH = 2.0
+
+_CHAT_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post",
+              "my_chat_member", "chat_member", "chat_join_request")
+
+def chat_of(update: dict):
+    for key in _CHAT_KEYS:
+        obj = update.get(key)
+        if obj and "chat" in obj:
+            return obj["chat"]["id"]
+    cq = update.get("callback_query")
+    if cq and cq.get("message"):
+        return cq["message"]["chat"]["id"]
+    return None
+
+def shard_of(chat_id, n: int) -> int:
+    return 0 if chat_id is None else chat_id % n
+
+class Supervisor:
+    def __init__(self, n: int, target=None, max_queue: int = 10000):
+        self.n = n
+        self.target = target or _worker_main
+        self._ctx = mp.get_context("spawn")
+        self.status = self._ctx.Queue()
+        self.max_queue = max_queue
+        self._queues = [self._ctx.Queue(max_queue) for _ in range(n)]
+        self._procs = [None] * n
+        self._ready = [False] * n
+        self._spawned_at = [0.0] * n
+        self._backoff = [0.0] * n
+        self._closing = False
+        self._monitor = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.dropped = 0
+
+    def _spawn(self, i: int):
+        p = self._ctx.Process(target=self.target, args=(i, self.n, self._queues[i], self.status),
+                              name=f"shard-{i}")
+        p.start()
+        self._procs[i] = p
+        self._ready[i] = False
+        self._spawned_at[i] = time.monotonic()
+
+    def start(self):
+        for i in range(self.n):
+            self._spawn(i)
+
+    def watch(self):
+        # restarts dead workers and collects readiness; needs a running loop
+        if self._monitor is None:
+            self._monitor = asyncio.ensure_future(self._watch())
+        return self._monitor
+
+    async def _watch(self):
+        while not self._closing:
+            while True:
+                try:
+                    kind, i, *rest = self.status.get_nowait()
+                except _queue.Empty:
+                    break
+                if kind == "ready":
+                    self._ready[i] = True
+                    print(f"Shard {i} ready (pid {self._procs[i].pid})")
+                elif kind == "metrics":
+                    metrics.merge_shard(i, rest[0])
+            now = time.monotonic()
+            for i, p in enumerate(self._procs):
+                if self._closing or p.is_alive():
+                    continue
+                if now < self._spawned_at[i] + self._backoff[i]:
+                    continue  # crash loop: wait before the next attempt
+                # quick deaths double the delay (up to 30 s), a long healthy run resets it
+                lived = now - self._spawned_at[i]
+                self._backoff[i] = 0.0 if lived > 60 else min(30.0, max(1.0, self._backoff[i] * 2))
+                print(f"Shard {i} exited with code {p.exitcode}; restarting")
+                self.restarts += 1
+                old, self._queues[i] = self._queues[i], self._ctx.Queue(self.max_queue)
+                old.cancel_join_thread()
+                old.close()
+                self._spawn(i)
+            await asyncio.sleep(0.2)
+
+    def dispatch(self, update: dict) -> bool:
+        i = shard_of(chat_of(update), self.n)
+        try:
+            self._queues[i].put_nowait(update)
+        except _queue.Full:
+            self.dropped += 1
+            return False
+        self.forwarded += 1
+        return True
+
+    def is_ready(self) -> bool:
+        return all(self._ready)
+
+    async def stop(self, timeout: float = 15.0):
+        # workers finish what they already took, then exit; stragglers are terminated
+        self._closing = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+        for q in self._queues:
+            try:
+                q.put_nowait(None)
+            except _queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for p in self._procs:
+            if p is None:
+                continue
+            await asyncio.to_thread(p.join, max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                print(f"Shard {p.name} did not stop in time; terminating")
+                p.terminate()
+                await asyncio.to_thread(p.join, 2)
+
+    def stats(self) -> dict:
+        depth = 0
+        for q in self._queues:
+            try:
+                depth += q.qsize()
+            except NotImplementedError:  # macOS
+                pass
+        return {
+            "workers": self.n,
+            "alive": sum(1 for p in self._procs if p is not None and p.is_alive()),
+            "ready": sum(self._ready),
+            "restarts": self.restarts,
+            "forwarded": self.forwarded,
+            "dropped": self.dropped,
+            "queued": depth,
+        }
+
+def next_update(inq, poll: float = 1.0):
+    # blocking; None means stop (also when the supervisor process is gone)
+    parent = mp.parent_process()
+    while True:
+        try:
+            return inq.get(timeout=poll)
+        except _queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return None
+
+def _worker_main(index: int, n: int, inq, status):
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the supervisor
+    os.environ[WORKER_ENV] = str(index)
+    os.environ["DEDUP_WINDOW"] = "0"  # already deduplicated by the supervisor
+    os.environ.setdefault("AUDIO_WORKERS", "1")
+    asyncio.run(_worker(index, inq, status))
+
+async def _feed(mod, update: dict):
+    try:
+        await mod.dp.feed_raw_update(mod.bot, update)
+    except Exception as e:
+        print("Update failed:", repr(e))
+
+async def _push_metrics(index: int, status):
+    while True:
+        await asyncio.sleep(METRICS_PUSH)
+        status.put(("metrics", index, metrics.snapshot()))
+
+async def _worker(index: int, inq, status):
+    import bot as mod
+    await mod.startup()
+    while not mod.is_ready():
+        await asyncio.sleep(0.05)
+    status.put(("ready", index))
+    pusher = asyncio.create_task(_push_metrics(index, status)) if metrics.ENABLED else None
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, next_update, inq)
+            if update is None:
+                break
+            task = asyncio.create_task(_feed(mod, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.wait(tasks, timeout=10)
+        if pusher is not None:
+            pusher.cancel()
+        await mod.shutdown()
+        try:
+            await mod.bot.session.close()
+        except Exception:
+            pass
+
+_instance = None
+
+def start(n: int):
+    global _instance
+    if _instance is None:
+        _instance = Supervisor(n)
+        _instance.start()
+        _instance.watch()
+        print(f"Sharding updates over {n} worker processes")
+    return _instance
+
+async def stop():
+    global _instance
+    s, _instance = _instance, None
+    if s is not None:
+        await s.stop()
+
+async def middleware(handler, update, data):
+    # registered as dp.update outer middleware after dedup: in the supervisor
+    # the update goes to its shard instead of the local handlers
+    if _instance is None:
+        return await handler(update, data)
+    if not _instance.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True)):
+        print(f"Shard queue full, update {update.update_id} dropped")
+    return None
+
+def is_ready() -> bool:
+    return _instance is not None and _instance.is_ready()
+
+def stats():
+    return _instance.stats() if _instance is not None else None
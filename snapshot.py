@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Online snapshots of the SQLite database for hosts with an ephemeral disk
+# (Render Free loses ./data on every deploy). A snapshot is taken with the
+# backup API in small page steps from a read-only connection pinned to one WAL
+# read snapshot, so writers are never blocked and the copy never restarts;
+# it is then gzip'ed into SNAPSHOT_DIR under a temporary name and renamed.
+# On start, before init_db(), a missing database is restored from the newest
+# snapshot that decompresses cleanly (gzip CRC) and opens as a database.
+#
+#   python snapshot.py take | restore [--force] | list
+import argparse, asyncio, glob, gzip, json, os, shutil, sqlite3, time, zlib
+from pathlib import Path
+
+import db
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "")
+KEEP = int(os.environ.get("SNAPSHOT_KEEP", "5"))
+PAGES = int(os.environ.get("SNAPSHOT_PAGES", "2048"))  # pages per backup step
+SLEEP_MS = int(os.environ.get("SNAPSHOT_SLEEP_MS", "5"))
+LEVEL = int(os.environ.get("SNAPSHOT_GZIP_LEVEL", "3"))
+VERIFY = os.environ.get("SNAPSHOT_VERIFY", "quick")  # quick | full (PRAGMA quick_check)
+PREFIX = "fartbot-"
+BUF = 1 << 20
+
+def _snapshots(directory: str):
+    # newest first; names sort by their UTC timestamp
+    return sorted(glob.glob(os.path.join(directory, PREFIX + "*.sqlite3.gz")), reverse=True)
+
+def take(directory: str = None, db_path: str = None) -> dict:
+    directory = directory or SNAPSHOT_DIR
+    db_path = db_path or db.DB_PATH
+    os.makedirs(directory, exist_ok=True)
+    t0 = time.perf_counter()
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    raw = os.path.join(directory, f".{PREFIX}{stamp}.sqlite3.tmp")
+    out = os.path.join(directory, f"{PREFIX}{stamp}.sqlite3.gz")
+    steps = [0, 0.0, time.perf_counter()]  # count, longest step, last tick
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        steps[0] += 1
+        steps[1] = max(steps[1], now - steps[2])
+        steps[2] = now
+
+    src = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    dst = sqlite3.connect(raw)
+    try:
+        # one read transaction for the whole copy: later commits by other
+        # connections stay in the WAL and do not restart the backup
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        steps[2] = time.perf_counter()
+        src.backup(dst, pages=PAGES, progress=progress, sleep=SLEEP_MS / 1000.0)
+        src.execute("ROLLBACK")
+    finally:
+        dst.close()
+        src.close()
+    t_backup = time.perf_counter() - t0
+    try:
+        with open(raw, "rb") as f, gzip.open(out + ".tmp", "wb", compresslevel=LEVEL) as z:
+            shutil.copyfileobj(f, z, BUF)
+        with open(out + ".tmp", "rb") as f:
+            os.fsync(f.fileno())
+        raw_bytes = os.path.getsize(raw)
+        os.replace(out + ".tmp", out)
+    finally:
+        for p in (raw, out + ".tmp"):
+            if os.path.exists(p):
+                os.remove(p)
+    for old in _snapshots(directory)[max(1, KEEP):]:
+        os.remove(old)
+    return {"path": out, "bytes": raw_bytes, "gz_bytes": os.path.getsize(out), "steps": steps[0],
+            "max_step_ms": round(steps[1] * 1000, 1), "backup_s": round(t_backup, 3),
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+def _check(path: str, full: bool):
+    conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        if full:
+            res = conn.execute("PRAGMA quick_check").fetchone()[0]
+            if res != "ok":
+                raise sqlite3.DatabaseError(res)
+    finally:
+        conn.close()
+
+def restore(directory: str = None, db_path: str = None, force: bool = False):
+    # returns a report, or None when nothing was restored
+    directory = directory or SNAPSHOT_DIR
+    db_path = db_path or db.DB_PATH
+    if not directory:
+        return None
+    if not force and os.path.exists(db_path) and os.path.getsize(db_path) > 0:
+        return None
+    t0 = time.perf_counter()
+    tmp = db_path + ".restore"
+    for snap in _snapshots(directory):
+        try:
+            with gzip.open(snap, "rb") as z, open(tmp, "wb") as f:
+                shutil.copyfileobj(z, f, BUF)
+            _check(tmp, VERIFY == "full")
+        except (OSError, EOFError, zlib.error, sqlite3.DatabaseError) as e:
+            print(f"Snapshot {os.path.basename(snap)} unusable: {e!r}")
+            continue
+        finally:
+            if os.path.exists(tmp + "-journal"):
+                os.remove(tmp + "-journal")
+        for sfx in ("-wal", "-shm"):
+            if os.path.exists(db_path + sfx):
+                os.remove(db_path + sfx)
+        os.replace(tmp, db_path)
+        return {"path": snap, "bytes": os.path.getsize(db_path), "seconds": round(time.perf_counter() - t0, 3)}
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    return None
+
+async def run_periodically(minutes: float):
+    while True:
+        await asyncio.sleep(minutes * 60)
+        try:
+            report = await asyncio.to_thread(take)
+            print("Snapshot:", json.dumps(report, ensure_ascii=False))
+        except Exception as e:
+            print("Snapshot failed:", repr(e))
+
+_task = None
+
+def enabled() -> bool:
+    return bool(SNAPSHOT_DIR)
+
+def start(cfg: dict = None):
+    # SNAPSHOT_INTERVAL_MIN=0 keeps only the on-shutdown snapshot
+    global _task
+    cfg = cfg or os.environ
+    minutes = float(cfg.get("SNAPSHOT_INTERVAL_MIN", "60"))
+    if enabled() and _task is None and minutes > 0:
+        _task = asyncio.ensure_future(run_periodically(minutes))
+    return _task
+
+async def stop(final: bool = True):
+    # cancels the schedule and, if enabled, takes one last snapshot
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if final and enabled():
+        try:
+            report = await asyncio.to_thread(take)
+            print("Snapshot:", json.dumps(report, ensure_ascii=False))
+        except Exception as e:
+            print("Snapshot failed:", repr(e))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="SQLite snapshots")
+    ap.add_argument("action", choices=["take", "restore", "list"])
+    ap.add_argument("--dir", default=SNAPSHOT_DIR or None)
+    ap.add_argument("--force", action="store_true", help="restore over an existing database")
+    args = ap.parse_args(argv)
+    if not args.dir:
+        ap.error("set SNAPSHOT_DIR or pass --dir")
+    if args.action == "list":
+        for p in _snapshots(args.dir):
+            print(p, os.path.getsize(p))
+    elif args.action == "take":
+        print(json.dumps(take(args.dir), ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(restore(args.dir, force=args.force), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
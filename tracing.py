@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Sampled per-update traces for /admin/slow. A TRACE_SAMPLE share of updates
+# gets a Trace in a context variable; every stage timer (metrics.STAGE_SECONDS:
+# download, decode, classify, db, reply, top, plus the scheduler queue wait)
+# adds its duration to it, and finished traces go into a ring of the last
+# TRACE_KEEP. Unsampled updates cost one random() call. Nothing is sampled
+# until start() has read the settings.
+import contextvars, os, random, threading, time
+from collections import deque
+
+import metrics
+
+SAMPLE = 0.0
+KEEP = 500
+
+_current = contextvars.ContextVar("fartbot_trace", default=None)
+_lock = threading.Lock()
+_done = deque(maxlen=KEEP)
+_sampled = 0
+
+def start(cfg: dict = None):
+    # TRACE_SAMPLE share of updates traced (0 disables), TRACE_KEEP traces kept
+    global SAMPLE, KEEP, _done
+    cfg = cfg or os.environ
+    SAMPLE = float(cfg.get("TRACE_SAMPLE", "0.1"))
+    KEEP = max(1, int(cfg.get("TRACE_KEEP", "500")))
+    with _lock:
+        _done = deque(_done, maxlen=KEEP)
+
+class Trace:
+    __slots__ = ("kind", "chat_id", "update_id", "started", "t0", "stages", "seconds")
+
+    def __init__(self, kind: str, chat_id, update_id):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.update_id = update_id
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.stages = []
+        self.seconds = None
+
+    def as_dict(self) -> dict:
+        stages = {}
+        for name, s in self.stages:
+            stages[name] = round(stages.get(name, 0.0) + s * 1000, 2)
+        return {"kind": self.kind, "chat_id": self.chat_id, "update_id": self.update_id,
+                "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+                "total_ms": round(self.seconds * 1000, 2), "stages_ms": stages}
+
+def record(stage, seconds: float):
+    trace = _current.get()
+    if trace is not None:
+        trace.stages.append((stage, seconds))
+
+# every stage timer also lands in the current trace, with or without METRICS_ENABLED
+metrics.STAGE_SECONDS.on_observe = record
+
+def bind(fn):
+    # the per-chat scheduler runs fn in its own drain task; this carries the
+    # caller's trace over and records how long the job waited in the queue
+    trace = _current.get()
+    if trace is None:
+        return fn
+    queued = time.perf_counter()
+    async def wrapper():
+        token = _current.set(trace)
+        try:
+            trace.stages.append(("queue", time.perf_counter() - queued))
+            return await fn()
+        finally:
+            _current.reset(token)
+    return wrapper
+
+def _kind(message) -> str:
+    if message is None:
+        return "other"
+    if message.voice or message.audio or message.video_note:
+        return "voice"
+    if message.text and message.text.startswith("/"):
+        return message.text.split()[0].split("@")[0]
+    return "message"
+
+async def middleware(handler, update, data):
+    # registered as dp.update outer middleware; samples whole updates
+    global _sampled
+    if SAMPLE <= 0 or random.random() >= SAMPLE:
+        return await handler(update, data)
+    message = update.message
+    trace = Trace(_kind(message), message.chat.id if message else None, update.update_id)
+    token = _current.set(trace)
+    try:
+        return await handler(update, data)
+    finally:
+        _current.reset(token)
+        trace.seconds = time.perf_counter() - trace.t0
+        with _lock:
+            _done.append(trace)
+            _sampled += 1
+
+def slowest(limit: int = 20, kind: str = None) -> list:
+    with _lock:
+        traces = [t for t in _done if kind is None or t.kind == kind]
+    traces.sort(key=lambda t: t.seconds, reverse=True)
+    return [t.as_dict() for t in traces[:limit]]
+
+def stats() -> dict:
+    return {"sample": SAMPLE, "sampled": _sampled, "kept": len(_done)}
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Offline training for CLASSIFIER_MODE=model. Expects a folder of labeled clips:
+#   DATA/fart/*   positives     DATA/other/*   negatives
+# (any format ffmpeg reads: .ogg voice notes, .m4a, .wav). Clips are decoded
+# and turned into log-mel statistics exactly as at inference, then a logistic
+# regression (--hidden 0) or a one-hidden-layer MLP is fit with full-batch Adam
+# and saved as a compact .npz together with the feature parameters and the
+# decision threshold that maximizes F1 on the held-out split.
+#
+#   python train_model.py DATA --out models/fart.npz [--hidden 0] [--sr 8000]
+import argparse, json, os, sys, time
+import numpy as np
+
+from audio_classifier import decode_to_array
+from features import LogMelExtractor, normalize
+
+LABELS = {"fart": 1, "other": 0}
+
+def load_folder(root: str, sr: int, max_seconds: float):
+    paths, ys = [], []
+    for name, label in LABELS.items():
+        d = os.path.join(root, name)
+        if not os.path.isdir(d):
+            raise SystemExit(f"missing {d}/ (expected {'/ and '.join(LABELS)}/ subfolders)")
+        for fn in sorted(os.listdir(d)):
+            if not fn.startswith("."):
+                paths.append(os.path.join(d, fn))
+                ys.append(label)
+    clips, labels = [], []
+    for path, label in zip(paths, ys):
+        try:
+            with open(path, "rb") as f:
+                y = decode_to_array(f.read(), target_sr=sr)
+        except (OSError, RuntimeError) as e:
+            print(f"skip {path}: {e}", file=sys.stderr)
+            continue
+        if len(y) < sr // 2:
+            continue  # the classifier answers too_short without looking at it
+        clips.append(normalize(y[:int(max_seconds * sr)]))
+        labels.append(label)
+    return clips, np.asarray(labels, dtype=np.float32)
+
+def _forward(params, x):
+    if "w1" in params:
+        h = np.maximum(x @ params["w1"] + params["b1"], 0.0)
+    else:
+        h = x
+    return h, 1.0 / (1.0 + np.exp(-(h @ params["w"] + params["b"])))
+
+def fit(x, y, hidden: int = 0, epochs: int = 500, lr: float = 0.01, l2: float = 1e-3, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    d = x.shape[1]
+    params = {}
+    if hidden:
+        params["w1"] = rng.standard_normal((d, hidden)) * np.sqrt(2.0 / d)
+        params["b1"] = np.zeros(hidden)
+        params["w"] = rng.standard_normal(hidden) * np.sqrt(1.0 / hidden)
+    else:
+        params["w"] = np.zeros(d)
+    params["b"] = np.zeros(())
+    # balance the classes so a skewed folder does not just learn the prior
+    pos = max(1.0, y.sum())
+    neg = max(1.0, len(y) - y.sum())
+    sw = np.where(y > 0, len(y) / (2 * pos), len(y) / (2 * neg)) / len(y)
+    m = {k: np.zeros_like(v) for k, v in params.items()}
+    v = {k: np.zeros_like(v) for k, v in params.items()}
+    for t in range(1, epochs + 1):
+        h, p = _forward(params, x)
+        g = (p - y) * sw
+        grads = {"w": h.T @ g + l2 * params["w"], "b": g.sum()}
+        if hidden:
+            gh = np.outer(g, params["w"]) * (h > 0)
+            grads["w1"] = x.T @ gh + l2 * params["w1"]
+            grads["b1"] = gh.sum(axis=0)
+        for k in params:
+            m[k] = 0.9 * m[k] + 0.1 * grads[k]
+            v[k] = 0.999 * v[k] + 0.001 * grads[k] ** 2
+            params[k] = params[k] - lr * (m[k] / (1 - 0.9 ** t)) / (np.sqrt(v[k] / (1 - 0.999 ** t)) + 1e-8)
+    return params
+
+def scores(p, y, threshold: float) -> dict:
+    pred = p >= threshold
+    tp = float(np.sum(pred & (y > 0)))
+    fp = float(np.sum(pred & (y == 0)))
+    fn = float(np.sum(~pred & (y > 0)))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"threshold": round(threshold, 3), "precision": round(precision, 4), "recall": round(recall, 4),
+            "f1": round(f1, 4), "accuracy": round(float(np.mean(pred == (y > 0))), 4)}
+
+def best_threshold(p, y) -> float:
+    grid = np.round(np.arange(0.2, 0.91, 0.01), 2)
+    return float(max(grid, key=lambda t: (scores(p, y, t)["f1"], -abs(t - 0.5))))
+
+def train(root: str, out: str, sr: int = 8000, n_mels: int = 32, fmin: float = 20.0, fmax: float = 4000.0,
+          hidden: int = 0, epochs: int = 500, lr: float = 0.01, l2: float = 1e-3, val: float = 0.2,
+          max_seconds: float = 12.0, seed: int = 0) -> dict:
+    t0 = time.perf_counter()
+    clips, y = load_folder(root, sr, max_seconds)
+    if len(set(y.tolist())) < 2:
+        raise SystemExit("need clips in both fart/ and other/")
+    ext = LogMelExtractor(sr, n_mels, fmin, fmax)
+    x = np.concatenate([ext.extract_batch(clips[i:i + 32]) for i in range(0, len(clips), 32)]).astype(np.float64)
+    idx = np.random.default_rng(seed).permutation(len(y))
+    n_val = int(len(y) * val) if len(y) >= 10 else 0
+    va, tr = idx[:n_val], idx[n_val:]
+    mu = x[tr].mean(axis=0)
+    sigma = x[tr].std(axis=0) + 1e-6
+    z = (x - mu) / sigma
+    params = fit(z[tr], y[tr], hidden, epochs, lr, l2, seed)
+    held = va if n_val else tr
+    p = _forward(params, z[held])[1]
+    threshold = best_threshold(p, y[held])
+    report = {"clips": len(y), "positives": int(y.sum()), "train": len(tr), "val": n_val,
+              "model": f"mlp{hidden}" if hidden else "logreg", "features": ext.dim,
+              "val_at_threshold": scores(p, y[held], threshold),
+              "val_at_0.55": scores(p, y[held], 0.55)}
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    arrays = {k: np.asarray(v, dtype=np.float32) for k, v in params.items()}
+    np.savez_compressed(out, format=np.int32(1), sr=np.int32(sr), n_mels=np.int32(n_mels),
+                        fmin=np.float32(fmin), fmax=np.float32(fmax), mu=mu.astype(np.float32),
+                        sigma=sigma.astype(np.float32), threshold=np.float32(threshold),
+                        info=np.asarray(json.dumps(report)), **arrays)
+    report["path"] = out
+    report["bytes"] = os.path.getsize(out)
+    report["seconds"] = round(time.perf_counter() - t0, 2)
+    return report
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Train the model-mode classifier from a labeled clip folder")
+    ap.add_argument("data", help="folder with fart/ and other/ subfolders")
+    ap.add_argument("--out", default=os.environ.get("MODEL_PATH", "./models/fart.npz"))
+    ap.add_argument("--sr", type=int, default=8000, help="feature sample rate (8000 decodes straight to 8 kHz)")
+    ap.add_argument("--n-mels", type=int, default=32)
+    ap.add_argument("--fmin", type=float, default=20.0)
+    ap.add_argument("--fmax", type=float, default=4000.0)
+    ap.add_argument("--hidden", type=int, default=0, help="hidden units; 0 = logistic regression")
+    ap.add_argument("--epochs", type=int, default=500)
+    ap.add_argument("--lr", type=float, default=0.01)
+    ap.add_argument("--l2", type=float, default=1e-3)
+    ap.add_argument("--val", type=float, default=0.2, help="held-out share for the threshold and the report")
+    ap.add_argument("--max-seconds", type=float, default=float(os.environ.get("MAX_VOICE_SECONDS", "12")))
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    report = train(args.data, args.out, args.sr, args.n_mels, args.fmin, args.fmax, args.hidden, args.epochs,
+                   args.lr, args.l2, args.val, args.max_seconds, args.seed)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# In-process directory of known chat members: (chat_id, user_id) -> the names
+# last written to `users`. db.py consults it before touching SQLite, so a
+# member who speaks again with the same names costs no write, only real name
+# changes are upserted, and /top renders names without an IN (...) query.
+# Entries are only added after the transaction that wrote them commits (or
+# from rows read back from the table), so a hit always means both the `users`
+# and the `stats` row exist. Bounded LRU; evicted members are reloaded lazily.
+import threading
+from collections import OrderedDict
+
+class UserDirectory:
+    def __init__(self, max_users: int = 50000):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int, user_id: int):
+        # -> (username, first_name, last_name) or None
+        with self._lock:
+            names = self._users.get((chat_id, user_id))
+            if names is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._users.move_to_end((chat_id, user_id))
+            return names
+
+    def put(self, chat_id: int, user_id: int, names: tuple):
+        with self._lock:
+            self._users[(chat_id, user_id)] = names
+            self._users.move_to_end((chat_id, user_id))
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def lookup(self, chat_id: int, user_ids):
+        # -> ({user_id: names} for the known ones, [missing user_ids])
+        found, missing = {}, []
+        with self._lock:
+            for uid in user_ids:
+                names = self._users.get((chat_id, uid))
+                if names is None:
+                    missing.append(uid)
+                else:
+                    found[uid] = names
+                    self._users.move_to_end((chat_id, uid))
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._users), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._users)
@@ -1,39 +1,79 @@
 # -*- coding: utf-8 -*-
 # Web Service entrypoint for Render Free plan: exposes HTTP port and runs Telegram bot polling in background.
-import os, asyncio
+import os, asyncio, time, importlib
+STARTED = time.monotonic()
+from dotenv import load_dotenv
+# before any project import: most modules read their settings at import time
+load_dotenv()
 from aiohttp import web
 
-from db import init_db
-from bot import dp, bot, acquire_singleton_lock
+import admin_http, metrics
+
+# `bot` (and with it aiogram) is imported in the background after the port is
+# bound: on a cold instance that import is most of the start-up time
+_bot = None
+_tasks = {}
+
+async def _boot():
+    global _bot
+    _bot = await asyncio.to_thread(importlib.import_module, "bot")
+    _bot.acquire_singleton_lock()
+    await _bot.startup()
+    print(f"Bot loaded in {time.monotonic() - STARTED:.2f}s")
+    # aiohttp owns SIGINT/SIGTERM: with aiogram's handlers a SIGTERM only stopped
+    # polling and the web app kept the process alive until it was killed
+    _tasks['poller'] = asyncio.create_task(_bot.dp.start_polling(_bot.bot, allowed_updates=["message"],
+                                                                  handle_signals=False))
 
 async def start_polling(app: web.Application):
-    acquire_singleton_lock()
-    init_db()
-    app['poller'] = asyncio.create_task(dp.start_polling(bot, allowed_updates=["message"]))
+    _tasks['boot'] = asyncio.create_task(_boot())
 
 async def stop_polling(app: web.Application):
-    task = app.get('poller')
-    if task:
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
+    for key in ('boot', 'poller'):
+        task = _tasks.get(key)
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    if _bot is None:
+        return
+    await _bot.shutdown()
     try:
-        await bot.session.close()
+        await _bot.bot.session.close()
     except Exception:
         pass
 
+def is_ready() -> bool:
+    return _bot is not None and _bot.is_ready()
+
 async def handle_root(request):
     return web.Response(text="fartbot alive")
 
 async def handle_health(request):
-    return web.Response(text="ok")
+    # liveness: always 200 while the process serves HTTP; readiness is reported separately
+    return web.json_response({"live": True, "ready": is_ready(), "uptime": round(time.monotonic() - STARTED, 1)})
+
+async def handle_ready(request):
+    if is_ready():
+        return web.Response(text="ready")
+    return web.Response(status=503, text="warming up")
+
+async def handle_metrics(request):
+    body = metrics.render()
+    if body is None:
+        raise web.HTTPNotFound()
+    return web.Response(body=body.encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
 def main():
     app = web.Application()
     app.router.add_get("/", handle_root)
     app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+    admin_http.add_routes(app)
     app.on_startup.append(start_polling)
     app.on_cleanup.append(stop_polling)
 
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 # Webhook entrypoint (fixed) for aiogram 3.x + Render Free.
-import os, asyncio
+import os, asyncio, time, importlib
+STARTED = time.monotonic()
+from dotenv import load_dotenv
+# before any project import: most modules read their settings at import time
+load_dotenv()
 from aiohttp import web
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from db import init_db
-from bot import dp, bot, acquire_singleton_lock
+import admin_http, metrics
+
+# `bot` (and with it aiogram) is imported in the background after the port is
+# bound: on a cold instance that import is most of the start-up time.
+# Until it is loaded /webhook answers 503 and Telegram retries the delivery.
+_bot = None
+_tasks = {}
+_inflight = set()  # updates acknowledged to Telegram and still being processed
 
 def _infer_public_url():
     url = os.environ.get("WEBHOOK_URL")
@@ -17,9 +26,7 @@ def _infer_public_url():
     port = int(os.environ.get("PORT", "10000"))
     return f"http://0.0.0.0:{port}"
 
-async def on_startup(app: web.Application):
-    acquire_singleton_lock()
-    init_db()
+async def register_webhook(bot):
     public = _infer_public_url()
     webhook_url = public + "/webhook"
     try:
@@ -29,30 +36,95 @@ async def on_startup(app: web.Application):
     except Exception as e:
         print("Failed to set webhook:", e)
 
+async def _boot(app: web.Application):
+    global _bot
+    mod = await asyncio.to_thread(importlib.import_module, "bot")
+    mod.acquire_singleton_lock()
+    await mod.startup()
+    await mod.dp.emit_startup(app=app, dispatcher=mod.dp, bot=mod.bot, **mod.dp.workflow_data)
+    _bot = mod
+    print(f"Bot loaded in {time.monotonic() - STARTED:.2f}s")
+    await register_webhook(mod.bot)
+
+async def on_startup(app: web.Application):
+    _tasks['boot'] = asyncio.create_task(_boot(app))
+
 async def on_cleanup(app: web.Application):
+    task = _tasks.get('boot')
+    if task and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if _bot is None:
+        return
+    if _inflight:
+        # let acknowledged updates finish before the pools are torn down
+        await asyncio.wait(list(_inflight), timeout=10)
     try:
-        await bot.delete_webhook()
+        await _bot.bot.delete_webhook()
     except Exception:
         pass
+    await _bot.dp.emit_shutdown(app=app, dispatcher=_bot.dp, bot=_bot.bot, **_bot.dp.workflow_data)
+    await _bot.shutdown()
     try:
-        await bot.session.close()
+        await _bot.bot.session.close()
     except Exception:
         pass
 
+def is_ready() -> bool:
+    return _bot is not None and _bot.is_ready()
+
+async def _feed(update: dict):
+    try:
+        await _bot.dp.feed_raw_update(_bot.bot, update)
+    except Exception as e:
+        print("Update failed:", repr(e))
+
+async def handle_webhook(request):
+    # answers Telegram at once and processes the update in the background, so a
+    # slow clip never delays the response past Telegram's timeout (and a
+    # redelivery that does happen is dropped by dedup.py)
+    if _bot is None:
+        return web.Response(status=503, text="starting")
+    try:
+        update = await request.json()
+    except ValueError:
+        return web.Response(status=400, text="bad update")
+    task = asyncio.create_task(_feed(update))
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+    return web.json_response({})
+
 async def handle_root(request):
     return web.Response(text="fartbot (webhook) alive")
 
 async def handle_health(request):
-    return web.Response(text="ok")
+    # liveness: always 200 while the process serves HTTP; readiness is reported separately
+    return web.json_response({"live": True, "ready": is_ready(), "uptime": round(time.monotonic() - STARTED, 1)})
+
+async def handle_ready(request):
+    if is_ready():
+        return web.Response(text="ready")
+    return web.Response(status=503, text="warming up")
+
+async def handle_metrics(request):
+    body = metrics.render()
+    if body is None:
+        raise web.HTTPNotFound()
+    return web.Response(body=body.encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
 def main():
     app = web.Application()
     app.router.add_get("/", handle_root)
     app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+    admin_http.add_routes(app)
 
-    # ✅ aiogram 3.x compatible webhook registration
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path="/webhook")
-    setup_application(app, dp, bot=bot)
+    app.router.add_post("/webhook", handle_webhook)
 
     app.on_startup.append(on_startup)
     app.on_cleanup.append(on_cleanup)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Optional write-behind for the append-only log tables (events, audit_log).
+# Rows are queued and committed in groups by a background task, so a burst of
+# detections costs one fsync per batch instead of one per clip. Counters in
+# `stats` / `daily_totals` are still written synchronously and stay authoritative.
+import asyncio, os, time
+
+import db
+
+class WriteBehind:
+    def __init__(self, batch_size: int = 200, interval_ms: int = 250, max_queue: int = 20000,
+                 retries: int = 3):
+        self.batch_size = max(1, batch_size)
+        self.retries = max(0, retries)
+        self.interval = max(1, interval_ms) / 1000.0
+        self.max_queue = max_queue
+        self._queue = None
+        self._loop = None
+        self._task = None
+        self._closing = False
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.overflow = 0
+        self.retried = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._last_report = time.monotonic()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        db.set_log_sink(self)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def accepting(self) -> bool:
+        # asked by db worker threads; False makes db.py insert the row itself
+        if self._closing or self._loop is None or self.depth() >= self.max_queue:
+            self.overflow += 1
+            return False
+        return True
+
+    def submit(self, table: str, row: tuple):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (table, row))
+
+    async def _run(self):
+        # a None item is the shutdown sentinel: flush what we have and exit
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = self._loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    await self._flush(batch)
+                    return
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        events = [row for table, row in batch if table == "events"]
+        audits = [row for table, row in batch if table == "audit_log"]
+        t0 = time.perf_counter()
+        dropped = 0
+        # a busy or locked database usually clears: retry the whole batch with
+        # backoff, then insert row by row so one bad row only loses itself
+        for attempt in range(self.retries + 1):
+            try:
+                await db.run(db.insert_log_rows, events, audits)
+                break
+            except Exception as e:
+                print(f"write-behind flush failed (attempt {attempt + 1}):", e)
+                if attempt < self.retries:
+                    self.retried += 1
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+        else:
+            dropped = await self._flush_rows(events, audits)
+        ms = (time.perf_counter() - t0) * 1000
+        self.flushes += 1
+        self.rows_flushed += len(batch) - dropped
+        self.last_flush_ms = ms
+        self.max_flush_ms = max(self.max_flush_ms, ms)
+        self.total_flush_ms += ms
+        if time.monotonic() - self._last_report >= 60:
+            self._last_report = time.monotonic()
+            print(f"write-behind: depth={self.depth()} flushes={self.flushes} rows={self.rows_flushed} "
+                  f"avg={self.total_flush_ms / self.flushes:.1f}ms max={self.max_flush_ms:.1f}ms overflow={self.overflow} "
+                  f"dropped={self.dropped}")
+
+    async def _flush_rows(self, events, audits) -> int:
+        dropped = 0
+        for table, rows in (("events", events), ("audit_log", audits)):
+            for row in rows:
+                try:
+                    await db.run(db.insert_log_rows, [row] if table == "events" else [],
+                                 [row] if table == "audit_log" else [])
+                except Exception as e:
+                    dropped += 1
+                    print(f"write-behind dropped a row of {table}:", e)
+        self.dropped += dropped
+        return dropped
+
+    async def stop(self):
+        self._closing = True
+        db.set_log_sink(None)
+        if self._task is None:
+            return
+        await asyncio.sleep(0)  # let already-scheduled submits land before the sentinel
+        self._queue.put_nowait(None)
+        await self._task
+        await asyncio.sleep(0)
+        batch = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+        if batch:
+            await self._flush(batch)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "overflow": self.overflow,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
+
+_instance = None
+
+def start(cfg: dict = None):
+    # WRITE_BEHIND=1 enables it; WRITE_BEHIND_BATCH rows / WRITE_BEHIND_MS per group commit
+    global _instance
+    cfg = cfg or os.environ
+    if _instance is not None or cfg.get("WRITE_BEHIND", "0") in ("0", "", "false", "no"):
+        return _instance
+    _instance = WriteBehind(batch_size=int(cfg.get("WRITE_BEHIND_BATCH", "200")),
+                            interval_ms=int(cfg.get("WRITE_BEHIND_MS", "250")),
+                            max_queue=int(cfg.get("WRITE_BEHIND_MAX_QUEUE", "20000")))
+    _instance.start()
+    return _instance
+
+async def stop():
+    global _instance
+    wb, _instance = _instance, None
+    if wb is not None:
+        await wb.stop()
+
+def stats():
+    return _instance.stats() if _instance is not None else None